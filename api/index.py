@@ -19,8 +19,11 @@ from langchain_core.messages import HumanMessage, AIMessage
 
 # Import our custom modules
 try:
-    from tools import tools, convert_text_to_speech, process_uploaded_file, convert_speech_to_text
+    from tools import convert_text_to_speech, process_uploaded_file, convert_speech_to_text
     from schema import SymptomResponse, ChatRequest
+    from session_store import create_session_store
+    from chat_history import create_history_window
+    from consultation import create_consultation_chain, consult, log_consultation, response_text as consultation_text
 except ImportError:
     # Fallback imports for Vercel
     import importlib.util
@@ -35,12 +38,32 @@ except ImportError:
     schema_module = importlib.util.module_from_spec(schema_spec)
     schema_spec.loader.exec_module(schema_module)
     
-    tools = tools_module.tools
     convert_text_to_speech = tools_module.convert_text_to_speech
     process_uploaded_file = tools_module.process_uploaded_file
     convert_speech_to_text = tools_module.convert_speech_to_text
     SymptomResponse = schema_module.SymptomResponse
     ChatRequest = schema_module.ChatRequest
+    
+    # Load session store module
+    session_store_spec = importlib.util.spec_from_file_location("session_store", os.path.join(os.path.dirname(os.path.dirname(__file__)), "session_store.py"))
+    session_store_module = importlib.util.module_from_spec(session_store_spec)
+    session_store_spec.loader.exec_module(session_store_module)
+    create_session_store = session_store_module.create_session_store
+    
+    # Load chat history module
+    chat_history_spec = importlib.util.spec_from_file_location("chat_history", os.path.join(os.path.dirname(os.path.dirname(__file__)), "chat_history.py"))
+    chat_history_module = importlib.util.module_from_spec(chat_history_spec)
+    chat_history_spec.loader.exec_module(chat_history_module)
+    create_history_window = chat_history_module.create_history_window
+    
+    # Load consultation module
+    consultation_spec = importlib.util.spec_from_file_location("consultation", os.path.join(os.path.dirname(os.path.dirname(__file__)), "consultation.py"))
+    consultation_module = importlib.util.module_from_spec(consultation_spec)
+    consultation_spec.loader.exec_module(consultation_module)
+    create_consultation_chain = consultation_module.create_consultation_chain
+    consult = consultation_module.consult
+    log_consultation = consultation_module.log_consultation
+    consultation_text = consultation_module.response_text
 
 SYSTEM_PROMPT = """
 You are a helpful medical assistant for a General Practitioner clinic. You do NOT give diagnoses.
@@ -55,11 +78,16 @@ IMPORTANT:
 - Always be cautious and refer to doctors when unclear
 - Never provide definitive diagnoses
 - Always recommend consulting healthcare professionals for proper medical advice
-- Call the log_symptom_entry tool to record the consultation
 
 Respond in a helpful, professional manner while being clear about limitations.
 """
 
+# The agent logs through its tool; the structured path logs server-side
+AGENT_PROMPT = SYSTEM_PROMPT + "\nCall the log_symptom_entry tool to record the consultation.\n"
+
+# structured (default): one schema-constrained call; agent: tool-calling loop
+CHAT_MODE = os.getenv('CHAT_MODE', 'structured').lower()
+
 # Gemini LLM Setup
 llm = ChatGoogleGenerativeAI(
     model="gemini-1.5-flash",
@@ -70,17 +98,25 @@ llm = ChatGoogleGenerativeAI(
 # JSON Output Parser
 parser = PydanticOutputParser(pydantic_object=SymptomResponse)
 
-# Prompt Template
-prompt = ChatPromptTemplate.from_messages([
-    ("system", SYSTEM_PROMPT),
-    ("placeholder", "{chat_history}"),
-    ("human", "{query}"),
-    ("placeholder", "{agent_scratchpad}")
-])
+# Single-call consultation chain
+consultation_chain = create_consultation_chain(llm, SYSTEM_PROMPT)
 
-# Agent & Executor
-agent = create_tool_calling_agent(llm=llm, prompt=prompt, tools=tools)
-executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
+# Agent & Executor (opt-in, for real tool use)
+executor = None
+if CHAT_MODE == 'agent':
+    try:
+        from tools import tools
+    except ImportError:
+        tools = tools_module.tools
+    
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", AGENT_PROMPT),
+        ("placeholder", "{chat_history}"),
+        ("human", "{query}"),
+        ("placeholder", "{agent_scratchpad}")
+    ])
+    agent = create_tool_calling_agent(llm=llm, prompt=prompt, tools=tools)
+    executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
 
 # Flask App Setup
 app = Flask(__name__, template_folder='../templates')
@@ -96,8 +132,11 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs('/tmp/audio', exist_ok=True)
 
-# Chat Session Storage (in-memory for serverless)
-chat_sessions = {}
+# Chat Session Storage (in-memory for serverless, bounded like the other apps)
+chat_sessions = create_session_store()
+
+# Prompt history: recent turns verbatim, older turns folded into a per-session summary
+history_window = create_history_window(llm)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -168,35 +207,50 @@ def chat():
         # Combine query with file context
         full_query = f"{query}\n{file_context}" if file_context else query
         
-        if session_id not in chat_sessions:
-            chat_sessions[session_id] = []
-        
-        chat_history = chat_sessions[session_id]
-        chat_history.append(HumanMessage(content=full_query))
-        
-        result = executor.invoke({
-            "query": full_query,
-            "chat_history": chat_history
-        })
-        
-        # Extract the response text
-        response_text = result.get("output", "")
-        chat_history.append(AIMessage(content=response_text))
+        # Earlier turns only; the new message goes in once, as the query
+        system_prompt = AGENT_PROMPT if executor else SYSTEM_PROMPT
+        chat_history, history_info = history_window.prepare(chat_sessions, session_id, system_prompt, full_query)
         
-        # Try to parse structured response, fallback to simple response
-        try:
-            # Try to parse as structured JSON
-            response = parser.parse(response_text)
+        if executor:
+            result = executor.invoke({
+                "query": full_query,
+                "chat_history": chat_history
+            })
+            
+            # Extract the response text
+            response_text = result.get("output", "")
+            
+            # Try to parse structured response, fallback to simple response
+            try:
+                # Try to parse as structured JSON
+                response = parser.parse(response_text)
+                probable_cause = response.probable_cause
+                severity = response.severity
+                advice = response.advice
+                log_status = response.log_status
+            except:
+                # Fallback: create a simple structured response
+                probable_cause = response_text
+                severity = "moderate"  # Default severity
+                advice = "Please consult with a healthcare professional for proper evaluation and treatment."
+                log_status = "Consultation logged"
+        else:
+            try:
+                response = consult(consultation_chain, full_query, chat_history)
+            except Exception as e:
+                print(f"⚠️ Structured consultation failed: {e}")
+                response = SymptomResponse(
+                    probable_cause="I understand you have health concerns, but I could not assess them right now.",
+                    severity="moderate",
+                    advice="Please consult with a healthcare professional for proper evaluation and treatment."
+                )
             probable_cause = response.probable_cause
             severity = response.severity
             advice = response.advice
-            log_status = response.log_status
-        except:
-            # Fallback: create a simple structured response
-            probable_cause = response_text
-            severity = "moderate"  # Default severity
-            advice = "Please consult with a healthcare professional for proper evaluation and treatment."
-            log_status = "Consultation logged"
+            log_status = log_consultation(session_id, full_query, response)
+            response_text = consultation_text(response)
+        
+        chat_sessions.append(session_id, HumanMessage(content=full_query), AIMessage(content=response_text))
         
         # Generate audio response (simplified for serverless)
         audio_path = None
@@ -213,7 +267,11 @@ def chat():
                 'severity': severity,
                 'advice': advice,
                 'log_status': log_status,
-                'audio_response': audio_path if audio_path and not audio_path.startswith('Error') else None
+                'audio_response': audio_path if audio_path and not audio_path.startswith('Error') else None,
+                'prompt_tokens': history_info['prompt_tokens'],
+                'history_messages': history_info['history_messages'],
+                'summarized_messages': history_info['summarized_messages'],
+                'mode': 'agent' if executor else 'structured'
             }
         })
             
@@ -223,6 +281,11 @@ def chat():
             'error': str(e)
         })
 
+@app.route('/api/sessions/status')
+def sessions_status():
+    """Chat session store size and eviction counts"""
+    return jsonify(chat_sessions.get_statistics())
+
 @app.route('/api/audio/<path:filename>')
 def serve_audio(filename):
     try:
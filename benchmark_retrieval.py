@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Retrieval benchmark for the RAG system
+Generates synthetic medical-like corpora, then measures build time, index size,
+query latency percentiles, QPS and recall@k against exact search for every
+index type, and end-to-end retrieval latency of MedicalRAGSystem per retrieval mode.
+Runs offline with a deterministic hashing embedder; results are written as JSON lines.
+
+Usage: python benchmark_retrieval.py [--sizes 1000,10000,100000] [--index-types flat,hnsw]
+                                     [--embedder hash|model] [--output bench.jsonl]
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+try:
+    from langchain_core.embeddings import Embeddings
+except ImportError:
+    Embeddings = object
+
+from vector_index import INDEX_TYPES, get_index_settings, create_index, apply_search_params
+
+SYMPTOMS = ["headache", "fever", "cough", "nausea", "fatigue", "dizziness", "rash", "sore throat", "chest pain",
+            "back pain", "shortness of breath", "abdominal pain", "swelling", "itching", "chills", "insomnia",
+            "vomiting", "diarrhea", "congestion", "joint pain", "numbness", "palpitations", "wheezing", "cramps"]
+BODY_PARTS = ["head", "throat", "chest", "abdomen", "back", "skin", "joints", "lungs", "stomach", "eyes", "ears",
+              "knee", "ankle", "wrist", "neck", "shoulder", "heart", "kidneys", "liver", "sinuses"]
+CAUSES = ["viral infection", "bacterial infection", "allergy", "dehydration", "stress", "injury", "migraine",
+          "inflammation", "poor sleep", "food poisoning", "influenza", "asthma", "arthritis", "anemia", "sprain"]
+TREATMENTS = ["rest", "fluids", "ibuprofen", "acetaminophen", "antihistamines", "cold compress", "warm compress",
+              "saline rinse", "antibiotics", "inhaler", "elevation", "stretching", "oral rehydration", "honey"]
+ADVICE = ["see a doctor if symptoms persist", "seek emergency care if severe", "monitor for three days",
+          "avoid strenuous activity", "follow dosing instructions", "keep a symptom diary", "stay home from work"]
+CATEGORIES = ["symptoms", "first_aid", "prevention", "medications"]
+
+def generate_corpus(n_chunks: int, seed: int = 0) -> List[Dict]:
+    """Synthetic knowledge base entries, each short enough to be a single chunk"""
+    rng = np.random.default_rng(seed)
+    entries = []
+    for i in range(n_chunks):
+        symptom, part, cause = rng.choice(SYMPTOMS), rng.choice(BODY_PARTS), rng.choice(CAUSES)
+        treatment, advice = rng.choice(TREATMENTS, 2, replace=False), rng.choice(ADVICE)
+        entries.append({
+            "category": CATEGORIES[i % len(CATEGORIES)],
+            "title": f"{symptom.title()} of the {part} #{i}",
+            "content": (f"{symptom.capitalize()} affecting the {part} is often caused by {cause}. "
+                        f"Treatment includes {treatment[0]} and {treatment[1]}; {advice}. Case {i}.")
+        })
+    return entries
+
+def generate_queries(n_queries: int, seed: int = 1) -> List[str]:
+    rng = np.random.default_rng(seed)
+    return [f"{rng.choice(SYMPTOMS)} in my {rng.choice(BODY_PARTS)}, could it be {rng.choice(CAUSES)}? "
+            f"should I take {rng.choice(TREATMENTS)}" for _ in range(n_queries)]
+
+class HashingEmbeddings(Embeddings):
+    """Deterministic offline stand-in for the embedding model
+
+    Each word maps to a fixed pseudo-random vector derived from its hash; a text
+    is the normalized sum of its words, so texts sharing words are close.
+    """
+
+    def __init__(self, size: int = 384):
+        self.size = size
+        self.word_vectors: Dict[str, np.ndarray] = {}
+
+    @property
+    def index_model_name(self) -> str:
+        return f"hashing-{self.size}"
+
+    def _word_vector(self, word: str) -> np.ndarray:
+        vector = self.word_vectors.get(word)
+        if vector is None:
+            seed = int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'little')
+            vector = np.random.default_rng(seed).standard_normal(self.size).astype(np.float32)
+            self.word_vectors[word] = vector
+        return vector
+
+    def embed_array(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.size), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in text.lower().replace(",", " ").replace(".", " ").replace(";", " ").split():
+                vectors[i] += self._word_vector(word)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_array([text])[0].tolist()
+
+def percentiles(latencies_ms: List[float]) -> Dict:
+    values = np.asarray(latencies_ms)
+    return {f"p{p}_ms": round(float(np.percentile(values, p)), 3) for p in (50, 95, 99)}
+
+def index_size_mb(index) -> float:
+    import faiss
+    return round(len(faiss.serialize_index(index)) / (1024 * 1024), 2)
+
+def recall_at_k(vectors: np.ndarray, queries: np.ndarray, found: np.ndarray, exact_distances: np.ndarray) -> float:
+    """Fraction of returned neighbours that are as close as the exact k-th neighbour
+
+    Templated corpora have many equidistant chunks, so matching ids exactly
+    would count an equally good neighbour as a miss.
+    """
+    hits = 0
+    for query, ids, distances in zip(queries, found, exact_distances):
+        ids = ids[ids >= 0]
+        true_distances = ((vectors[ids] - query) ** 2).sum(axis=1)
+        hits += int((true_distances <= distances[-1] * (1 + 1e-4) + 1e-6).sum())
+    return hits / found.size
+
+def benchmark_index(index_type: str, vectors: np.ndarray, queries: np.ndarray, exact_distances: np.ndarray,
+                    k: int, settings: Dict, search_params: Dict) -> Dict:
+    """Build one index type over the vectors and measure it against exact neighbours"""
+    started = time.perf_counter()
+    index, params = create_index(dict(settings, type=index_type), vectors)
+    index.add(vectors)
+    build_s = time.perf_counter() - started
+    params.update({key: value for key, value in search_params.items() if value})
+    apply_search_params(index, params)
+
+    latencies = []
+    found = np.zeros((len(queries), k), dtype=np.int64)
+    for i, query in enumerate(queries):
+        started = time.perf_counter()
+        found[i] = index.search(query[None, :], k)[1][0]
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    index.search(queries, k)
+    batch_s = time.perf_counter() - started
+
+    recall = recall_at_k(vectors, queries, found, exact_distances)
+    return dict({
+        "benchmark": "index",
+        "index_type": params["type"],
+        "requested_index_type": index_type,
+        "build_s": round(build_s, 3),
+        "index_mb": index_size_mb(index),
+        "qps": round(len(queries) / batch_s, 1) if batch_s else None,
+        "recall_at_k": round(float(recall), 4),
+        "params": {key: value for key, value in params.items() if key != "type"}
+    }, **percentiles(latencies))
+
+def benchmark_system(entries: List[Dict], queries: List[str], embeddings, k: int, index_type: str) -> List[Dict]:
+    """Build MedicalRAGSystem on the corpus and time retrieve_relevant_info per retrieval mode"""
+    from rag_system import MedicalRAGSystem
+    from knowledge_store import KnowledgeStore
+
+    results = []
+    with tempfile.TemporaryDirectory() as kb_path:
+        KnowledgeStore(kb_path).replace_all(entries)
+        previous = {name: os.environ.get(name)
+                    for name in ('RAG_INDEX_TYPE', 'RAG_EMBEDDING_CACHE', 'RAG_SNAPSHOT', 'RAG_CHUNK_DEDUP')}
+        # Templated entries look alike; index every one so the corpus has the requested size
+        os.environ.update({'RAG_INDEX_TYPE': index_type, 'RAG_EMBEDDING_CACHE': 'false', 'RAG_SNAPSHOT': '',
+                           'RAG_CHUNK_DEDUP': 'false'})
+        try:
+            started = time.perf_counter()
+            rag = MedicalRAGSystem(kb_path, embeddings=embeddings)
+            build_s = time.perf_counter() - started
+        finally:
+            for name, value in previous.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+        for mode in ("dense", "hybrid"):
+            rag.retrieval_mode = mode
+            rag.result_cache.clear()
+            rag.query_embedding_cache.clear()
+            latencies = []
+            started_all = time.perf_counter()
+            for query in queries:
+                started = time.perf_counter()
+                rag.retrieve_relevant_info(query, max_results=k, min_similarity=-1.0)
+                latencies.append((time.perf_counter() - started) * 1000)
+            total_s = time.perf_counter() - started_all
+            results.append(dict({
+                "benchmark": "system",
+                "index_type": rag.index_params["type"],
+                "requested_index_type": index_type,
+                "retrieval_mode": mode,
+                "build_s": round(build_s, 3),
+                "index_mb": index_size_mb(rag.vector_store.index),
+                "qps": round(len(queries) / total_s, 1) if total_s else None
+            }, **percentiles(latencies)))
+    return results
+
+def run_benchmarks(sizes: List[int], index_types: List[str], n_queries: int = 200, k: int = 10,
+                   embedder: str = "hash", dim: int = 384, system_max_size: int = 10000,
+                   search_params: Optional[Dict] = None, settings: Optional[Dict] = None) -> List[Dict]:
+    """Run every benchmark and return one result record per measurement"""
+    import faiss
+
+    if embedder == "hash":
+        embeddings = HashingEmbeddings(dim)
+        embed = embeddings.embed_array
+    else:
+        from rag_system import MedicalRAGSystem
+        model_holder = MedicalRAGSystem.__new__(MedicalRAGSystem)
+        model_holder.setup_embeddings()
+        embeddings = model_holder.embeddings
+        embed = lambda texts: np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+
+    settings = settings or get_index_settings()
+    search_params = search_params or {}
+    query_texts = generate_queries(n_queries)
+    query_vectors = np.ascontiguousarray(embed(query_texts), dtype=np.float32)
+    run_info = {"run": datetime.now().isoformat(), "commit": _git_commit(), "embedder": embedder, "k": k,
+                "queries": n_queries}
+
+    results = []
+    for size in sizes:
+        entries = generate_corpus(size)
+        started = time.perf_counter()
+        vectors = np.concatenate([embed([entry["content"] for entry in entries[start:start + 10000]])
+                                  for start in range(0, size, 10000)]).astype(np.float32)
+        embed_s = time.perf_counter() - started
+
+        # Ground truth from exact search
+        exact_index = faiss.IndexFlatL2(vectors.shape[1])
+        exact_index.add(vectors)
+        exact_distances = exact_index.search(query_vectors, k)[0]
+
+        for index_type in index_types:
+            result = benchmark_index(index_type, vectors, query_vectors, exact_distances, k, settings, search_params)
+            results.append(dict(run_info, chunks=size, dimensions=vectors.shape[1], embed_s=round(embed_s, 3), **result))
+            _print_result(results[-1])
+
+        if size <= system_max_size:
+            for index_type in index_types:
+                for result in benchmark_system(entries, query_texts, embeddings, min(k, 5), index_type):
+                    results.append(dict(run_info, chunks=size, dimensions=vectors.shape[1], **result))
+                    _print_result(results[-1])
+    return results
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def _print_result(result: Dict):
+    label = result["index_type"] + (f"/{result['retrieval_mode']}" if "retrieval_mode" in result else "")
+    recall = f"recall@{result['k']} {result['recall_at_k']:.3f}" if "recall_at_k" in result else "end-to-end"
+    print(f"   {result['chunks']:>8} chunks  {label:<16} build {result['build_s']:>8.2f}s  "
+          f"{result['index_mb']:>8.2f} MB  p50 {result['p50_ms']:.3f} ms  p99 {result['p99_ms']:.3f} ms  "
+          f"{result['qps']} qps  {recall}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark RAG retrieval on synthetic corpora")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Comma-separated corpus sizes in chunks")
+    parser.add_argument("--index-types", default=",".join(INDEX_TYPES), help="Comma-separated index types")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries per run")
+    parser.add_argument("-k", type=int, default=10, help="Neighbours per query for recall@k")
+    parser.add_argument("--embedder", choices=["hash", "model"], default="hash",
+                        help="hash: deterministic offline stand-in; model: the configured embedding backend")
+    parser.add_argument("--dim", type=int, default=384, help="Dimensions of the hashing embedder")
+    parser.add_argument("--nprobe", type=int, default=None, help="IVF lists probed per query")
+    parser.add_argument("--ef-search", type=int, default=None, help="HNSW search depth")
+    parser.add_argument("--system-max-size", type=int, default=10000,
+                        help="Largest corpus to also run through MedicalRAGSystem end to end")
+    parser.add_argument("--output", default=None, help="Append results as JSON lines to this file")
+    args = parser.parse_args()
+
+    print("📏 RAG retrieval benchmark")
+    print("=" * 50)
+    results = run_benchmarks([int(size) for size in args.sizes.split(",")], args.index_types.split(","),
+                             n_queries=args.queries, k=args.k, embedder=args.embedder, dim=args.dim,
+                             system_max_size=args.system_max_size,
+                             search_params={"nprobe": args.nprobe, "ef_search": args.ef_search})
+
+    if args.output:
+        with open(args.output, 'a', encoding='utf-8') as f:
+            f.write("".join(json.dumps(result) + "\n" for result in results))
+        print(f"✅ Wrote {len(results)} results to {args.output}")
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Bulk document ingestion for the RAG knowledge base
+Walks a directory of PDF/DOCX/TXT files, extracts text in a process pool,
+embeds chunks in large batches and writes the index at checkpoints
+
+Usage: python bulk_ingest.py DIRECTORY [--category uploaded_document] [--workers 4]
+"""
+
+import os
+import time
+import hashlib
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from vector_manifest import content_hash
+
+SUPPORTED_EXTENSIONS = ('.txt', '.pdf', '.docx')
+DEFAULT_CHECKPOINT_EVERY = 500
+
+def find_documents(directory: str) -> List[str]:
+    """Supported files below a directory, in a stable order"""
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    return paths
+
+def file_hash(path: str) -> str:
+    """SHA-256 of a file's bytes"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def extract_text(path: str) -> Tuple[str, Optional[str], Optional[str]]:
+    """Extract the text of one file, returning (path, text, error)"""
+    try:
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.pdf':
+            import PyPDF2
+            with open(path, 'rb') as f:
+                text = "\n".join(page.extract_text() or "" for page in PyPDF2.PdfReader(f).pages)
+        elif extension == '.docx':
+            from docx import Document
+            text = "\n".join(paragraph.text for paragraph in Document(path).paragraphs)
+        else:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                text = f.read()
+        return path, text, None
+    except Exception as e:
+        return path, None, str(e)
+
+def iter_extracted(paths: List[str], workers: int) -> Iterator[Tuple[str, Optional[str], Optional[str]]]:
+    """Extract files in a process pool, yielding results in order
+
+    Only a few files per worker are in flight, so extracted text never piles up
+    while the embedding step is slower than extraction.
+    """
+    if workers <= 1:
+        yield from map(extract_text, paths)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for path in paths:
+            in_flight.append(pool.submit(extract_text, path))
+            if len(in_flight) >= workers * 4:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+def ingest_directory(rag, directory: str, category: str = "uploaded_document", workers: Optional[int] = None,
+                     batch_size: int = 64, checkpoint_every: int = DEFAULT_CHECKPOINT_EVERY) -> Dict:
+    """Add every supported file below a directory to the knowledge base
+
+    Files already ingested are skipped by content, so an interrupted run can simply
+    be started again, and renamed or copied files are not added twice. A file is
+    matched by the hash of its bytes before extraction and of its text after it;
+    vectors embedded before an interruption come back from the embedding cache.
+    Every checkpoint_every documents (0 = only at the end) the knowledge base and
+    index are saved and the saved text is dropped from memory.
+    """
+    workers = workers or os.cpu_count() or 1
+    started = time.monotonic()
+    ingested_files = {document.metadata['source_hash'] for document in rag.documents
+                      if 'source_hash' in document.metadata}
+    ingested_texts = {content_hash(document.page_content) for document in rag.documents}
+
+    paths = []
+    source_hashes = {}
+    skipped = 0
+    for path in find_documents(directory):
+        source_hash = file_hash(path)
+        if source_hash in ingested_files:
+            skipped += 1
+        else:
+            ingested_files.add(source_hash)
+            source_hashes[path] = source_hash
+            paths.append(path)
+    print(f"📂 {len(paths)} files to ingest, {skipped} already in the knowledge base")
+
+    report = {"documents": 0, "chunks": 0, "near_duplicates": 0, "skipped": skipped, "failed": []}
+    chunks_before = len(rag.keyword_index)
+    duplicates_before = rag.get_statistics()["chunking"]["near_duplicates_left_out"]
+    batch = []
+    since_checkpoint = 0
+    released = len(rag.documents)
+
+    def flush():
+        nonlocal batch
+        if batch:
+            rag.add_medical_documents(batch, persist=False)
+            report["documents"] += len(batch)
+            elapsed = time.monotonic() - started
+            print(f"   {report['documents']}/{len(paths)} documents ({report['documents'] / elapsed:.1f} docs/sec)")
+            batch = []
+
+    for path, text, error in iter_extracted(paths, workers):
+        if error or not (text and text.strip()):
+            report["failed"].append({"path": path, "error": error or "no text extracted"})
+            continue
+        text_hash = content_hash(text)
+        if text_hash in ingested_texts:
+            report["skipped"] += 1
+            continue
+        ingested_texts.add(text_hash)
+
+        source_path = os.path.relpath(path, directory)
+        batch.append({
+            "category": category,
+            "title": f"Uploaded: {source_path}",
+            "content": text,
+            "source_path": source_path,
+            "source_hash": source_hashes[path],
+            "added_date": datetime.now().isoformat()
+        })
+        if len(batch) >= batch_size:
+            since_checkpoint += len(batch)
+            flush()
+            if checkpoint_every and since_checkpoint >= checkpoint_every:
+                # Saving clears the pending entries and reopens the chunk store without its overlay
+                rag.persist_knowledge(checkpoint=True)
+                released = rag.release_document_text(released)
+                since_checkpoint = 0
+
+    flush()
+    rag.persist_knowledge(checkpoint=True)
+
+    elapsed = time.monotonic() - started
+    report["chunks"] = len(rag.keyword_index) - chunks_before
+    report["near_duplicates"] = rag.get_statistics()["chunking"]["near_duplicates_left_out"] - duplicates_before
+    report["seconds"] = round(elapsed, 2)
+    report["docs_per_sec"] = round(report["documents"] / elapsed, 2) if elapsed else 0.0
+    report["chunks_per_sec"] = round(report["chunks"] / elapsed, 2) if elapsed else 0.0
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-ingest PDF/DOCX/TXT files into the medical knowledge base")
+    parser.add_argument("directory", help="Directory to walk for documents")
+    parser.add_argument("--knowledge-base", default="medical_knowledge", help="Knowledge base directory")
+    parser.add_argument("--category", default="uploaded_document", help="Category for the ingested documents")
+    parser.add_argument("--workers", type=int, default=None, help="Extraction processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv('RAG_INGEST_BATCH', '64')),
+                        help="Documents embedded per batch")
+    parser.add_argument("--checkpoint-every", type=int,
+                        default=int(os.getenv('RAG_INGEST_CHECKPOINT', str(DEFAULT_CHECKPOINT_EVERY))),
+                        help="Save the knowledge base after this many documents (0 = only at the end)")
+    args = parser.parse_args()
+
+    from rag_system import MedicalRAGSystem
+
+    print("🧠 Bulk ingestion into the medical knowledge base")
+    print("=" * 50)
+    rag = MedicalRAGSystem(args.knowledge_base)
+    report = ingest_directory(rag, args.directory, args.category, args.workers,
+                              args.batch_size, args.checkpoint_every)
+
+    print(f"\n✅ Ingested {report['documents']} documents ({report['chunks']} chunks) in {report['seconds']}s")
+    print(f"⚡ {report['docs_per_sec']} docs/sec, {report['chunks_per_sec']} chunks/sec")
+    if report["near_duplicates"]:
+        print(f"♻️ Left out {report['near_duplicates']} chunks that duplicate indexed ones")
+    if report["skipped"]:
+        print(f"⏭️ Skipped {report['skipped']} files already in the knowledge base")
+    for failure in report["failed"]:
+        print(f"❌ {failure['path']}: {failure['error']}")
+
+if __name__ == "__main__":
+    main()
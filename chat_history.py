@@ -0,0 +1,134 @@
+"""
+Token-budgeted chat history for the agent prompt
+Keeps the most recent turns verbatim and folds older ones into a rolling
+summary stored at the head of the session, so each turn is summarized once
+and every worker sharing the session store sees the same summary. The store
+never trims the summary away, and folding swaps only the messages that were
+summarized, so turns appended meanwhile by a parallel request survive
+"""
+
+import os
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.messages import SystemMessage
+
+from text_utils import estimate_tokens
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+def message_text(message: Any) -> str:
+    content = getattr(message, 'content', message)
+    return content if isinstance(content, str) else str(content)
+
+def is_summary(message: Any) -> bool:
+    return getattr(message, 'type', '') == 'system'
+
+def truncate_tokens(text: str, max_tokens: int, keep_end: bool = False) -> str:
+    """Cut text to roughly max_tokens at a word boundary, keeping its start (or end)"""
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    if keep_end:
+        return text[-max_chars:].split(' ', 1)[-1]
+    return text[:max_chars].rsplit(' ', 1)[0]
+
+def transcript(messages: List[Any]) -> str:
+    return "\n".join(
+        f"{'Patient' if getattr(m, 'type', 'human') == 'human' else 'Assistant'}: {message_text(m)}"
+        for m in messages
+    )
+
+def extractive_summary(previous: str, messages: List[Any], max_tokens: int) -> str:
+    """First sentence of each folded message appended to the previous summary, newest kept"""
+    parts = [previous] if previous else []
+    for message in messages:
+        first_sentence = re.split(r'(?<=[.!?])\s', message_text(message).strip(), maxsplit=1)[0]
+        role = 'Patient' if getattr(message, 'type', 'human') == 'human' else 'Assistant'
+        parts.append(f"{role}: {truncate_tokens(first_sentence, 50)}")
+    return truncate_tokens(" ".join(parts), max_tokens, keep_end=True)
+
+def create_llm_summarizer(llm, max_tokens: int = 300) -> Callable[[str, List[Any]], str]:
+    """Summarizer that asks the LLM to update the running summary, extractive on failure"""
+    def summarize(previous: str, messages: List[Any]) -> str:
+        request = (
+            "Update the running summary of a GP consultation with the new turns below. "
+            "Keep symptoms, their duration and severity, relevant history, medications and "
+            f"the advice already given. Answer with the summary only, at most {max_tokens * 3 // 4} words.\n\n"
+            f"Current summary: {previous or 'none'}\n\nNew turns:\n{transcript(messages)}"
+        )
+        try:
+            summary = message_text(llm.invoke(request)).strip()
+            if summary:
+                return truncate_tokens(summary, max_tokens)
+        except Exception as e:
+            print(f"⚠️ History summary failed ({e}), using an extractive summary")
+        return extractive_summary(previous, messages, max_tokens)
+    return summarize
+
+class HistoryWindow:
+    """Builds the chat_history passed to the agent within a token budget
+
+    The last keep_turns turns go in verbatim as long as they fit in
+    max_tokens; anything older is folded into the session's summary, which
+    replaces those messages in the store.
+    """
+
+    def __init__(self, summarize: Optional[Callable[[str, List[Any]], str]] = None,
+                 max_tokens: int = 1500, keep_turns: int = 4, summary_tokens: int = 300):
+        self.summary_tokens = summary_tokens
+        self.summarize = summarize or (lambda previous, messages: extractive_summary(previous, messages, summary_tokens))
+        self.max_tokens = max_tokens
+        self.keep_turns = keep_turns
+
+    def prepare(self, store, session_id: str, system_prompt: str, query: str) -> Tuple[List[Any], Dict]:
+        """Prompt history for the next turn and its estimated prompt token counts"""
+        history = store.get(session_id)
+        summary = ""
+        head = []
+        if history and is_summary(history[0]):
+            summary = message_text(history[0])
+            head, history = history[:1], history[1:]
+
+        # Newest messages first, until the turn limit or the budget left after the summary
+        budget = self.max_tokens - self.summary_tokens
+        keep = used = 0
+        for message in reversed(history):
+            tokens = estimate_tokens(message_text(message))
+            if keep >= self.keep_turns * 2 or used + tokens > budget:
+                break
+            keep += 1
+            used += tokens
+        older, recent = history[:len(history) - keep], history[len(history) - keep:]
+
+        if older:
+            summary = self.summarize(summary, older)
+            # Summarizing can take an LLM call; only fold if no other request folded these turns first
+            store.compare_and_replace(session_id, head + older, [SystemMessage(content=summary)])
+
+        prompt_history = ([SystemMessage(content=SUMMARY_PREFIX + summary)] if summary else []) + recent
+        counts = {
+            "system": estimate_tokens(system_prompt),
+            "summary": estimate_tokens(SUMMARY_PREFIX + summary) if summary else 0,
+            "history": used,
+            "query": estimate_tokens(query)
+        }
+        counts["total"] = sum(counts.values())
+        return prompt_history, {
+            "prompt_tokens": counts,
+            "history_messages": len(recent),
+            "summarized_messages": len(older)
+        }
+
+def create_history_window(llm=None) -> HistoryWindow:
+    """History window configured from the environment"""
+    summary_tokens = int(os.getenv('CHAT_SUMMARY_TOKENS', '300'))
+    summarize = None
+    if llm is not None and os.getenv('CHAT_HISTORY_SUMMARY', 'llm').lower() == 'llm':
+        summarize = create_llm_summarizer(llm, summary_tokens)
+    return HistoryWindow(
+        summarize,
+        max_tokens=int(os.getenv('CHAT_HISTORY_MAX_TOKENS', '1500')),
+        keep_turns=int(os.getenv('CHAT_HISTORY_TURNS', '4')),
+        summary_tokens=summary_tokens
+    )
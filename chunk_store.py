@@ -0,0 +1,199 @@
+"""
+Memory-mapped chunk store for the RAG vector store
+Replaces the pickled LangChain docstore: chunks are kept as an offset-indexed
+blob on disk so several processes can share them through the page cache, and
+only looked-up chunks become Python objects. New chunks are appended; the ids
+file is written last, so chunks past the last complete id are ignored
+"""
+
+import os
+import json
+import mmap
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+try:
+    from langchain_community.docstore.base import AddableMixin, Docstore
+    from langchain.schema import Document
+except ImportError:
+    AddableMixin = Docstore = object
+    Document = None
+
+CHUNKS_FILENAME = "chunks.bin"
+OFFSETS_FILENAME = "chunks.offsets"
+IDS_FILENAME = "chunks.ids"
+
+def chunk_store_exists(directory: str) -> bool:
+    """Whether a complete chunk store was written to the directory"""
+    return all(os.path.exists(os.path.join(directory, name))
+               for name in (CHUNKS_FILENAME, OFFSETS_FILENAME, IDS_FILENAME))
+
+def write_chunk_store(directory: str, chunks: Iterable[Tuple[str, "Document"]]):
+    """Write (chunk id, document) pairs in index order"""
+    os.makedirs(directory, exist_ok=True)
+    offsets = [0]
+    ids = []
+    tmp_files = {name: os.path.join(directory, f"{name}.tmp") for name in (CHUNKS_FILENAME, OFFSETS_FILENAME, IDS_FILENAME)}
+
+    with open(tmp_files[CHUNKS_FILENAME], 'wb') as f:
+        for chunk_id, doc in chunks:
+            record = json.dumps({"t": doc.page_content, "m": doc.metadata}, ensure_ascii=False).encode('utf-8')
+            f.write(record)
+            offsets.append(offsets[-1] + len(record))
+            ids.append(chunk_id)
+
+    np.asarray(offsets, dtype='<i8').tofile(tmp_files[OFFSETS_FILENAME])
+    with open(tmp_files[IDS_FILENAME], 'w', encoding='utf-8') as f:
+        f.write("".join(f"{chunk_id}\n" for chunk_id in ids))
+
+    for name, tmp_file in tmp_files.items():
+        os.replace(tmp_file, os.path.join(directory, name))
+
+def _append(path: str, data: bytes, size: int):
+    """Write data at byte size of a file, dropping whatever a torn earlier write left after it"""
+    with open(path, 'r+b') as f:
+        f.truncate(size)
+        f.seek(size)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+def append_chunk_store(directory: str, count: int, ids_bytes: int, chunks: Iterable[Tuple[str, "Document"]]) -> int:
+    """Append (chunk id, document) pairs after the first count chunks of a store
+
+    The first ids_bytes bytes of the ids file must hold exactly count ids.
+    Returns the new chunk count.
+    """
+    offsets_file = os.path.join(directory, OFFSETS_FILENAME)
+    chunk_end = int(np.fromfile(offsets_file, dtype='<i8', count=count + 1)[count])
+    records, ids = [], []
+    offsets = [chunk_end]
+    for chunk_id, doc in chunks:
+        record = json.dumps({"t": doc.page_content, "m": doc.metadata}, ensure_ascii=False).encode('utf-8')
+        records.append(record)
+        offsets.append(offsets[-1] + len(record))
+        ids.append(chunk_id)
+    if not ids:
+        return count
+
+    # Chunks and offsets first; the ids make them part of the store
+    _append(os.path.join(directory, CHUNKS_FILENAME), b"".join(records), chunk_end)
+    _append(offsets_file, np.asarray(offsets[1:], dtype='<i8').tobytes(), (count + 1) * 8)
+    _append(os.path.join(directory, IDS_FILENAME), "".join(f"{chunk_id}\n" for chunk_id in ids).encode('utf-8'), ids_bytes)
+    return count + len(ids)
+
+class MappedDocstore(Docstore, AddableMixin):
+    """Read-only mmap of a chunk store with an in-memory overlay for later edits
+
+    With count, only the first count chunks are served (the rows of the index
+    saved with them); stored_count tells whether the files hold more.
+    """
+
+    def __init__(self, directory: str, count: Optional[int] = None):
+        self.directory = directory
+        with open(os.path.join(directory, IDS_FILENAME), 'rb') as f:
+            data = f.read()
+        # A torn id line at the end does not count as stored
+        self.ids_bytes = data.rfind(b"\n") + 1
+        ids = data[:self.ids_bytes].decode('utf-8').split()
+        self.stored_count = len(ids)
+        if count is not None:
+            if count > self.stored_count:
+                raise ValueError(f"Chunk store holds {self.stored_count} chunks, expected {count}")
+            ids = ids[:count]
+        offsets = np.fromfile(os.path.join(directory, OFFSETS_FILENAME), dtype='<i8')[:len(ids) + 1]
+
+        blob = None
+        chunks_file = os.path.join(directory, CHUNKS_FILENAME)
+        if os.path.getsize(chunks_file) > 0:
+            with open(chunks_file, 'rb') as f:
+                blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._init_store(ids, offsets, blob)
+
+    @classmethod
+    def from_buffers(cls, ids: List[str], offsets: np.ndarray, blob) -> "MappedDocstore":
+        """Serve a chunk store held in memory or in a slice of a larger mapped file"""
+        store = cls.__new__(cls)
+        store.directory = None
+        store.stored_count = len(ids)
+        store.ids_bytes = None
+        store._init_store(ids, offsets, blob if len(blob) else None)
+        return store
+
+    def _init_store(self, ids: List[str], offsets: np.ndarray, blob):
+        self.ids: List[str] = ids
+        self.positions = {chunk_id: position for position, chunk_id in enumerate(ids)}
+        self.offsets = offsets
+        self.blob = blob
+        self.added: Dict[str, "Document"] = {}
+        self.deleted = set()
+
+    def __len__(self) -> int:
+        return len(self.ids) - len(self.deleted) + len(self.added)
+
+    def appendable(self) -> bool:
+        """Whether new chunks can be appended to the files: they hold exactly the served chunks, none deleted"""
+        return self.directory is not None and self.stored_count == len(self.ids) and not self.deleted
+
+    def append_to_files(self, chunks: Iterable[Tuple[str, "Document"]]) -> int:
+        """Append chunks after the served ones; returns the new chunk count (reopen to serve them)"""
+        if not self.appendable():
+            raise ValueError("Chunk store files cannot be appended to")
+        return append_chunk_store(self.directory, len(self.ids), self.ids_bytes, chunks)
+
+    def _read(self, position: int) -> "Document":
+        start, end = int(self.offsets[position]), int(self.offsets[position + 1])
+        record = json.loads(bytes(self.blob[start:end]).decode('utf-8'))
+        return Document(page_content=record["t"], metadata=record["m"])
+
+    def search(self, search: str) -> Union[str, "Document"]:
+        """Materialize a single chunk by id"""
+        if search in self.added:
+            return self.added[search]
+        position = self.positions.get(search)
+        if position is None or search in self.deleted:
+            return f"ID {search} not found."
+        return self._read(position)
+
+    def add(self, texts: Dict[str, "Document"]) -> None:
+        overlapping = [chunk_id for chunk_id in texts
+                       if chunk_id in self.added or (chunk_id in self.positions and chunk_id not in self.deleted)]
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        self.added.update(texts)
+
+    def delete(self, ids: List) -> None:
+        for chunk_id in ids:
+            if chunk_id in self.added:
+                del self.added[chunk_id]
+            elif chunk_id in self.positions and chunk_id not in self.deleted:
+                self.deleted.add(chunk_id)
+            else:
+                raise ValueError(f"ID {chunk_id} not found.")
+
+    def close(self):
+        if isinstance(self.blob, mmap.mmap):
+            self.blob.close()
+        self.blob = None
+
+def migrate_pickle_docstore(directory: str) -> bool:
+    """One-shot conversion of a LangChain index.pkl docstore into a chunk store
+
+    This is the only place the pickle is still read; it is deleted afterwards.
+    """
+    pickle_file = os.path.join(directory, "index.pkl")
+    if not os.path.exists(pickle_file):
+        return False
+
+    import pickle
+    with open(pickle_file, 'rb') as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+
+    write_chunk_store(directory, (
+        (index_to_docstore_id[position], docstore.search(index_to_docstore_id[position]))
+        for position in range(len(index_to_docstore_id))
+    ))
+    os.remove(pickle_file)
+    print(f"✅ Migrated {len(index_to_docstore_id)} chunks from index.pkl to the chunk store")
+    return True
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Structure-aware chunking and near-duplicate detection for the RAG index
+Splits knowledge base text at its headings ("1. Tension Headaches:", "Red flags:")
+and drops chunks whose sections MinHash shows to be near copies of indexed ones
+
+Usage: python chunking.py [--knowledge-base medical_knowledge]
+"""
+
+import os
+import re
+import hashlib
+import argparse
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from text_utils import tokenize
+
+# Split points of the fixed-size splitter, coarsest first
+SPLIT_SEPARATORS = ["\n\n", "\n", ". ", " "]
+
+# "1. Tension Headaches:", "2) Migraine", or a short title line ending in a colon
+HEADING_PATTERN = re.compile(r"^(\d+[.)]\s+\S.{0,80}|[A-Z][^\n.:]{2,60}:)$")
+
+SHINGLE_SIZE = 2
+MINHASH_PERMUTATIONS = 128
+MINHASH_BAND_ROWS = 4
+
+DEDUP_INDEX_FILENAME = "dedup_index.npz"
+# Signatures are only reusable with the same shingling and hash functions
+DEDUP_INDEX_VERSION = 1
+
+def split_sections(text: str) -> List[str]:
+    """Break text into sections that each start at a heading, with indentation removed"""
+    sections, current = [], []
+    for line in text.splitlines():
+        line = line.strip()
+        if HEADING_PATTERN.match(line) and not line.startswith("-") and any(current):
+            sections.append("\n".join(current).strip())
+            current = []
+        current.append(line)
+    sections.append("\n".join(current).strip())
+    return [section for section in sections if section]
+
+def split_text_by_sections(text: str, chunk_size: int, fallback: Callable[[str], List[str]]) -> List[str]:
+    """Chunks that follow the heading structure
+
+    Consecutive sections are packed together up to chunk_size, and only a
+    section longer than chunk_size is cut further by the fallback splitter.
+    """
+    chunks, current = [], ""
+    for section in split_sections(text):
+        if len(section) > chunk_size:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.extend(fallback(section))
+        elif not current:
+            current = section
+        elif len(current) + 2 + len(section) <= chunk_size:
+            current = f"{current}\n\n{section}"
+        else:
+            chunks.append(current)
+            current = section
+    if current:
+        chunks.append(current)
+    return chunks
+
+def shingles(text: str) -> set:
+    """Word bigrams of the text (single words for one-word texts)"""
+    words = tokenize(text) or text.lower().split()
+    if len(words) < SHINGLE_SIZE:
+        return set(words)
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+# Fixed random multiply-shift hash functions, one per MinHash permutation
+_rng = np.random.default_rng(20240601)
+_HASH_A = _rng.integers(1, 2 ** 63, MINHASH_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+_HASH_B = _rng.integers(0, 2 ** 63, MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+def minhash(text: str) -> np.ndarray:
+    """MinHash signature; the share of equal positions estimates the Jaccard similarity of the shingle sets"""
+    hashes = np.array([int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little')
+                       for shingle in shingles(text)] or [0], dtype=np.uint64)
+    permuted = (hashes[:, None] * _HASH_A[None, :] + _HASH_B[None, :]) >> np.uint64(32)
+    return permuted.min(axis=0).astype(np.uint32)
+
+class NearDuplicateIndex:
+    """MinHash signatures of the sections of indexed chunks, with LSH banding
+
+    A chunk is a near duplicate when every one of its sections has an indexed
+    section with an estimated Jaccard similarity of at least the threshold.
+    Comparing sections rather than whole chunks still finds copies whose
+    sections were packed into chunks differently. Sections sharing any band of
+    MINHASH_BAND_ROWS signature rows are the candidates that get compared.
+    """
+
+    def __init__(self, threshold: float = 0.8):
+        self.threshold = threshold
+        self.signatures: Dict[str, List[np.ndarray]] = {}
+        self.bands: Dict[tuple, set] = {}
+
+    @staticmethod
+    def _band_keys(signature: np.ndarray):
+        return [(start, signature[start:start + MINHASH_BAND_ROWS].tobytes())
+                for start in range(0, MINHASH_PERMUTATIONS, MINHASH_BAND_ROWS)]
+
+    def _find_section(self, signature: np.ndarray) -> Optional[str]:
+        candidates = set()
+        for key in self._band_keys(signature):
+            candidates.update(self.bands.get(key, ()))
+        best_id, best_similarity = None, self.threshold
+        for chunk_id in candidates:
+            similarity = max(float(np.mean(section == signature)) for section in self.signatures[chunk_id])
+            if similarity >= best_similarity:
+                best_id, best_similarity = chunk_id, similarity
+        return best_id
+
+    def find(self, text: str) -> Optional[List[str]]:
+        """Ids of the indexed chunks that together cover the text, or None if any section is new"""
+        stand_ins = []
+        for section in split_sections(text) or [text]:
+            chunk_id = self._find_section(minhash(section))
+            if chunk_id is None:
+                return None
+            if chunk_id not in stand_ins:
+                stand_ins.append(chunk_id)
+        return stand_ins
+
+    def add(self, chunk_id: str, text: str):
+        self.add_signatures(chunk_id, [minhash(section) for section in split_sections(text) or [text]])
+
+    def add_signatures(self, chunk_id: str, signatures: List[np.ndarray]):
+        self.signatures[chunk_id] = signatures
+        for signature in signatures:
+            for key in self._band_keys(signature):
+                self.bands.setdefault(key, set()).add(chunk_id)
+
+    def remove(self, chunk_id: str):
+        for signature in self.signatures.pop(chunk_id, []):
+            for key in self._band_keys(signature):
+                self.bands[key].discard(chunk_id)
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def save(self, directory: str):
+        """Persist the section signatures; the bands are rebuilt from them without re-reading any chunk"""
+        ids, owners, rows = [], [], []
+        for chunk_id, signatures in self.signatures.items():
+            owners.extend([len(ids)] * len(signatures))
+            ids.append(chunk_id)
+            rows.extend(signatures)
+
+        index_file = os.path.join(directory, DEDUP_INDEX_FILENAME)
+        tmp_file = f"{index_file}.tmp"
+        with open(tmp_file, 'wb') as f:
+            np.savez(f,
+                     params=np.array([DEDUP_INDEX_VERSION, MINHASH_PERMUTATIONS, MINHASH_BAND_ROWS, SHINGLE_SIZE]),
+                     ids=np.array(ids, dtype=str),
+                     owners=np.array(owners, dtype=np.int64),
+                     signatures=np.array(rows, dtype=np.uint32).reshape(-1, MINHASH_PERMUTATIONS))
+        os.replace(tmp_file, index_file)
+
+    @classmethod
+    def load(cls, directory: str, threshold: float = 0.8) -> Optional["NearDuplicateIndex"]:
+        """Load persisted signatures, or None if there are no usable ones"""
+        index_file = os.path.join(directory, DEDUP_INDEX_FILENAME)
+        if not os.path.exists(index_file):
+            return None
+        try:
+            with np.load(index_file, allow_pickle=False) as data:
+                params, ids, owners, signatures = data["params"], data["ids"], data["owners"], data["signatures"]
+        except (OSError, ValueError, KeyError):
+            return None
+        if params.tolist() != [DEDUP_INDEX_VERSION, MINHASH_PERMUTATIONS, MINHASH_BAND_ROWS, SHINGLE_SIZE]:
+            return None
+
+        index = cls(threshold)
+        bounds = np.searchsorted(owners, np.arange(len(ids) + 1))
+        for position, chunk_id in enumerate(ids.tolist()):
+            index.add_signatures(chunk_id, list(signatures[bounds[position]:bounds[position + 1]]))
+        return index
+
+def split_entry_text(text: str, chunking: str, chunk_size: int, chunk_overlap: int) -> List[str]:
+    """Chunk texts of one knowledge base entry, split the way the RAG index splits it"""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                                              separators=SPLIT_SEPARATORS)
+    if chunking == 'sections':
+        return split_text_by_sections(text, chunk_size, splitter.split_text)
+    return splitter.split_text(text)
+
+def chunking_report(items: List[Dict], chunk_size: int, chunk_overlap: int, threshold: float = 0.8) -> Dict:
+    """Chunk counts of fixed-size splitting, heading-aware splitting and heading-aware splitting with dedup"""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                                              separators=SPLIT_SEPARATORS)
+    fixed = sum(len(splitter.split_text(item['content'])) for item in items)
+    sections = [chunk for item in items
+                for chunk in split_text_by_sections(item['content'], chunk_size, splitter.split_text)]
+
+    index = NearDuplicateIndex(threshold)
+    for i, chunk in enumerate(sections):
+        if index.find(chunk) is None:
+            index.add(str(i), chunk)
+
+    return {
+        "documents": len(items),
+        "fixed_size_chunks": fixed,
+        "section_chunks": len(sections),
+        "deduplicated_chunks": len(index),
+        "near_duplicates": len(sections) - len(index),
+        "reduction": round(1 - len(index) / fixed, 3) if fixed else 0.0
+    }
+
+def main():
+    from knowledge_store import KnowledgeStore
+    from rag_system import CHUNK_SIZE, CHUNK_OVERLAP
+
+    parser = argparse.ArgumentParser(description="Compare chunk counts of the chunking strategies")
+    parser.add_argument("--knowledge-base", default="medical_knowledge", help="Knowledge base directory")
+    parser.add_argument("--threshold", type=float, default=0.8, help="Jaccard similarity treated as a near duplicate")
+    args = parser.parse_args()
+
+    report = chunking_report(KnowledgeStore(args.knowledge_base).load(), CHUNK_SIZE, CHUNK_OVERLAP, args.threshold)
+    print(f"📚 {report['documents']} documents")
+    print(f"   {report['fixed_size_chunks']:>7} chunks with fixed-size splitting")
+    print(f"   {report['section_chunks']:>7} chunks split at headings")
+    print(f"   {report['deduplicated_chunks']:>7} chunks after dropping {report['near_duplicates']} near duplicates")
+    print(f"✅ {report['reduction']:.1%} fewer chunks")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Single-call consultations
+The model fills in a SymptomResponse in one schema-constrained call and the
+consultation is logged server-side afterwards, instead of an agent loop that
+spends a second round trip calling the log_symptom_entry tool
+"""
+
+import json
+from typing import Any, Generator, List, Tuple
+
+from schema import SymptomAssessment, SymptomResponse
+from streaming import field_deltas
+from tools import log_symptom_entry
+
+SEVERITIES = ("mild", "moderate", "severe")
+
+# Bound as a plain JSON schema: structured output then streams partial dicts as the
+# tool-call arguments arrive, where a pydantic schema yields nothing until every field validates
+ASSESSMENT_SCHEMA = SymptomAssessment.model_json_schema()
+
+def normalize_severity(severity: Any) -> str:
+    """One of SEVERITIES; the most serious level mentioned wins, moderate when none is"""
+    value = str(severity or '').strip().lower()
+    for level in reversed(SEVERITIES):
+        if level in value:
+            return level
+    return "moderate"
+
+def create_consultation_chain(llm, system_prompt: str):
+    """Prompt piped into the LLM constrained to the SymptomAssessment schema
+
+    log_status and audio_response stay out of the tool schema, so the model can never
+    choose a server file path to send back as audio.
+    """
+    from langchain_core.prompts import ChatPromptTemplate
+
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", system_prompt),
+        ("placeholder", "{chat_history}"),
+        ("human", "{query}")
+    ])
+    return prompt | llm.with_structured_output(ASSESSMENT_SCHEMA)
+
+def finish_response(response: Any) -> SymptomResponse:
+    """SymptomResponse validated from the model's assessment fields only; anything else it sent is dropped"""
+    if response is None:
+        raise ValueError("Model returned no structured response")
+    if not isinstance(response, dict):
+        response = response.model_dump()
+    assessment = SymptomAssessment(**response)
+    return SymptomResponse(**assessment.model_dump(exclude={'severity'}),
+                           severity=normalize_severity(assessment.severity))
+
+def consult(chain, query: str, chat_history: List[Any]) -> SymptomResponse:
+    """Run one consultation; raises ValueError when the model returns no structured answer"""
+    return finish_response(chain.invoke({"query": query, "chat_history": chat_history}))
+
+def stream_consult(chain, query: str, chat_history: List[Any]) -> Generator[Tuple[str, Any], None, SymptomResponse]:
+    """Token events as the model fills in the response, returning the finished SymptomResponse
+
+    Meant for `response = yield from stream_consult(...)` inside an SSE generator.
+    """
+    last = []
+
+    def partials():
+        for partial in chain.stream({"query": query, "chat_history": chat_history}):
+            last[:] = [partial]
+            yield partial
+
+    yield from field_deltas(partials(), {})
+    return finish_response(last[0] if last else None)
+
+def response_text(response: SymptomResponse) -> str:
+    """Plain-text form of a consultation for the session history"""
+    return f"{response.probable_cause}\nSeverity: {response.severity}\n{response.advice}"
+
+def log_consultation(session_id: str, query: str, response: SymptomResponse) -> str:
+    """Record the consultation in the symptom log; returns the log status"""
+    entry = json.dumps({
+        "session_id": session_id,
+        "query": query,
+        "probable_cause": response.probable_cause,
+        "severity": response.severity,
+        "advice": response.advice
+    }, ensure_ascii=False)
+    try:
+        return log_symptom_entry(entry)
+    except Exception as e:
+        print(f"⚠️ Could not log consultation: {e}")
+        return "Consultation not logged"
@@ -0,0 +1,297 @@
+"""
+Persistent embedding cache for the RAG system
+Stores chunk vectors on disk, keyed by embedding model and chunk text hash,
+so rebuilds and new replicas reuse vectors instead of recomputing them
+"""
+
+import os
+import re
+import json
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Iterable
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+VECTORS_FILENAME = "vectors.f32"
+KEYS_FILENAME = "keys.txt"
+META_FILENAME = "meta.json"
+LOCK_FILENAME = "cache.lock"
+
+class _ModelCache:
+    """Vectors of a single embedding model: a float32 matrix plus a hash->row index
+
+    Several processes may share the files. Writers take an exclusive flock on
+    LOCK_FILENAME and number their rows from the vectors file itself; readers
+    pick up rows appended by other processes, and reload when a compaction
+    has replaced the files.
+    """
+
+    def __init__(self, model_dir: str, model_name: str, dim: int):
+        self.model_dir = model_dir
+        self.model_name = model_name
+        self.dim = dim
+        self.row_bytes = 4 * dim
+        self.vectors_file = os.path.join(model_dir, VECTORS_FILENAME)
+        self.keys_file = os.path.join(model_dir, KEYS_FILENAME)
+        self.lock_file = os.path.join(model_dir, LOCK_FILENAME)
+        self.rows: Dict[str, int] = {}
+        self.row_count = 0
+        self.keys_offset = 0
+        self.vectors_inode = None
+        self.matrix = None
+        self.mapped_rows = 0
+        self.load()
+
+    @contextmanager
+    def locked(self):
+        """Exclusive access to the files across processes, where flock exists"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_file, 'a') as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    def _stored_rows(self) -> int:
+        return os.path.getsize(self.vectors_file) // self.row_bytes if os.path.exists(self.vectors_file) else 0
+
+    def load(self):
+        """Rebuild the row index from disk"""
+        self.rows = {}
+        self.row_count = 0
+        self.keys_offset = 0
+        self.vectors_inode = os.stat(self.vectors_file).st_ino if os.path.exists(self.vectors_file) else None
+        self.matrix = None
+        self.mapped_rows = 0
+        self._read_new_keys()
+
+    def _read_new_keys(self):
+        """Index keys written since the last read, up to the rows whose vectors are complete"""
+        if not os.path.exists(self.keys_file):
+            return
+        stored_rows = self._stored_rows()
+        with open(self.keys_file, 'rb') as f:
+            f.seek(self.keys_offset)
+            data = f.read()
+        # A writer (or a crash) may leave a partial last line or keys without vectors; stop there
+        for line in data.split(b"\n")[:-1]:
+            if self.row_count >= stored_rows:
+                break
+            self.rows[line.decode('utf-8')] = self.row_count
+            self.row_count += 1
+            self.keys_offset += len(line) + 1
+
+    def sync(self):
+        """Catch up with appends and compactions made by other processes"""
+        inode = os.stat(self.vectors_file).st_ino if os.path.exists(self.vectors_file) else None
+        if inode != self.vectors_inode:
+            self.load()
+        elif inode is not None and self._stored_rows() > self.row_count:
+            self._read_new_keys()
+
+    def size_bytes(self) -> int:
+        return self.row_count * self.row_bytes
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        if row >= self.mapped_rows:
+            # Remap after appends so the new rows become visible
+            self.mapped_rows = self.row_count
+            self.matrix = np.memmap(self.vectors_file, dtype=np.float32, mode='r', shape=(self.mapped_rows, self.dim))
+        return np.array(self.matrix[row])
+
+    def append(self, keys: List[str], vectors: np.ndarray) -> int:
+        """Append vectors for keys not stored yet (by any process), returning how many were written"""
+        with self.locked():
+            self.sync()
+            new = {}
+            for key, vector in zip(keys, vectors):
+                if key not in self.rows:
+                    new.setdefault(key, vector)
+            new = list(new.items())
+            if not new:
+                return 0
+
+            # Drop the tail a crash between the two appends left behind, so rows and keys line up
+            if self._stored_rows() != self.row_count:
+                with open(self.vectors_file, 'r+b') as f:
+                    f.truncate(self.row_count * self.row_bytes)
+            if os.path.exists(self.keys_file) and os.path.getsize(self.keys_file) != self.keys_offset:
+                with open(self.keys_file, 'r+b') as f:
+                    f.truncate(self.keys_offset)
+
+            with open(self.vectors_file, 'ab') as f:
+                f.write(np.ascontiguousarray(np.stack([vector for _, vector in new]), dtype=np.float32).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            if self.vectors_inode is None:
+                self.vectors_inode = os.stat(self.vectors_file).st_ino
+            key_lines = "".join(f"{key}\n" for key, _ in new).encode('utf-8')
+            with open(self.keys_file, 'ab') as f:
+                f.write(key_lines)
+            for key, _ in new:
+                self.rows[key] = self.row_count
+                self.row_count += 1
+            self.keys_offset += len(key_lines)
+            return len(new)
+
+    def rewrite(self, keys: List[str]):
+        """Keep only the given keys, writing the surviving rows to fresh files"""
+        with self.locked():
+            self.sync()
+            tmp_vectors = f"{self.vectors_file}.tmp"
+            tmp_keys = f"{self.keys_file}.tmp"
+            kept = [key for key in keys if key in self.rows]
+            with open(tmp_vectors, 'wb') as f:
+                for key in kept:
+                    f.write(self.get(key).tobytes())
+            with open(tmp_keys, 'w', encoding='utf-8') as f:
+                f.write("".join(f"{key}\n" for key in kept))
+
+            self.matrix = None
+            os.replace(tmp_vectors, self.vectors_file)
+            os.replace(tmp_keys, self.keys_file)
+            self.load()
+
+class EmbeddingCache:
+    """Disk-backed embedding cache shared by every index build"""
+
+    def __init__(self, cache_dir: str, max_bytes: Optional[int] = None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.models: Dict[str, _ModelCache] = {}
+        self.hits = 0
+        self.misses = 0
+        self.full_warning_shown = False
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _model_dir(self, model_name: str) -> str:
+        return os.path.join(self.cache_dir, re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name))
+
+    def _get_model(self, model_name: str, dim: Optional[int] = None) -> Optional[_ModelCache]:
+        if model_name in self.models:
+            return self.models[model_name]
+
+        model_dir = self._model_dir(model_name)
+        meta_file = os.path.join(model_dir, META_FILENAME)
+        if os.path.exists(meta_file):
+            with open(meta_file, 'r', encoding='utf-8') as f:
+                dim = json.load(f)["dim"]
+        elif dim is None:
+            return None
+        else:
+            os.makedirs(model_dir, exist_ok=True)
+            with open(meta_file, 'w', encoding='utf-8') as f:
+                json.dump({"model_name": model_name, "dim": dim}, f)
+
+        self.models[model_name] = _ModelCache(model_dir, model_name, dim)
+        return self.models[model_name]
+
+    def get_many(self, model_name: str, keys: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Return the cached vectors for the keys that are present"""
+        keys = list(keys)
+        with self.lock:
+            model = self._get_model(model_name)
+            found = {}
+            if model is not None:
+                model.sync()
+                for key in keys:
+                    vector = model.get(key)
+                    if vector is not None:
+                        found[key] = vector
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+            return found
+
+    def put_many(self, model_name: str, keys: List[str], vectors) -> int:
+        """Store vectors for new keys, returning how many were written"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not keys:
+            return 0
+
+        with self.lock:
+            model = self._get_model(model_name, dim=vectors.shape[1])
+            model.sync()
+            new_rows = {}
+            for key, vector in zip(keys, vectors):
+                if key not in model.rows:
+                    new_rows[key] = vector
+            if not new_rows:
+                return 0
+
+            if self.max_bytes is not None:
+                added_bytes = len(new_rows) * model.dim * 4
+                if self._total_bytes() + added_bytes > self.max_bytes:
+                    if not self.full_warning_shown:
+                        print(f"⚠️ Embedding cache is full ({self.max_bytes // (1024 * 1024)} MB); new vectors are not cached")
+                        self.full_warning_shown = True
+                    return 0
+
+            return model.append(list(new_rows), np.stack(list(new_rows.values())))
+
+    def list_models(self) -> List[str]:
+        """Embedding models that have vectors in the cache"""
+        models = []
+        for name in sorted(os.listdir(self.cache_dir)):
+            meta_file = os.path.join(self.cache_dir, name, META_FILENAME)
+            if os.path.exists(meta_file):
+                with open(meta_file, 'r', encoding='utf-8') as f:
+                    models.append(json.load(f)["model_name"])
+        return models
+
+    def _total_bytes(self) -> int:
+        return sum(self._get_model(name).size_bytes() for name in self.list_models())
+
+    def get_statistics(self) -> Dict:
+        """Size accounting per model"""
+        with self.lock:
+            models = {}
+            for name in self.list_models():
+                model = self._get_model(name)
+                models[name] = {
+                    "entries": model.row_count,
+                    "dimensions": model.dim,
+                    "size_mb": round(model.size_bytes() / (1024 * 1024), 2)
+                }
+            return {
+                "cache_dir": os.path.abspath(self.cache_dir),
+                "models": models,
+                "total_size_mb": round(sum(self._get_model(name).size_bytes() for name in models) / (1024 * 1024), 2),
+                "max_size_mb": round(self.max_bytes / (1024 * 1024), 2) if self.max_bytes else None,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+    def evict_model(self, model_name: str) -> int:
+        """Delete every vector of a retired model, returning the bytes freed"""
+        with self.lock:
+            model = self._get_model(model_name)
+            if model is None:
+                return 0
+            freed = model.size_bytes()
+            self.models.pop(model_name, None)
+            shutil.rmtree(model.model_dir, ignore_errors=True)
+            return freed
+
+    def compact(self, model_name: str, keep_keys: Iterable[str]) -> int:
+        """Drop vectors of a model that are not in keep_keys, returning the bytes freed"""
+        with self.lock:
+            model = self._get_model(model_name)
+            if model is None:
+                return 0
+            before = model.size_bytes()
+            model.rewrite(list(dict.fromkeys(keep_keys)))
+            return before - model.size_bytes()
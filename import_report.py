@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Import-time report for the application modules
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter and
+summarizes the slowest imports, failing when startup exceeds a budget
+
+Usage: python import_report.py [main_rag] [--top 15] [--max-ms 1500] [--json]
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+from typing import Dict, List
+
+def measure_imports(module: str, env: Dict = None) -> List[Dict]:
+    """Per-module self and cumulative import times (microseconds) for importing a module"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=dict(os.environ, **(env or {})),
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr[-2000:]}")
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        imports.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip())) // 2,
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us)
+        })
+    return imports
+
+def summarize(module: str, imports: List[Dict], top: int = 15) -> Dict:
+    """Total import time of the module and its most expensive dependencies"""
+    total = next((item["cumulative_us"] for item in imports if item["module"] == module), 0)
+    slowest = sorted((item for item in imports if item["depth"] <= 1),
+                     key=lambda item: item["cumulative_us"], reverse=True)[:top]
+    return {
+        "module": module,
+        "total_ms": round(total / 1000, 1),
+        "modules_imported": len(imports),
+        "slowest": [{"module": item["module"], "cumulative_ms": round(item["cumulative_us"] / 1000, 1)}
+                    for item in slowest]
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Report module import times (python -X importtime)")
+    parser.add_argument("module", nargs="?", default="main_rag", help="Module to import")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest imports to list")
+    parser.add_argument("--max-ms", type=float, default=None, help="Fail if the import takes longer")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable output")
+    args = parser.parse_args()
+
+    # Measure the import itself, not the RAG warm-up it schedules
+    report = summarize(args.module, measure_imports(args.module, {"RAG_WARMUP": "lazy"}), args.top)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"⏱️ import {report['module']}: {report['total_ms']} ms ({report['modules_imported']} modules)")
+        for item in report["slowest"]:
+            print(f"   {item['cumulative_ms']:>9.1f} ms  {item['module']}")
+
+    if args.max_ms is not None and report["total_ms"] > args.max_ms:
+        print(f"❌ Import time {report['total_ms']} ms exceeds the {args.max_ms} ms budget")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+BM25 inverted index for keyword retrieval over knowledge base chunks
+Built once, updated incrementally and persisted next to the vector store
+"""
+
+import os
+import json
+import math
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from text_utils import tokenize
+
+KEYWORD_INDEX_FILENAME = "keyword_index.json"
+KEYWORD_INDEX_VERSION = 1
+
+class BM25Index:
+    """Okapi BM25 over chunk ids with a term -> {slot: tf} inverted index"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.terms: List[str] = []
+        self.vocab: Dict[str, int] = {}
+        self.postings: List[Dict[int, int]] = []
+        self.doc_ids: List[Optional[str]] = []
+        self.slots: Dict[str, int] = {}
+        self.doc_lengths: List[int] = []
+        self.doc_terms: List[array] = []
+        self.total_length = 0
+        self._posting_arrays: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        self._lengths_array = None
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.slots
+
+    def _term_id(self, term: str) -> int:
+        term_id = self.vocab.get(term)
+        if term_id is None:
+            term_id = len(self.terms)
+            self.vocab[term] = term_id
+            self.terms.append(term)
+            self.postings.append({})
+        return term_id
+
+    def _add_counts(self, doc_id: str, length: int, counts: Dict[int, int]):
+        slot = len(self.doc_ids)
+        self.doc_ids.append(doc_id)
+        self.slots[doc_id] = slot
+        self.doc_lengths.append(length)
+        self.doc_terms.append(array('I', counts))
+        self.total_length += length
+        for term_id, tf in counts.items():
+            self.postings[term_id][slot] = tf
+            self._posting_arrays.pop(term_id, None)
+        self._lengths_array = None
+
+    def add(self, doc_id: str, text: str):
+        """Index a chunk, replacing any previous version with the same id"""
+        if doc_id in self.slots:
+            self.remove(doc_id)
+        tokens = tokenize(text)
+        counts = Counter(self._term_id(token) for token in tokens)
+        self._add_counts(doc_id, len(tokens), counts)
+
+    def remove(self, doc_id: str) -> bool:
+        """Drop a chunk from the index"""
+        slot = self.slots.pop(doc_id, None)
+        if slot is None:
+            return False
+        for term_id in self.doc_terms[slot]:
+            self.postings[term_id].pop(slot, None)
+            self._posting_arrays.pop(term_id, None)
+        self.total_length -= self.doc_lengths[slot]
+        self.doc_ids[slot] = None
+        self.doc_terms[slot] = array('I')
+        self.doc_lengths[slot] = 0
+        self._lengths_array = None
+        return True
+
+    def _postings_for(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        arrays = self._posting_arrays.get(term_id)
+        if arrays is None:
+            posting = self.postings[term_id]
+            arrays = (np.fromiter(posting.keys(), dtype=np.int64, count=len(posting)),
+                      np.fromiter(posting.values(), dtype=np.float32, count=len(posting)))
+            self._posting_arrays[term_id] = arrays
+        return arrays
+
+    def search(self, query: str, k: int = 3, allowed: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+        """Return the k best (chunk id, BM25 score) pairs for a query, optionally only among allowed ids"""
+        if not self.slots:
+            return []
+        term_ids = {self.vocab[token] for token in tokenize(query) if token in self.vocab}
+        if not term_ids:
+            return []
+
+        if self._lengths_array is None:
+            self._lengths_array = np.asarray(self.doc_lengths, dtype=np.float32)
+        n_docs = len(self.slots)
+        avg_length = self.total_length / n_docs if n_docs else 1.0
+        scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+
+        for term_id in term_ids:
+            slots, tfs = self._postings_for(term_id)
+            if len(slots) == 0:
+                continue
+            idf = math.log(1 + (n_docs - len(slots) + 0.5) / (len(slots) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self._lengths_array[slots] / avg_length)
+            scores[slots] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+
+        candidates = np.flatnonzero(scores)
+        if allowed is not None:
+            candidates = candidates[np.fromiter((self.doc_ids[slot] in allowed for slot in candidates),
+                                                dtype=bool, count=len(candidates))]
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        ranked = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [(self.doc_ids[slot], float(scores[slot])) for slot in ranked]
+
+    def save(self, directory: str):
+        """Persist the index as JSON, compacting removed slots"""
+        docs = []
+        for slot, doc_id in enumerate(self.doc_ids):
+            if doc_id is None:
+                continue
+            term_ids = list(self.doc_terms[slot])
+            docs.append([doc_id, self.doc_lengths[slot], term_ids, [self.postings[t][slot] for t in term_ids]])
+
+        index_file = os.path.join(directory, KEYWORD_INDEX_FILENAME)
+        tmp_file = f"{index_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({
+                "version": KEYWORD_INDEX_VERSION,
+                "k1": self.k1,
+                "b": self.b,
+                "terms": self.terms,
+                "docs": docs
+            }, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_file, index_file)
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["BM25Index"]:
+        """Load a persisted index, or None if there is no usable one"""
+        index_file = os.path.join(directory, KEYWORD_INDEX_FILENAME)
+        if not os.path.exists(index_file):
+            return None
+        try:
+            with open(index_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != KEYWORD_INDEX_VERSION:
+            return None
+        return cls.from_data(data)
+
+    @classmethod
+    def from_data(cls, data: Dict) -> "BM25Index":
+        """Rebuild an index from its persisted JSON form"""
+        index = cls(k1=data["k1"], b=data["b"])
+        index.terms = data["terms"]
+        index.vocab = {term: term_id for term_id, term in enumerate(index.terms)}
+        index.postings = [{} for _ in index.terms]
+        for doc_id, length, term_ids, tfs in data["docs"]:
+            index._add_counts(doc_id, length, dict(zip(term_ids, tfs)))
+        return index
@@ -0,0 +1,236 @@
+"""
+Append-only storage for the medical knowledge base
+medical_knowledge.json is a snapshot; additions and deletions are appended to
+medical_knowledge.log.jsonl with an fsync each and folded back into the
+snapshot by compaction, which swaps the new snapshot in with an atomic rename
+"""
+
+import os
+import json
+import uuid
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from vector_manifest import document_hash
+
+SNAPSHOT_FILENAME = "medical_knowledge.json"
+LOG_FILENAME = "medical_knowledge.log.jsonl"
+LOCK_FILENAME = "medical_knowledge.lock"
+
+def new_entry_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+def assign_entry_ids(entries: List[Dict]) -> List[Dict]:
+    """Give snapshot entries without an id a stable one derived from their content"""
+    seen = set()
+    for entry in entries:
+        if "id" not in entry:
+            base_id = document_hash(entry)[:16]
+            entry_id = base_id
+            occurrence = 1
+            while entry_id in seen:
+                occurrence += 1
+                entry_id = f"{base_id}-{occurrence}"
+            entry["id"] = entry_id
+        seen.add(entry["id"])
+    return entries
+
+def _fsync_directory(directory: str):
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class KnowledgeStore:
+    """Snapshot + append-only log of knowledge base entries, shared by every reader and writer
+
+    Log records are replayed idempotently: adds of an id already in the
+    snapshot are skipped and tombstones of missing ids do nothing, so a crash
+    between writing a snapshot and truncating the log loses nothing.
+    """
+
+    _thread_locks: Dict[str, threading.RLock] = {}
+    # How deeply the thread holding each path's lock has entered it
+    _lock_depths: Dict[str, int] = {}
+
+    def __init__(self, knowledge_base_path: str, compact_after: int = None):
+        self.knowledge_base_path = knowledge_base_path
+        self.snapshot_file = os.path.join(knowledge_base_path, SNAPSHOT_FILENAME)
+        self.log_file = os.path.join(knowledge_base_path, LOG_FILENAME)
+        self.lock_file = os.path.join(knowledge_base_path, LOCK_FILENAME)
+        if compact_after is None:
+            compact_after = int(os.getenv('RAG_KB_COMPACT_AFTER', '200'))
+        self.compact_after = compact_after
+        self.log_records = None
+        self.compactions = 0
+        self.compaction_thread = None
+        self.thread_lock = KnowledgeStore._thread_locks.setdefault(os.path.abspath(knowledge_base_path), threading.RLock())
+
+    @contextmanager
+    def locked(self):
+        """Serialize writers across threads and, where flock exists, processes
+
+        Reentrant: a thread already holding the lock does not flock again.
+        """
+        with self.thread_lock:
+            key = os.path.abspath(self.knowledge_base_path)
+            depth = KnowledgeStore._lock_depths.get(key, 0)
+            if fcntl is None or depth:
+                KnowledgeStore._lock_depths[key] = depth + 1
+                try:
+                    yield
+                finally:
+                    KnowledgeStore._lock_depths[key] = depth
+                return
+            os.makedirs(self.knowledge_base_path, exist_ok=True)
+            with open(self.lock_file, 'a') as lock:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+                KnowledgeStore._lock_depths[key] = 1
+                try:
+                    yield
+                finally:
+                    KnowledgeStore._lock_depths[key] = 0
+                    fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.snapshot_file) or os.path.exists(self.log_file)
+
+    def _read_snapshot(self) -> List[Dict]:
+        if not os.path.exists(self.snapshot_file):
+            return []
+        with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+            return assign_entry_ids(json.load(f))
+
+    def _read_log(self) -> List[Dict]:
+        if not os.path.exists(self.log_file):
+            return []
+        records = []
+        with open(self.log_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # A torn final line from a crash mid-append
+                    break
+        return records
+
+    def _replay(self, entries: List[Dict], records: List[Dict]) -> List[Dict]:
+        positions = {entry["id"]: i for i, entry in enumerate(entries)}
+        deleted = set()
+        for record in records:
+            if record["op"] == "add":
+                entry = record["entry"]
+                if entry["id"] not in positions:
+                    positions[entry["id"]] = len(entries)
+                    entries.append(entry)
+            elif record["op"] == "delete":
+                if record["id"] in positions:
+                    deleted.add(record["id"])
+        return [entry for entry in entries if entry["id"] not in deleted]
+
+    def load(self) -> List[Dict]:
+        """Every live entry: the snapshot with the log applied on top"""
+        with self.locked():
+            records = self._read_log()
+            self.log_records = len(records)
+            return self._replay(self._read_snapshot(), records)
+
+    def _append_records(self, records: List[Dict]):
+        os.makedirs(self.knowledge_base_path, exist_ok=True)
+        with self.locked():
+            # Drop a torn final line so the next record starts on its own line
+            if os.path.exists(self.log_file) and os.path.getsize(self.log_file) > 0:
+                with open(self.log_file, 'rb+') as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        f.seek(0)
+                        valid = f.read().rfind(b"\n") + 1
+                        f.truncate(valid)
+            with open(self.log_file, 'a', encoding='utf-8') as f:
+                f.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+                f.flush()
+                os.fsync(f.fileno())
+            if self.log_records is None:
+                self.log_records = len(self._read_log())
+            else:
+                self.log_records += len(records)
+        self.maybe_compact()
+
+    def append(self, entries: Iterable[Dict]) -> List[Dict]:
+        """Durably add entries, returning them with their ids"""
+        entries = [dict(entry, id=entry.get("id") or new_entry_id()) for entry in entries]
+        if entries:
+            self._append_records([{"op": "add", "entry": entry} for entry in entries])
+        return entries
+
+    def delete(self, entry_ids: Iterable[str]):
+        """Durably delete entries by writing tombstones"""
+        records = [{"op": "delete", "id": entry_id} for entry_id in entry_ids]
+        if records:
+            self._append_records(records)
+
+    def _write_snapshot(self, entries: List[Dict]):
+        os.makedirs(self.knowledge_base_path, exist_ok=True)
+        tmp_file = f"{self.snapshot_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.snapshot_file)
+        _fsync_directory(self.knowledge_base_path)
+
+    def replace_all(self, entries: List[Dict]):
+        """Replace the whole knowledge base (initial creation, restores)"""
+        with self.locked():
+            self._write_snapshot(assign_entry_ids([dict(entry) for entry in entries]))
+            if os.path.exists(self.log_file):
+                os.remove(self.log_file)
+            self.log_records = 0
+
+    def compact(self) -> int:
+        """Fold the log into a new snapshot, returning the number of records folded"""
+        with self.locked():
+            records = self._read_log()
+            if not records:
+                return 0
+            self._write_snapshot(self._replay(self._read_snapshot(), records))
+            # Replay is idempotent, so a crash before this truncation is harmless
+            open(self.log_file, 'w').close()
+            self.log_records = 0
+            self.compactions += 1
+            return len(records)
+
+    def maybe_compact(self):
+        """Compact in a background thread once the log has grown past the threshold"""
+        if not self.compact_after or (self.log_records or 0) < self.compact_after:
+            return
+        if self.compaction_thread is not None and self.compaction_thread.is_alive():
+            return
+        self.compaction_thread = threading.Thread(target=self._compact_in_background, name="kb-compaction", daemon=True)
+        self.compaction_thread.start()
+
+    def _compact_in_background(self):
+        try:
+            folded = self.compact()
+            if folded:
+                print(f"✅ Compacted {folded} knowledge base log records into the snapshot")
+        except Exception as e:
+            print(f"⚠️ Knowledge base compaction failed: {e}")
+
+    def get_statistics(self) -> Dict:
+        return {
+            "snapshot_file": os.path.abspath(self.snapshot_file),
+            "log_file": os.path.abspath(self.log_file),
+            "log_records": self.log_records if self.log_records is not None else len(self._read_log()),
+            "compact_after": self.compact_after,
+            "compactions": self.compactions
+        }
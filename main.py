@@ -12,8 +12,13 @@ from werkzeug.utils import secure_filename
 import os
 from datetime import datetime
 
-from tools import tools, convert_text_to_speech, process_uploaded_file, convert_speech_to_text
-from schema import SymptomResponse, ChatRequest
+from tools import convert_text_to_speech, process_uploaded_file, convert_speech_to_text
+from schema import SymptomAssessment, SymptomResponse, ChatRequest
+from session_store import create_session_store
+from chat_history import create_history_window
+from consultation import create_consultation_chain, consult, stream_consult, log_consultation, response_text as consultation_text
+from streaming import field_deltas, sse_response
+from response_cache import create_response_cache, QueryEmbedder
 
 SYSTEM_PROMPT = """
 You are a helpful medical assistant for a General Practitioner clinic. You do NOT give diagnoses.
@@ -28,11 +33,16 @@ IMPORTANT:
 - Always be cautious and refer to doctors when unclear
 - Never provide definitive diagnoses
 - Always recommend consulting healthcare professionals for proper medical advice
-- Call the log_symptom_entry tool to record the consultation
 
 Respond in a helpful, professional manner while being clear about limitations.
 """
 
+# The agent logs through its tool; the structured path logs server-side
+AGENT_PROMPT = SYSTEM_PROMPT + "\nCall the log_symptom_entry tool to record the consultation.\n"
+
+# structured (default): one schema-constrained call; agent: tool-calling loop
+CHAT_MODE = os.getenv('CHAT_MODE', 'structured').lower()
+
 # Gemini LLM Setup
 llm = ChatGoogleGenerativeAI(
     model="gemini-1.5-flash",
@@ -42,19 +52,24 @@ llm = ChatGoogleGenerativeAI(
 )
 
 # JSON Output Parser
-parser = PydanticOutputParser(pydantic_object=SymptomResponse)
+parser = PydanticOutputParser(pydantic_object=SymptomAssessment)
 
-# Prompt Template
-prompt = ChatPromptTemplate.from_messages([
-    ("system", SYSTEM_PROMPT),
-    ("placeholder", "{chat_history}"),
-    ("human", "{query}"),
-    ("placeholder", "{agent_scratchpad}")
-])
+# Single-call consultation chain
+consultation_chain = create_consultation_chain(llm, SYSTEM_PROMPT)
 
-# Agent & Executor
-agent = create_tool_calling_agent(llm=llm, prompt=prompt, tools=tools)
-executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
+# Agent & Executor (opt-in, for real tool use)
+executor = None
+if CHAT_MODE == 'agent':
+    from tools import tools
+    
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", AGENT_PROMPT),
+        ("placeholder", "{chat_history}"),
+        ("human", "{query}"),
+        ("placeholder", "{agent_scratchpad}")
+    ])
+    agent = create_tool_calling_agent(llm=llm, prompt=prompt, tools=tools)
+    executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
 
 # Flask App Setup
 app = Flask(__name__)
@@ -70,8 +85,19 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs('static/audio', exist_ok=True)
 
-# Chat Session Storage
-chat_sessions = {}
+# Chat Session Storage (bounded; in-process, SQLite or Redis per CHAT_SESSION_BACKEND)
+chat_sessions = create_session_store()
+
+# Prompt history: recent turns verbatim, older turns folded into a per-session summary
+history_window = create_history_window(llm)
+
+# Response cache for first-turn structured answers (RESPONSE_CACHE=false disables).
+# Exact repeats only by default: matching paraphrases needs an embedding model in every worker
+response_cache = create_response_cache()
+SEMANTIC_CACHE = os.getenv('RESPONSE_CACHE_SEMANTIC', 'false').lower() == 'true'
+query_embedder = QueryEmbedder() if response_cache is not None and SEMANTIC_CACHE else None
+# There is no knowledge base here, so answers are versioned by the model that wrote them
+CACHE_VERSION = llm.model
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -112,79 +138,146 @@ def upload_file():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+def parse_chat_request():
+    """Session id and the query combined with any audio transcript and file analysis"""
+    # Handle both JSON and form data
+    if request.is_json:
+        data = request.json
+    else:
+        data = request.form.to_dict()
+    
+    query = data.get('message', '')
+    session_id = data.get('session_id', 'default')
+    uploaded_files = data.get('files', [])
+    audio_input = data.get('audio_input')
+    
+    # Process audio input if provided
+    if audio_input:
+        audio_text = convert_speech_to_text(audio_input)
+        query = f"{query} {audio_text}" if query else audio_text
+    
+    # Process uploaded files
+    file_context = ""
+    if uploaded_files:
+        for file_path in uploaded_files:
+            if os.path.exists(file_path):
+                file_info = process_uploaded_file(file_path)
+                file_context += f"\nFile analysis: {file_info}"
+    
+    # Combine query with file context
+    full_query = f"{query}\n{file_context}" if file_context else query
+    return session_id, query, full_query
+
+def prepare_history(session_id, full_query):
+    """Earlier turns only; the new message goes in once, as the query"""
+    system_prompt = AGENT_PROMPT if executor else SYSTEM_PROMPT
+    return history_window.prepare(chat_sessions, session_id, system_prompt, full_query)
+
+def cache_signature(query, full_query, chat_history):
+    """(vector, version) to cache the answer under, or None when it must not be shared
+
+    Only opening questions without attachments are cached: later turns depend on
+    the conversation and files make a query unique. The agent path is not cached.
+    The vector is None without the semantic cache, so only exact repeats match.
+    """
+    if response_cache is None or executor or chat_history or full_query != query:
+        return None
+    vector = None
+    if query_embedder is not None:
+        try:
+            vector = query_embedder(query)
+        except Exception as e:
+            print(f"⚠️ Query embedding failed: {e}")
+    return vector, CACHE_VERSION
+
+def fallback_response():
+    return SymptomResponse(
+        probable_cause="I understand you have health concerns, but I could not assess them right now.",
+        severity="moderate",
+        advice="Please consult with a healthcare professional for proper evaluation and treatment."
+    )
+
+def agent_answer(full_query, chat_history):
+    """Run the tool-calling agent; returns its parsed response and raw answer text"""
+    result = executor.invoke({
+        "query": full_query,
+        "chat_history": chat_history
+    })
+    
+    # Extract the response text
+    response_text = result.get("output", "")
+    
+    # Try to parse structured response, fallback to simple response
+    try:
+        # Try to parse as structured JSON
+        # Only the assessment fields come from the model; log_status and audio_response are ours
+        response = SymptomResponse(**parser.parse(response_text).model_dump())
+    except:
+        # Fallback: create a simple structured response
+        response = SymptomResponse(
+            probable_cause=response_text,
+            severity="moderate",  # Default severity
+            advice="Please consult with a healthcare professional for proper evaluation and treatment.",
+            log_status="Consultation logged"
+        )
+    return response, response_text
+
+def finish_turn(session_id, full_query, response, response_text, history_info):
+    """Store the turn and return the response fields sent to the client"""
+    chat_sessions.append(session_id, HumanMessage(content=full_query), AIMessage(content=response_text))
+    return {
+        'probable_cause': response.probable_cause,
+        'severity': response.severity,
+        'advice': response.advice,
+        'log_status': response.log_status,
+        'prompt_tokens': history_info['prompt_tokens'],
+        'history_messages': history_info['history_messages'],
+        'summarized_messages': history_info['summarized_messages'],
+        'mode': 'agent' if executor else 'structured'
+    }
+
+def speak(response, session_id):
+    """Synthesize the spoken answer; None when TTS fails"""
+    if response.audio_response and os.path.exists(response.audio_response):
+        return response.audio_response
+    audio_path = convert_text_to_speech(f"{response.probable_cause}. {response.advice}", session_id)
+    return audio_path if not audio_path.startswith('Error') else None
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     try:
-        # Handle both JSON and form data
-        if request.is_json:
-            data = request.json
-        else:
-            data = request.form.to_dict()
-        
-        query = data.get('message', '')
-        session_id = data.get('session_id', 'default')
-        uploaded_files = data.get('files', [])
-        audio_input = data.get('audio_input')
-        
-        # Process audio input if provided
-        if audio_input:
-            audio_text = convert_speech_to_text(audio_input)
-            query = f"{query} {audio_text}" if query else audio_text
-        
-        # Process uploaded files
-        file_context = ""
-        if uploaded_files:
-            for file_path in uploaded_files:
-                if os.path.exists(file_path):
-                    file_info = process_uploaded_file(file_path)
-                    file_context += f"\nFile analysis: {file_info}"
-        
-        # Combine query with file context
-        full_query = f"{query}\n{file_context}" if file_context else query
+        session_id, query, full_query = parse_chat_request()
+        chat_history, history_info = prepare_history(session_id, full_query)
+        signature = cache_signature(query, full_query, chat_history)
+        cached = response_cache.lookup(*signature, query=query) if signature else None
         
-        if session_id not in chat_sessions:
-            chat_sessions[session_id] = []
-        
-        chat_history = chat_sessions[session_id]
-        chat_history.append(HumanMessage(content=full_query))
-        
-        result = executor.invoke({
-            "query": full_query,
-            "chat_history": chat_history
-        })
-        
-        # Extract the response text
-        response_text = result.get("output", "")
-        chat_history.append(AIMessage(content=response_text))
+        if executor:
+            response, response_text = agent_answer(full_query, chat_history)
+        else:
+            if cached is not None:
+                response = cached.model_copy()
+            else:
+                try:
+                    response = consult(consultation_chain, full_query, chat_history)
+                except Exception as e:
+                    print(f"⚠️ Structured consultation failed: {e}")
+                    response = fallback_response()
+                    signature = None
+            response.log_status = log_consultation(session_id, full_query, response)
+            response_text = consultation_text(response)
         
-        # Try to parse structured response, fallback to simple response
-        try:
-            # Try to parse as structured JSON
-            response = parser.parse(response_text)
-            probable_cause = response.probable_cause
-            severity = response.severity
-            advice = response.advice
-            log_status = response.log_status
-        except:
-            # Fallback: create a simple structured response
-            probable_cause = response_text
-            severity = "moderate"  # Default severity
-            advice = "Please consult with a healthcare professional for proper evaluation and treatment."
-            log_status = "Consultation logged"
+        fields = finish_turn(session_id, full_query, response, response_text, history_info)
+        fields['cached'] = cached is not None
         
         # Generate audio response
-        audio_text = f"{probable_cause}. {advice}"
-        audio_path = convert_text_to_speech(audio_text, session_id)
+        fields['audio_response'] = speak(response, session_id)
+        
+        if signature and cached is None:
+            response_cache.store(*signature, response.model_copy(update={'audio_response': fields['audio_response']}), query=query)
         
         return jsonify({
             'success': True,
-            'response': {
-                'probable_cause': probable_cause,
-                'severity': severity,
-                'advice': advice,
-                'log_status': log_status,
-                'audio_response': audio_path if not audio_path.startswith('Error') else None
-            }
+            'response': fields
         })
             
     except Exception as e:
@@ -193,6 +286,69 @@ def chat():
             'error': str(e)
         })
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """/api/chat as Server-Sent Events: retrieval, token, final, audio and done"""
+    try:
+        session_id, query, full_query = parse_chat_request()
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+    
+    def events():
+        try:
+            chat_history, history_info = prepare_history(session_id, full_query)
+            signature = cache_signature(query, full_query, chat_history)
+            cached = response_cache.lookup(*signature, query=query) if signature else None
+            yield "retrieval", {
+                'history_messages': history_info['history_messages'],
+                'summarized_messages': history_info['summarized_messages'],
+                'cached': cached is not None
+            }
+            
+            if executor:
+                response, response_text = agent_answer(full_query, chat_history)
+                yield from field_deltas([response], {})
+            else:
+                if cached is not None:
+                    response = cached.model_copy()
+                    yield from field_deltas([response], {})
+                else:
+                    try:
+                        response = yield from stream_consult(consultation_chain, full_query, chat_history)
+                    except Exception as e:
+                        print(f"⚠️ Structured consultation failed: {e}")
+                        response = fallback_response()
+                        signature = None
+                response.log_status = log_consultation(session_id, full_query, response)
+                response_text = consultation_text(response)
+            
+            fields = finish_turn(session_id, full_query, response, response_text, history_info)
+            fields['cached'] = cached is not None
+            yield "final", fields
+            audio_response = speak(response, session_id)
+            yield "audio", {'audio_response': audio_response}
+            
+            if signature and cached is None:
+                response_cache.store(*signature, response.model_copy(update={'audio_response': audio_response}), query=query)
+        except Exception as e:
+            yield "error", {'error': str(e)}
+        yield "done", {}
+    
+    return sse_response(events())
+
+@app.route('/api/cache/status')
+def cache_status():
+    """Semantic response cache statistics"""
+    return jsonify({
+        'response_cache_enabled': response_cache is not None,
+        'statistics': response_cache.get_statistics() if response_cache else {}
+    })
+
+@app.route('/api/sessions/status')
+def sessions_status():
+    """Chat session store size and eviction counts"""
+    return jsonify(chat_sessions.get_statistics())
+
 @app.route('/api/audio/<path:filename>')
 def serve_audio(filename):
     try:
@@ -10,6 +10,7 @@ import json
 
 # Import model configurations
 from models_config import get_model_config, get_available_models
+from session_store import create_session_store
 
 # Try different model providers
 MODEL_PROVIDER = os.getenv('MODEL_PROVIDER', 'huggingface')  # huggingface, ollama, free_api
@@ -175,8 +176,8 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs('static/audio', exist_ok=True)
 
-# Chat Session Storage
-chat_sessions = {}
+# Chat Session Storage (bounded; in-process, SQLite or Redis per CHAT_SESSION_BACKEND)
+chat_sessions = create_session_store()
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -250,8 +251,7 @@ def chat():
         # Combine query with file context
         full_query = f"{query}\n{file_context}" if file_context else query
         
-        if session_id not in chat_sessions:
-            chat_sessions[session_id] = []
+        chat_sessions.touch(session_id)
         
         # Get response from LLM
         try:
@@ -312,6 +312,11 @@ def chat():
             'error': str(e)
         })
 
+@app.route('/api/sessions/status')
+def sessions_status():
+    """Chat session store size and eviction counts"""
+    return jsonify(chat_sessions.get_statistics())
+
 @app.route('/api/audio/<path:filename>')
 def serve_audio(filename):
     try:
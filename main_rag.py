@@ -7,45 +7,103 @@ from flask_cors import CORS
 from werkzeug.utils import secure_filename
 from datetime import datetime
 import json
-
-# Import RAG system
-from rag_system import initialize_rag, get_medical_context, add_medical_knowledge
+import time
+import threading
 
 # Import model configurations
 from models_config import get_model_config, get_available_models
+from schema import SymptomResponse
+from response_cache import create_response_cache
+from session_store import create_session_store
+from streaming import field_deltas, sse_response
 
 # Model configuration
 MODEL_PROVIDER = os.getenv('MODEL_PROVIDER', 'simple')  # simple, huggingface, ollama, free_api
 MODEL_NAME = os.getenv('MODEL_NAME', 'medical_assistant')
 USE_RAG = os.getenv('USE_RAG', 'true').lower() == 'true'
+RAG_WARMUP = os.getenv('RAG_WARMUP', 'background').lower()  # background, eager or lazy
+
+# The RAG system pulls in LangChain, FAISS and the embedding model, so it is
+# imported on first use (or by the warm-up thread) rather than with this module
+def rag_module():
+    import rag_system
+    return rag_system
+
+def get_medical_context(query, categories=None):
+    return rag_module().get_medical_context(query, categories)
+
+def add_medical_knowledge(title, content, category="custom"):
+    return rag_module().add_medical_knowledge(title, content, category)
+
+def route_medical_query(query, include_uploads=False):
+    return rag_module().route_medical_query(query, include_uploads)
+
+def embed_medical_query(query):
+    return rag_module().embed_medical_query(query)
+
+warmup_state = {'status': 'pending' if USE_RAG else 'disabled', 'error': None, 'seconds': None}
+
+def warm_up_rag():
+    """Load the RAG system and embedding model, recording the outcome for /readyz"""
+    print("🧠 Initializing RAG system...")
+    started = time.monotonic()
+    try:
+        rag_module().initialize_rag()
+        warmup_state['status'] = 'ready'
+        print("✅ RAG system ready")
+    except Exception as e:
+        warmup_state['status'] = 'failed'
+        warmup_state['error'] = str(e)
+        print(f"⚠️ RAG warm-up failed: {e}")
+    warmup_state['seconds'] = round(time.monotonic() - started, 2)
 
 def create_rag_enhanced_llm():
     """Create RAG-enhanced LLM"""
     
-    # Initialize RAG system
+    # Initialize RAG system off the import path; requests arriving earlier wait for it
     if USE_RAG:
-        print("🧠 Initializing RAG system...")
-        initialize_rag()
-        print("✅ RAG system ready")
+        if RAG_WARMUP == 'eager':
+            warm_up_rag()
+        elif RAG_WARMUP == 'lazy':
+            warmup_state['status'] = 'lazy'
+        else:
+            threading.Thread(target=warm_up_rag, name="rag-warmup", daemon=True).start()
     
     class RAGEnhancedLLM:
         def __init__(self):
             self.use_rag = USE_RAG
+            # Context fetched ahead of invoke() by the streaming route, per request thread
+            self.prefetched = threading.local()
             
-        def invoke(self, prompt):
-            return self.generate_rag_response(prompt)
+        def invoke(self, prompt, categories=None):
+            return self.generate_rag_response(prompt, categories)
         
-        def generate_rag_response(self, prompt):
+        def lookup_context(self, prompt, categories=None):
+            """Relevant medical context for the prompt ("" without RAG or on failure)"""
+            if not self.use_rag:
+                return ""
+            try:
+                return get_medical_context(prompt, categories)
+            except Exception as e:
+                print(f"⚠️ RAG retrieval failed: {e}")
+                return ""
+        
+        def retrieve(self, prompt, categories=None):
+            """Fetch the context now; the next invoke() for this prompt on this thread reuses it"""
+            context = self.lookup_context(prompt, categories)
+            self.prefetched.value = (prompt, categories, context)
+            return context
+        
+        def generate_rag_response(self, prompt, categories=None):
             """Generate response using RAG + LLM"""
             
             # Get relevant medical context
-            medical_context = ""
-            if self.use_rag:
-                try:
-                    medical_context = get_medical_context(prompt)
-                except Exception as e:
-                    print(f"⚠️ RAG retrieval failed: {e}")
-                    medical_context = ""
+            prefetched = getattr(self.prefetched, 'value', None)
+            self.prefetched.value = None
+            if prefetched and prefetched[:2] == (prompt, categories):
+                medical_context = prefetched[2]
+            else:
+                medical_context = self.lookup_context(prompt, categories)
             
             # Enhanced prompt with medical context
             enhanced_prompt = f"""
@@ -187,13 +245,11 @@ def create_rag_enhanced_llm():
 # Create LLM instance
 llm = create_rag_enhanced_llm()
 
-# Import tools and schema
+# Import tools
 try:
-    from tools import tools, convert_text_to_speech, process_uploaded_file, convert_speech_to_text
-    from schema import SymptomResponse, ChatRequest
+    from tools import convert_text_to_speech, process_uploaded_file, convert_speech_to_text
 except ImportError:
     # Fallback if imports fail
-    tools = []
     def convert_text_to_speech(text, session_id): return None
     def process_uploaded_file(path): return "File processed"
     def convert_speech_to_text(path): return "Speech processed"
@@ -212,8 +268,11 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs('static/audio', exist_ok=True)
 
-# Chat Session Storage
-chat_sessions = {}
+# Chat Session Storage (bounded; in-process, SQLite or Redis per CHAT_SESSION_BACKEND)
+chat_sessions = create_session_store()
+
+# Answers to paraphrased questions, keyed on the query embedding and knowledge base version
+response_cache = create_response_cache()
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -222,6 +281,21 @@ def allowed_file(filename):
 def index():
     return render_template('index.html')
 
+@app.route('/healthz')
+def healthz():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: not ready only while the RAG system is still warming up
+
+    A failed warm-up still reports ready (with rag.status "failed"): the app serves
+    its rule-based fallback, and a 503 would keep the instance out of rotation for good.
+    """
+    ready = warmup_state['status'] != 'pending'
+    return jsonify({'ready': ready, 'rag': dict(warmup_state)}), 200 if ready else 503
+
 @app.route('/api/rag/status')
 def rag_status():
     """Get RAG system status"""
@@ -247,6 +321,14 @@ def rag_status():
             'error': str(e)
         })
 
+@app.route('/api/cache/status')
+def cache_status():
+    """Semantic response cache hit rate and size"""
+    return jsonify({
+        'response_cache_enabled': response_cache is not None,
+        'statistics': response_cache.get_statistics() if response_cache else {}
+    })
+
 @app.route('/api/rag/add', methods=['POST'])
 def add_knowledge():
     """Add new medical knowledge to RAG system"""
@@ -313,89 +395,146 @@ def upload_file():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
+def parse_chat_request():
+    """Session id, the query, the query combined with file analysis, and the uploaded files"""
+    # Handle both JSON and form data
+    if request.is_json:
+        data = request.json
+    else:
+        data = request.form.to_dict()
+    
+    query = data.get('message', '')
+    session_id = data.get('session_id', 'default')
+    uploaded_files = data.get('files', [])
+    
+    # Process uploaded files
+    file_context = ""
+    if uploaded_files:
+        for file_path in uploaded_files:
+            if os.path.exists(file_path):
+                file_info = process_uploaded_file(file_path)
+                file_context += f"\nFile analysis: {file_info}"
+    
+    # Combine query with file context
+    full_query = f"{query}\n{file_context}" if file_context else query
+    return session_id, query, full_query, uploaded_files
+
+def speak(probable_cause, advice, session_id):
+    """Synthesize the spoken answer; None when TTS fails"""
+    audio_path = None
     try:
-        # Handle both JSON and form data
-        if request.is_json:
-            data = request.json
-        else:
-            data = request.form.to_dict()
+        audio_path = convert_text_to_speech(f"{probable_cause}. {advice}", session_id)
+    except:
+        pass
+    return audio_path if audio_path and not audio_path.startswith('Error') else None
+
+def chat_events(session_id, query, full_query, uploaded_files):
+    """One consultation as (event, data) steps: retrieval, token, final and audio"""
+    chat_sessions.touch(session_id)
+    model_info = f"RAG-Enhanced Medical Assistant (RAG: {'Enabled' if USE_RAG else 'Disabled'})"
+    
+    # Get RAG-enhanced response from LLM
+    try:
+        # First-aid and medication questions only search their own knowledge base category
+        categories = None
+        if USE_RAG:
+            try:
+                categories = route_medical_query(query, include_uploads=bool(uploaded_files))
+            except Exception as e:
+                print(f"⚠️ RAG routing failed: {e}")
         
-        query = data.get('message', '')
-        session_id = data.get('session_id', 'default')
-        uploaded_files = data.get('files', [])
+        # Paraphrases of an earlier question reuse its answer; file uploads make a query unique
+        signature = None
+        if USE_RAG and response_cache is not None and not uploaded_files:
+            try:
+                signature = embed_medical_query(query)
+            except Exception as e:
+                print(f"⚠️ Query embedding failed: {e}")
+        cached = response_cache.lookup(*signature, query=query) if signature else None
+        if cached is not None:
+            yield "retrieval", {'rag_enhanced': False, 'cached': True}
+            yield from field_deltas([cached], {})
+            yield "final", {
+                'probable_cause': cached.probable_cause,
+                'severity': cached.severity,
+                'advice': cached.advice,
+                'log_status': cached.log_status,
+                'rag_enhanced': False,
+                'cached': True,
+                'model_info': model_info
+            }
+            audio_path = cached.audio_response
+            if not audio_path or not os.path.exists(audio_path):
+                audio_path = speak(cached.probable_cause, cached.advice, session_id)
+            yield "audio", {'audio_response': audio_path}
+            return
         
-        # Process uploaded files
-        file_context = ""
-        if uploaded_files:
-            for file_path in uploaded_files:
-                if os.path.exists(file_path):
-                    file_info = process_uploaded_file(file_path)
-                    file_context += f"\nFile analysis: {file_info}"
+        # Retrieve first so the client hears about it before generation starts
+        medical_context = llm.retrieve(full_query, categories)
+        yield "retrieval", {'rag_enhanced': bool(medical_context), 'cached': False}
+        response = llm.invoke(full_query, categories=categories)
         
-        # Combine query with file context
-        full_query = f"{query}\n{file_context}" if file_context else query
+        # Handle different response types
+        if isinstance(response, dict):
+            probable_cause = response.get("probable_cause", "")
+            severity = response.get("severity", "moderate")
+            advice = response.get("advice", "")
+            log_status = response.get("log_status", "Consultation logged")
+            rag_used = response.get("rag_context_used", False)
+        else:
+            # Handle string response
+            response_text = str(response)
+            probable_cause = response_text
+            severity = "moderate"
+            advice = "Please consult with a healthcare professional for proper evaluation."
+            log_status = "Consultation logged"
+            rag_used = False
         
-        if session_id not in chat_sessions:
-            chat_sessions[session_id] = []
+        yield from field_deltas([{'probable_cause': probable_cause, 'advice': advice}], {})
+        yield "final", {
+            'probable_cause': probable_cause,
+            'severity': severity,
+            'advice': advice,
+            'log_status': log_status,
+            'rag_enhanced': rag_used,
+            'cached': False,
+            'model_info': model_info
+        }
         
-        # Get RAG-enhanced response from LLM
-        try:
-            response = llm.invoke(full_query)
-            
-            # Handle different response types
-            if isinstance(response, dict):
-                probable_cause = response.get("probable_cause", "")
-                severity = response.get("severity", "moderate")
-                advice = response.get("advice", "")
-                log_status = response.get("log_status", "Consultation logged")
-                rag_used = response.get("rag_context_used", False)
-            else:
-                # Handle string response
-                response_text = str(response)
-                probable_cause = response_text
-                severity = "moderate"
-                advice = "Please consult with a healthcare professional for proper evaluation."
-                log_status = "Consultation logged"
-                rag_used = False
-            
-            # Generate audio response
-            audio_path = None
-            try:
-                audio_text = f"{probable_cause}. {advice}"
-                audio_path = convert_text_to_speech(audio_text, session_id)
-            except:
-                pass
-            
-            return jsonify({
-                'success': True,
-                'response': {
-                    'probable_cause': probable_cause,
-                    'severity': severity,
-                    'advice': advice,
-                    'log_status': log_status,
-                    'audio_response': audio_path if audio_path and not audio_path.startswith('Error') else None,
-                    'rag_enhanced': rag_used,
-                    'model_info': f"RAG-Enhanced Medical Assistant (RAG: {'Enabled' if USE_RAG else 'Disabled'})"
-                }
-            })
-            
-        except Exception as llm_error:
-            print(f"LLM Error: {llm_error}")
-            # Fallback response
-            return jsonify({
-                'success': True,
-                'response': {
-                    'probable_cause': "I understand you have health concerns. I recommend consulting with a healthcare professional for proper evaluation.",
-                    'severity': "moderate",
-                    'advice': "Please seek medical attention from a qualified healthcare provider who can properly assess your symptoms and provide appropriate care.",
-                    'log_status': "Consultation logged",
-                    'audio_response': None,
-                    'rag_enhanced': False,
-                    'model_info': "Fallback mode - RAG temporarily unavailable"
-                }
-            })
+        # Generate audio response
+        audio_response = speak(probable_cause, advice, session_id)
+        yield "audio", {'audio_response': audio_response}
+        
+        if signature:
+            response_cache.store(*signature, SymptomResponse(
+                probable_cause=probable_cause, severity=severity, advice=advice,
+                log_status=log_status, audio_response=audio_response
+            ), query=query)
+        
+    except Exception as llm_error:
+        print(f"LLM Error: {llm_error}")
+        # Fallback response
+        yield "final", {
+            'probable_cause': "I understand you have health concerns. I recommend consulting with a healthcare professional for proper evaluation.",
+            'severity': "moderate",
+            'advice': "Please seek medical attention from a qualified healthcare provider who can properly assess your symptoms and provide appropriate care.",
+            'log_status': "Consultation logged",
+            'rag_enhanced': False,
+            'model_info': "Fallback mode - RAG temporarily unavailable"
+        }
+        yield "audio", {'audio_response': None}
+
+@app.route('/api/chat', methods=['POST'])
+def chat():
+    try:
+        response = {}
+        for event, data in chat_events(*parse_chat_request()):
+            if event in ('final', 'audio'):
+                response.update(data)
+        return jsonify({
+            'success': True,
+            'response': response
+        })
             
     except Exception as e:
         return jsonify({
@@ -403,6 +542,28 @@ def chat():
             'error': str(e)
         })
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """/api/chat as Server-Sent Events: retrieval, token, final, audio and done"""
+    try:
+        request_args = parse_chat_request()
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+    
+    def events():
+        try:
+            yield from chat_events(*request_args)
+        except Exception as e:
+            yield "error", {'error': str(e)}
+        yield "done", {}
+    
+    return sse_response(events())
+
+@app.route('/api/sessions/status')
+def sessions_status():
+    """Chat session store size and eviction counts"""
+    return jsonify(chat_sessions.get_statistics())
+
 @app.route('/api/audio/<path:filename>')
 def serve_audio(filename):
     try:
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+ONNX Runtime embedding backend for the RAG system
+Runs an exported (optionally int8 dynamically quantized) copy of the
+sentence-transformers model on CPU, with a parity check against PyTorch
+
+Usage: python onnx_embeddings.py export [--quantize] [--output-dir DIR]
+       python onnx_embeddings.py parity [--output-dir DIR]
+"""
+
+import os
+import json
+import argparse
+from typing import Dict, List, Optional
+
+import numpy as np
+
+try:
+    import onnxruntime as ort
+    ONNX_AVAILABLE = True
+except ImportError:
+    ONNX_AVAILABLE = False
+
+try:
+    from langchain_core.embeddings import Embeddings
+except ImportError:
+    Embeddings = object
+
+MODEL_FILENAME = "model.onnx"
+QUANTIZED_MODEL_FILENAME = "model.int8.onnx"
+PARITY_FILENAME = "parity.json"
+
+# Minimum cosine similarity to the PyTorch vector for every parity sample
+PARITY_MIN_COSINE = {"fp32": 0.999, "int8": 0.98}
+
+PARITY_TEXTS = [
+    "I have a severe headache and sensitivity to light",
+    "What should I do for a fever in a child?",
+    "Coughing with a sore throat for three days",
+    "How to treat a minor cut or scrape",
+    "Maximum daily dose of acetaminophen for adults",
+    "Wash hands frequently to prevent the spread of infection",
+    "Chest pain radiating to the left arm requires emergency care",
+    "Apply a cold compress to reduce swelling after a sprain"
+]
+
+def default_model_dir(model_name: str) -> str:
+    return os.getenv('RAG_ONNX_MODEL_DIR', os.path.join("models", model_name.split("/")[-1] + "-onnx"))
+
+class OnnxEmbeddings(Embeddings):
+    """Mean-pooled sentence embeddings from an ONNX export of a transformer model"""
+
+    def __init__(self, model_dir: str, model_name: str, quantized: bool = False,
+                 threads: int = 0, batch_size: int = 32, max_length: int = 256):
+        from transformers import AutoTokenizer
+
+        self.model_dir = model_dir
+        self.model_name = model_name
+        self.quantized = quantized
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        model_file = os.path.join(model_dir, QUANTIZED_MODEL_FILENAME if quantized else MODEL_FILENAME)
+        self.session = ort.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    @property
+    def index_model_name(self) -> str:
+        """Name vectors are cached and indexed under
+
+        fp32 ONNX vectors match PyTorch within the parity tolerance, so they
+        share the existing index and embedding cache; int8 ones do not.
+        """
+        return f"{self.model_name}#int8" if self.quantized else self.model_name
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            encoded = self.tokenizer(texts[start:start + self.batch_size], padding=True, truncation=True,
+                                     max_length=self.max_length, return_tensors="np")
+            inputs = {name: encoded[name].astype(np.int64) for name in encoded if name in self.input_names}
+            token_embeddings = self.session.run(None, inputs)[0]
+
+            # Mean pooling over real tokens, then L2 normalization, as sentence-transformers does
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            vectors.append(pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12))
+        return np.concatenate(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(list(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text])[0].tolist()
+
+def export_model(model_name: str, output_dir: str, quantize: bool = False) -> str:
+    """Export the transformer to ONNX (and an int8 copy), saving the tokenizer alongside"""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+    tokenizer.save_pretrained(output_dir)
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    model_file = os.path.join(output_dir, MODEL_FILENAME)
+    with torch.no_grad():
+        torch.onnx.export(model, tuple(sample[name] for name in input_names), model_file,
+                          input_names=input_names, output_names=["last_hidden_state"],
+                          dynamic_axes=dynamic_axes, opset_version=14)
+    print(f"✅ Exported {model_name} to {model_file}")
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantized_file = os.path.join(output_dir, QUANTIZED_MODEL_FILENAME)
+        quantize_dynamic(model_file, quantized_file, weight_type=QuantType.QInt8)
+        print(f"✅ Wrote int8 model to {quantized_file}")
+    return output_dir
+
+def compare_embeddings(reference, candidate, texts: Optional[List[str]] = None, min_cosine: float = 0.999) -> Dict:
+    """Per-text cosine similarity between two embedding models' vectors"""
+    texts = texts or PARITY_TEXTS
+    expected = np.asarray(reference.embed_documents(texts), dtype=np.float32)
+    actual = np.asarray(candidate.embed_documents(texts), dtype=np.float32)
+    expected /= np.maximum(np.linalg.norm(expected, axis=1, keepdims=True), 1e-12)
+    actual /= np.maximum(np.linalg.norm(actual, axis=1, keepdims=True), 1e-12)
+    cosines = (expected * actual).sum(axis=1)
+    return {
+        "samples": len(texts),
+        "min_cosine": round(float(cosines.min()), 6),
+        "mean_cosine": round(float(cosines.mean()), 6),
+        "required_cosine": min_cosine,
+        "passed": bool(cosines.min() >= min_cosine)
+    }
+
+def run_parity_check(model_name: str, model_dir: str, quantized: bool, reference=None) -> Dict:
+    """Compare the ONNX model with the PyTorch one and record the result in the model directory"""
+    if reference is None:
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        reference = HuggingFaceEmbeddings(model_name=model_name, model_kwargs={'device': 'cpu'})
+    variant = "int8" if quantized else "fp32"
+    report = compare_embeddings(reference, OnnxEmbeddings(model_dir, model_name, quantized=quantized),
+                                min_cosine=PARITY_MIN_COSINE[variant])
+
+    parity_file = os.path.join(model_dir, PARITY_FILENAME)
+    results = {}
+    if os.path.exists(parity_file):
+        with open(parity_file, 'r', encoding='utf-8') as f:
+            results = json.load(f)
+    results[variant] = report
+    with open(parity_file, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    return report
+
+def load_parity(model_dir: str, quantized: bool) -> Optional[Dict]:
+    """Stored parity result for a model variant, if it was checked"""
+    parity_file = os.path.join(model_dir, PARITY_FILENAME)
+    if not os.path.exists(parity_file):
+        return None
+    with open(parity_file, 'r', encoding='utf-8') as f:
+        return json.load(f).get("int8" if quantized else "fp32")
+
+def create_onnx_embeddings(model_name: str, quantized: bool = False) -> OnnxEmbeddings:
+    """Load the ONNX backend, exporting and parity-checking the model on first use
+
+    Raises if onnxruntime is missing or the model fails its parity check, so
+    the caller can fall back to PyTorch.
+    """
+    if not ONNX_AVAILABLE:
+        raise ImportError("onnxruntime is not installed. Install with: pip install onnxruntime")
+
+    model_dir = default_model_dir(model_name)
+    model_file = os.path.join(model_dir, QUANTIZED_MODEL_FILENAME if quantized else MODEL_FILENAME)
+    if not os.path.exists(model_file):
+        export_model(model_name, model_dir, quantize=quantized)
+
+    parity = load_parity(model_dir, quantized)
+    if parity is None:
+        parity = run_parity_check(model_name, model_dir, quantized)
+    if not parity["passed"]:
+        raise ValueError(f"ONNX model failed its parity check (min cosine {parity['min_cosine']} "
+                         f"< {parity['required_cosine']})")
+
+    return OnnxEmbeddings(model_dir, model_name, quantized=quantized,
+                          threads=int(os.getenv('RAG_EMBEDDING_THREADS', '0')),
+                          batch_size=int(os.getenv('RAG_EMBEDDING_BATCH', '32')))
+
+def main():
+    from rag_system import EMBEDDING_MODEL_NAME
+
+    parser = argparse.ArgumentParser(description="Export and check the ONNX embedding backend")
+    parser.add_argument("command", choices=["export", "parity"])
+    parser.add_argument("--model", default=EMBEDDING_MODEL_NAME, help="Hugging Face model to export")
+    parser.add_argument("--output-dir", default=None, help="Directory for the ONNX model")
+    parser.add_argument("--quantize", action="store_true", help="Also write / check the int8 model")
+    args = parser.parse_args()
+
+    model_dir = args.output_dir or default_model_dir(args.model)
+    if args.command == "export":
+        export_model(args.model, model_dir, quantize=args.quantize)
+
+    for quantized in ([False, True] if args.quantize else [False]):
+        report = run_parity_check(args.model, model_dir, quantized)
+        status = "✅ passed" if report["passed"] else "❌ failed"
+        print(f"{'int8' if quantized else 'fp32'} parity {status}: min cosine {report['min_cosine']}, "
+              f"mean {report['mean_cosine']} (required {report['required_cosine']})")
+
+if __name__ == "__main__":
+    main()
@@ -9,13 +9,20 @@ import json
 from datetime import datetime
 from typing import Dict, List
 
+from vector_manifest import load_manifest, diff_documents, manifest_chunk_count, content_hash
+from chunking import split_entry_text
+from embedding_cache import EmbeddingCache
+from knowledge_store import KnowledgeStore
+
 class RAGDatabaseManager:
     """Manager for RAG database operations"""
     
     def __init__(self, knowledge_base_path: str = "medical_knowledge"):
         self.knowledge_base_path = knowledge_base_path
-        self.json_file = os.path.join(knowledge_base_path, "medical_knowledge.json")
+        self.knowledge_store = KnowledgeStore(knowledge_base_path)
+        self.json_file = self.knowledge_store.snapshot_file
         self.vector_store_path = os.path.join(knowledge_base_path, "vector_store")
+        self.embedding_cache_path = os.getenv('RAG_EMBEDDING_CACHE_DIR', os.path.join(knowledge_base_path, "embedding_cache"))
     
     def get_database_info(self) -> Dict:
         """Get comprehensive database information"""
@@ -23,7 +30,7 @@ class RAGDatabaseManager:
             "database_location": os.path.abspath(self.knowledge_base_path),
             "json_database": os.path.abspath(self.json_file),
             "vector_database": os.path.abspath(self.vector_store_path),
-            "database_exists": os.path.exists(self.json_file),
+            "database_exists": self.knowledge_store.exists(),
             "vector_store_exists": os.path.exists(self.vector_store_path),
             "total_size_mb": 0,
             "files": []
@@ -51,11 +58,10 @@ class RAGDatabaseManager:
     
     def get_knowledge_statistics(self) -> Dict:
         """Get statistics about the knowledge base content"""
-        if not os.path.exists(self.json_file):
+        if not self.knowledge_store.exists():
             return {"error": "Knowledge base not found"}
         
-        with open(self.json_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = self.knowledge_store.load()
         
         # Analyze content
         categories = {}
@@ -78,11 +84,10 @@ class RAGDatabaseManager:
     
     def search_knowledge_base(self, query: str) -> List[Dict]:
         """Search the knowledge base for specific content"""
-        if not os.path.exists(self.json_file):
+        if not self.knowledge_store.exists():
             return []
         
-        with open(self.json_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = self.knowledge_store.load()
         
         query_lower = query.lower()
         results = []
@@ -126,14 +131,6 @@ class RAGDatabaseManager:
     def add_knowledge_entry(self, title: str, content: str, category: str = "custom") -> bool:
         """Add a new knowledge entry to the database"""
         try:
-            # Load existing data
-            if os.path.exists(self.json_file):
-                with open(self.json_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-            else:
-                data = []
-            
-            # Add new entry
             new_entry = {
                 "category": category,
                 "title": title,
@@ -142,19 +139,123 @@ class RAGDatabaseManager:
                 "source": "manual_addition"
             }
             
-            data.append(new_entry)
-            
-            # Save updated data
-            os.makedirs(self.knowledge_base_path, exist_ok=True)
-            with open(self.json_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-            
+            # Appended to the knowledge base log; the vector store picks it up on next load
+            self.knowledge_store.append([new_entry])
             return True
             
         except Exception as e:
             print(f"Error adding knowledge entry: {e}")
             return False
     
+    def delete_knowledge_entries(self, title: str) -> int:
+        """Delete every entry with the given title, returning how many were removed"""
+        entry_ids = [item["id"] for item in self.knowledge_store.load() if item.get('title') == title]
+        self.knowledge_store.delete(entry_ids)
+        return len(entry_ids)
+    
+    def compact_knowledge_base(self) -> int:
+        """Fold the knowledge base log into the JSON snapshot"""
+        return self.knowledge_store.compact()
+    
+    def check_index_consistency(self) -> Dict:
+        """Report drift between the JSON knowledge base and the vector store without rebuilding"""
+        if not self.knowledge_store.exists():
+            return {"error": "Knowledge base not found"}
+        
+        manifest = load_manifest(self.vector_store_path)
+        if manifest is None:
+            return {
+                "in_sync": False,
+                "manifest_exists": False,
+                "message": "No manifest found; the vector store will be rebuilt on next startup"
+            }
+        
+        diff = diff_documents(manifest, self.knowledge_store.load())
+        report = {
+            "in_sync": diff["in_sync"],
+            "manifest_exists": True,
+            "index_config": manifest["index_config"],
+            "last_updated": manifest.get("updated"),
+            "added_documents": diff["added"],
+            "changed_documents": diff["changed"],
+            "removed_documents": diff["removed"],
+            "unchanged_documents": diff["unchanged"],
+            "manifest_chunks": manifest_chunk_count(manifest)
+        }
+        
+        # Compare against the vectors actually stored, when FAISS is installed
+        index_file = os.path.join(self.vector_store_path, "index.faiss")
+        try:
+            import faiss
+            report["index_vectors"] = faiss.read_index(index_file).ntotal
+            if report["index_vectors"] != report["manifest_chunks"]:
+                report["in_sync"] = False
+        except ImportError:
+            report["index_vectors"] = None
+        except Exception as e:
+            report["index_vectors"] = None
+            report["in_sync"] = False
+            report["index_error"] = str(e)
+        
+        return report
+    
+    def print_consistency_report(self):
+        """Print the index consistency report"""
+        report = self.check_index_consistency()
+        print("🔍 Index Consistency Check")
+        print("=" * 50)
+        
+        if "error" in report:
+            print(f"❌ {report['error']}")
+            return
+        if not report["manifest_exists"]:
+            print(f"⚠️ {report['message']}")
+            return
+        
+        print(f"{'✅ In sync' if report['in_sync'] else '⚠️ Drift detected'}")
+        print(f"   Embedding model: {report['index_config'].get('embedding_model')}")
+        print(f"   Last updated: {report['last_updated']}")
+        print(f"   Unchanged documents: {report['unchanged_documents']}")
+        print(f"   Manifest chunks: {report['manifest_chunks']}")
+        print(f"   Index vectors: {report['index_vectors'] if report['index_vectors'] is not None else 'unknown'}")
+        for label, key in [("Added", "added_documents"), ("Changed", "changed_documents"), ("Removed", "removed_documents")]:
+            if report[key]:
+                print(f"   {label}: {', '.join(report[key])}")
+    
+    def prune_embedding_cache(self) -> Dict:
+        """Evict cached vectors of retired models and compact the current model to the knowledge base's chunks"""
+        if not os.path.exists(self.embedding_cache_path):
+            return {"error": "Embedding cache not found"}
+        
+        manifest = load_manifest(self.vector_store_path)
+        if manifest is None:
+            return {"error": "No manifest found; rebuild the vector store before pruning"}
+        
+        cache = EmbeddingCache(self.embedding_cache_path)
+        current_model = manifest["index_config"]["embedding_model"]
+        freed = 0
+        evicted = []
+        for model_name in cache.list_models():
+            if model_name != current_model:
+                freed += cache.evict_model(model_name)
+                evicted.append(model_name)
+        
+        keep = {chunk_hash for doc in manifest["documents"].values() for chunk_hash in doc["chunks"].values()}
+        # Entries logged since the last index checkpoint are not in the manifest yet; keep their vectors too
+        config = manifest["index_config"]
+        diff = diff_documents(manifest, self.knowledge_store.load())
+        for doc_key in diff["added"] + diff["changed"]:
+            texts = split_entry_text(diff["items"][doc_key]['content'], config["chunking"],
+                                     config["chunk_size"], config["chunk_overlap"])
+            keep.update(content_hash(text) for text in texts)
+        freed += cache.compact(current_model, list(keep))
+        
+        return {
+            "evicted_models": evicted,
+            "freed_mb": round(freed / (1024 * 1024), 2),
+            "statistics": cache.get_statistics()
+        }
+    
     def backup_database(self, backup_path: str = None) -> str:
         """Create a backup of the RAG database"""
         if backup_path is None:
@@ -162,9 +263,8 @@ class RAGDatabaseManager:
             backup_path = f"rag_backup_{timestamp}.json"
         
         try:
-            if os.path.exists(self.json_file):
-                with open(self.json_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
+            if self.knowledge_store.exists():
+                data = self.knowledge_store.load()
                 
                 backup_data = {
                     "backup_date": datetime.now().isoformat(),
@@ -200,9 +300,7 @@ class RAGDatabaseManager:
                 knowledge_data = backup_data
             
             # Save restored data
-            os.makedirs(self.knowledge_base_path, exist_ok=True)
-            with open(self.json_file, 'w', encoding='utf-8') as f:
-                json.dump(knowledge_data, f, indent=2, ensure_ascii=False)
+            self.knowledge_store.replace_all(knowledge_data)
             
             return f"Database restored from {backup_path}"
             
@@ -257,9 +355,12 @@ def main():
         print("3. Add knowledge entry")
         print("4. Backup database")
         print("5. Restore database")
-        print("6. Exit")
+        print("6. Check index consistency")
+        print("7. Prune embedding cache")
+        print("8. Compact knowledge base log")
+        print("9. Exit")
         
-        choice = input("\nEnter your choice (1-6): ").strip()
+        choice = input("\nEnter your choice (1-9): ").strip()
         
         if choice == "1":
             manager.print_database_summary()
@@ -305,6 +406,22 @@ def main():
                 print(f"🔄 {result}")
         
         elif choice == "6":
+            manager.print_consistency_report()
+        
+        elif choice == "7":
+            result = manager.prune_embedding_cache()
+            if "error" in result:
+                print(f"❌ {result['error']}")
+            else:
+                print(f"🧹 Freed {result['freed_mb']} MB")
+                if result['evicted_models']:
+                    print(f"   Evicted models: {', '.join(result['evicted_models'])}")
+        
+        elif choice == "8":
+            folded = manager.compact_knowledge_base()
+            print(f"🗜️ Folded {folded} log records into the snapshot")
+        
+        elif choice == "9":
             print("👋 Goodbye!")
             break
         
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Single-file RAG snapshot
+Packs the chunk store, keyword index, manifest and knowledge base entries into one
+versioned, read-only file that opens without embedding anything, for serverless
+cold starts and container images. The FAISS index is written beside it as a plain
+index file, so it can be memory-mapped (RAG_MMAP_INDEX) and shared between workers
+
+Usage: python rag_snapshot.py build [--knowledge-base medical_knowledge] [--output FILE]
+       python rag_snapshot.py info FILE
+"""
+
+import os
+import json
+import mmap
+import struct
+import hashlib
+import argparse
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from chunk_store import MappedDocstore, CHUNKS_FILENAME, OFFSETS_FILENAME, IDS_FILENAME
+from keyword_index import KEYWORD_INDEX_FILENAME
+from vector_index import INDEX_PARAMS_FILENAME
+from vector_manifest import MANIFEST_FILENAME
+
+SNAPSHOT_MAGIC = b"MEDRAG\0\1"
+SNAPSHOT_VERSION = 2
+SNAPSHOT_FILENAME = "rag_snapshot.bin"
+KNOWLEDGE_SECTION = "knowledge.json"
+SECTION_FILES = [CHUNKS_FILENAME, OFFSETS_FILENAME, IDS_FILENAME,
+                 KEYWORD_INDEX_FILENAME, INDEX_PARAMS_FILENAME, MANIFEST_FILENAME]
+
+# Sections start on 64-byte boundaries so numeric arrays can be viewed in place
+ALIGNMENT = 64
+
+def _aligned(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def index_path_for(snapshot_path: str) -> str:
+    """FAISS index file that goes with a snapshot: rag_snapshot.bin -> rag_snapshot.faiss"""
+    return os.path.splitext(snapshot_path)[0] + ".faiss"
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def write_snapshot(vector_store_path: str, output_path: str, knowledge: List[Dict]) -> Dict:
+    """Pack a saved vector store and the knowledge base entries into a snapshot and its index file"""
+    # The index goes first, so a snapshot never points at an index from another build
+    index_path = index_path_for(output_path)
+    with open(os.path.join(vector_store_path, "index.faiss"), 'rb') as f:
+        index_bytes = f.read()
+    with open(f"{index_path}.tmp", 'wb') as f:
+        f.write(index_bytes)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{index_path}.tmp", index_path)
+
+    sections = {}
+    for name in SECTION_FILES:
+        with open(os.path.join(vector_store_path, name), 'rb') as f:
+            sections[name] = f.read()
+    sections[KNOWLEDGE_SECTION] = json.dumps(knowledge, ensure_ascii=False).encode('utf-8')
+
+    manifest = json.loads(sections[MANIFEST_FILENAME])
+    header = {
+        "version": SNAPSHOT_VERSION,
+        "created": datetime.now().isoformat(),
+        # Identifies the indexed content, so deployments can tell snapshots apart
+        "content_hash": hashlib.sha256(json.dumps(manifest["documents"], sort_keys=True).encode('utf-8')).hexdigest(),
+        "index_config": manifest["index_config"],
+        "documents": len(manifest["documents"]),
+        "index_file": os.path.basename(index_path),
+        "index_size": len(index_bytes),
+        "index_sha256": hashlib.sha256(index_bytes).hexdigest(),
+        "sections": {}
+    }
+    offset = 0
+    for name, data in sections.items():
+        header["sections"][name] = [offset, len(data)]
+        offset = _aligned(offset + len(data))
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _aligned(len(SNAPSHOT_MAGIC) + 8 + len(header_bytes))
+
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for name, data in sections.items():
+            f.seek(data_start + header["sections"][name][0])
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, output_path)
+    return header
+
+class RAGSnapshot:
+    """Read-only view of a snapshot file; sections are slices of one memory map"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a RAG snapshot")
+        header_length = struct.unpack_from('<Q', self.map, len(SNAPSHOT_MAGIC))[0]
+        header_start = len(SNAPSHOT_MAGIC) + 8
+        self.header = json.loads(self.map[header_start:header_start + header_length])
+        if self.header["version"] != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {self.header['version']}")
+        self.data_start = _aligned(header_start + header_length)
+
+    def section(self, name: str) -> memoryview:
+        offset, length = self.header["sections"][name]
+        start = self.data_start + offset
+        return memoryview(self.map)[start:start + length]
+
+    def read_json(self, name: str):
+        return json.loads(bytes(self.section(name)))
+
+    def load_index(self, mmap_index: bool = False):
+        """Open the FAISS index file; memory-mapped read-only pages are shared by every process
+
+        Raises ValueError when the index file does not belong to this snapshot.
+        """
+        import faiss
+        index_path = os.path.join(os.path.dirname(os.path.abspath(self.path)), self.header["index_file"])
+        # Same-sized indexes of other builds are common (flat, same chunk count), so compare content
+        if os.path.getsize(index_path) != self.header["index_size"] or file_sha256(index_path) != self.header["index_sha256"]:
+            raise ValueError(f"{index_path} does not match the snapshot; rebuild it")
+        if mmap_index:
+            mmap_flag = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP)
+            return faiss.read_index(index_path, mmap_flag | faiss.IO_FLAG_READ_ONLY)
+        return faiss.read_index(index_path)
+
+    def open_docstore(self) -> MappedDocstore:
+        """Chunk store served straight from the mapped file"""
+        ids = bytes(self.section(IDS_FILENAME)).decode('utf-8').split()
+        offsets = np.frombuffer(self.section(OFFSETS_FILENAME), dtype='<i8')
+        return MappedDocstore.from_buffers(ids, offsets, self.section(CHUNKS_FILENAME))
+
+def build_snapshot(knowledge_base_path: str = "medical_knowledge", output_path: Optional[str] = None) -> Dict:
+    """Bring the vector store up to date with the knowledge base and pack it"""
+    from rag_system import MedicalRAGSystem
+
+    # Always build from the knowledge base itself, never from an older snapshot
+    os.environ.pop('RAG_SNAPSHOT', None)
+    rag = MedicalRAGSystem(knowledge_base_path)
+    if rag.vector_store is None:
+        raise RuntimeError("No vector store was built; check that the embedding model is available")
+
+    rag.checkpoint_vector_store(force=True)
+    output_path = output_path or os.path.join(knowledge_base_path, SNAPSHOT_FILENAME)
+    return write_snapshot(rag.vector_store_path, output_path, rag.knowledge_store.load())
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or inspect a single-file RAG snapshot")
+    parser.add_argument("command", choices=["build", "info"])
+    parser.add_argument("path", nargs="?", default=None, help="Snapshot file (info)")
+    parser.add_argument("--knowledge-base", default="medical_knowledge", help="Knowledge base directory")
+    parser.add_argument("--output", default=None, help="Snapshot file to write")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        output = args.output or os.path.join(args.knowledge_base, SNAPSHOT_FILENAME)
+        header = build_snapshot(args.knowledge_base, output)
+        size = os.path.getsize(output) + os.path.getsize(index_path_for(output))
+        print(f"✅ Wrote {output} and {index_path_for(output)} ({size / (1024 * 1024):.2f} MB)")
+    else:
+        header = RAGSnapshot(args.path or os.path.join(args.knowledge_base, SNAPSHOT_FILENAME)).header
+
+    print(f"📦 Snapshot v{header['version']} {header['content_hash'][:12]} built {header['created']}")
+    print(f"   {header['documents']} documents, embedding model {header['index_config']['embedding_model']}")
+
+if __name__ == "__main__":
+    main()
@@ -5,48 +5,235 @@ Provides accurate medical information by retrieving relevant knowledge
 
 import os
 import json
-from typing import List, Dict, Optional
+import shutil
+import time
+import atexit
+import weakref
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime
 import numpy as np
 
+from vector_manifest import (
+    new_manifest, load_manifest, save_manifest, diff_documents,
+    document_key, document_keys, chunk_ids, record_document, content_hash, manifest_duplicate_count,
+    manifest_chunk_count
+)
+from embedding_cache import EmbeddingCache
+from knowledge_store import KnowledgeStore
+from ttl_cache import TTLCache
+from text_utils import normalize_query, tokenize, estimate_tokens, jaccard_similarity
+from keyword_index import BM25Index
+from chunking import SPLIT_SEPARATORS, split_text_by_sections, NearDuplicateIndex
+from reranker import create_reranker
+from chunk_store import MappedDocstore, chunk_store_exists, write_chunk_store, migrate_pickle_docstore
+from vector_index import (
+    get_index_settings, get_search_params, create_index, min_training_points, supports_remove,
+    apply_search_params, filtered_search_params, describe_index, load_index_params, save_index_params
+)
+
 # Vector database and embeddings
 try:
     from langchain_community.vectorstores import FAISS, Chroma
     from langchain_community.embeddings import HuggingFaceEmbeddings
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    import faiss
     from langchain.text_splitter import RecursiveCharacterTextSplitter
     from langchain.schema import Document
-    from langchain.retrievers import BM25Retriever, EnsembleRetriever
     VECTOR_DB_AVAILABLE = True
 except ImportError:
     VECTOR_DB_AVAILABLE = False
     print("⚠️ Vector database dependencies not available. Install with: pip install faiss-cpu chromadb")
 
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+
+# Shared pool that runs the dense and sparse legs of hybrid retrieval concurrently
+_search_pool = None
+_search_pool_lock = threading.Lock()
+
+def get_search_pool() -> ThreadPoolExecutor:
+    """Get the thread pool used for parallel retrieval legs"""
+    global _search_pool
+    with _search_pool_lock:
+        if _search_pool is None:
+            workers = int(os.getenv('RAG_SEARCH_THREADS', '4'))
+            _search_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rag-search")
+    return _search_pool
+
+# Reranking gets its own worker so a slow cross-encoder never holds up the retrieval legs
+_rerank_pool = None
+
+def get_rerank_pool() -> ThreadPoolExecutor:
+    """Get the single-thread pool the cross-encoder runs on"""
+    global _rerank_pool
+    with _search_pool_lock:
+        if _rerank_pool is None:
+            _rerank_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-rerank")
+    return _rerank_pool
+
+def normalize_vectors(vectors) -> np.ndarray:
+    """Scale vectors to unit length so FAISS L2 distances map to cosine similarity"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Fuse ranked id lists, scoring each id by the sum of 1 / (k + rank)"""
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, 1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+# Query words that send a question straight to one knowledge base category
+CATEGORY_ROUTES = {
+    "first_aid": {
+        "aid", "cut", "cuts", "burn", "burns", "burned", "bleeding", "wound", "wounds", "sprain", "sprained",
+        "choking", "bite", "bitten", "sting", "stung", "injury", "injured", "scrape", "bandage", "splinter"
+    },
+    "medications": {
+        "medication", "medications", "medicine", "medicines", "drug", "drugs", "dose", "dosage", "pill", "pills",
+        "tablet", "tablets", "ibuprofen", "acetaminophen", "paracetamol", "tylenol", "advil", "motrin",
+        "aspirin", "antibiotic", "antibiotics", "antihistamine", "antihistamines", "prescription"
+    },
+    "prevention": {
+        "prevent", "prevention", "preventing", "vaccine", "vaccines", "vaccination", "hygiene", "immunity"
+    }
+}
+UPLOADED_CATEGORY = "uploaded_document"
+
+def _checkpoint_on_exit(ref):
+    """Save a RAG system's unsaved index changes at interpreter exit"""
+    rag = ref()
+    if rag is None or not os.path.exists(rag.vector_store_path):
+        return
+    try:
+        rag.checkpoint_vector_store(force=True)
+    except Exception as e:
+        print(f"⚠️ Could not save the vector store at exit: {e}")
+
 class MedicalRAGSystem:
     """RAG system for medical knowledge retrieval"""
     
-    def __init__(self, knowledge_base_path: str = "medical_knowledge"):
+    def __init__(self, knowledge_base_path: str = "medical_knowledge", embeddings=None, reranker=None):
         self.knowledge_base_path = knowledge_base_path
+        self.knowledge_file = os.path.join(knowledge_base_path, "medical_knowledge.json")
+        self.knowledge_store = KnowledgeStore(knowledge_base_path)
+        self.vector_store_path = os.path.join(knowledge_base_path, "vector_store")
         self.vector_store = None
         self.retriever = None
-        self.embeddings = None
+        self.embeddings = embeddings
+        self.text_splitter = None
+        self.manifest = None
         self.documents = []
+        self.known_document_keys = set()
+        self.pending_documents = []
+        
+        # Index checkpoints: changes are saved once enough chunks were added or enough time
+        # passed; until then the knowledge base log is the record, replayed on the next load
+        self.checkpoint_chunks = int(os.getenv('RAG_INDEX_CHECKPOINT_CHUNKS', '256'))
+        self.checkpoint_seconds = float(os.getenv('RAG_INDEX_CHECKPOINT_SECONDS', '60'))
+        self.unsaved_chunks = 0
+        self.vector_store_dirty = False
+        self.last_checkpoint = time.monotonic()
+        atexit.register(_checkpoint_on_exit, weakref.ref(self))
+        
+        # FAISS index type (flat / ivf_flat / ivf_pq / hnsw) and its search tuning
+        self.index_settings = get_index_settings()
+        self.index_params = {"type": "flat"}
+        
+        # Map index.faiss and the chunk store read-only so workers share page cache
+        self.use_mmap = os.getenv('RAG_MMAP_INDEX', 'false').lower() == 'true'
+        self.index_mmapped = False
+        
+        # Prebuilt single-file snapshot (rag_snapshot.py); serving from it is read-only
+        self.snapshot_path = os.getenv('RAG_SNAPSHOT')
+        self.snapshot = None
+        self.read_only = False
+        
+        # BM25 index over the same chunk ids as the vector store
+        self.keyword_index = BM25Index()
+        self.keyword_chunks = {}
+        
+        # Chunk ids per category, so retrieval can search a single partition
+        self.partitions: Dict[str, set] = {}
+        self.chunk_categories: Dict[str, str] = {}
+        # FAISS positions of each category's vectors, kept in step with the index
+        self.partition_positions: Dict[str, List[int]] = {}
+        self.partition_filters = {}
+        self.category_routing = os.getenv('RAG_CATEGORY_ROUTING', 'true').lower() == 'true'
+        
+        # Bumped on every add or rebuild so cached retrieval results go stale
+        self.kb_version = 0
+        cache_size = int(os.getenv('RAG_QUERY_CACHE_SIZE', '1024'))
+        cache_ttl = float(os.getenv('RAG_QUERY_CACHE_TTL', '3600'))
+        self.query_embedding_cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.result_cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        
+        # Retrieval mode: "hybrid" fuses FAISS and BM25, "dense" uses FAISS only
+        self.retrieval_mode = os.getenv('RAG_RETRIEVAL_MODE', 'hybrid').lower()
+        self.leg_timeouts = {
+            'dense': float(os.getenv('RAG_DENSE_TIMEOUT_MS', '500')) / 1000,
+            'sparse': float(os.getenv('RAG_SPARSE_TIMEOUT_MS', '200')) / 1000
+        }
+        self.leg_timeout_counts = {'dense': 0, 'sparse': 0}
+        
+        # Context selection: weak and near-duplicate chunks never reach the LLM
+        self.min_similarity = float(os.getenv('RAG_MIN_SIMILARITY', '0.3'))
+        # BM25 score a keyword match needs to be kept without a passing similarity
+        self.min_keyword_score = float(os.getenv('RAG_MIN_KEYWORD_SCORE', '2.0'))
+        self.duplicate_threshold = float(os.getenv('RAG_DUPLICATE_THRESHOLD', '0.8'))
+        self.context_token_budget = int(os.getenv('RAG_CONTEXT_TOKEN_BUDGET', '600'))
+        
+        # Two-stage retrieval: the first stage fetches candidates, a cross-encoder reorders them in budget
+        self.reranker = reranker if reranker is not None else create_reranker()
+        self.rerank_candidates = int(os.getenv('RAG_RERANK_CANDIDATES', '20'))
+        self.rerank_budget = float(os.getenv('RAG_RERANK_BUDGET_MS', '150')) / 1000
+        self.rerank_counts = {'reranked': 0, 'budget_exceeded': 0, 'failed': 0}
+        
+        # Index time: split at the headings of the text, leave near-duplicate chunks out
+        self.chunking = os.getenv('RAG_CHUNKING', 'sections').lower()
+        self.chunk_dedup_threshold = (float(os.getenv('RAG_CHUNK_DEDUP_THRESHOLD', '0.8'))
+                                      if os.getenv('RAG_CHUNK_DEDUP', 'true').lower() == 'true' else None)
+        self.dedup_index = None
         
         # Create knowledge base directory
         os.makedirs(knowledge_base_path, exist_ok=True)
         
-        # Initialize embeddings
-        self.setup_embeddings()
+        # Reuse previously computed chunk vectors across rebuilds and replicas
+        self.embedding_cache = self.create_embedding_cache()
+        
+        # Initialize embeddings (callers may inject their own model)
+        if self.embeddings is None:
+            self.setup_embeddings()
         
         # Load or create knowledge base
         self.load_medical_knowledge()
         
     def setup_embeddings(self):
-        """Setup embedding model"""
+        """Setup embedding model (RAG_EMBEDDING_BACKEND: torch, onnx or onnx_int8)"""
+        backend = os.getenv('RAG_EMBEDDING_BACKEND', 'torch').lower()
+        threads = int(os.getenv('RAG_EMBEDDING_THREADS', '0'))
+        if VECTOR_DB_AVAILABLE and backend in ('onnx', 'onnx_int8'):
+            try:
+                from onnx_embeddings import create_onnx_embeddings
+                self.embeddings = create_onnx_embeddings(EMBEDDING_MODEL_NAME, quantized=backend == 'onnx_int8')
+                print(f"✅ Embeddings model loaded (ONNX Runtime{', int8' if backend == 'onnx_int8' else ''})")
+                return
+            except Exception as e:
+                print(f"⚠️ ONNX embedding backend unavailable ({e}), using PyTorch")
+        
         try:
             if VECTOR_DB_AVAILABLE:
+                if threads:
+                    import torch
+                    torch.set_num_threads(threads)
                 # Use free Hugging Face embeddings
                 self.embeddings = HuggingFaceEmbeddings(
-                    model_name="sentence-transformers/all-MiniLM-L6-v2",
+                    model_name=EMBEDDING_MODEL_NAME,
                     model_kwargs={'device': 'cpu'}
                 )
                 print("✅ Embeddings model loaded")
@@ -56,6 +243,18 @@ class MedicalRAGSystem:
             print(f"⚠️ Embeddings setup failed: {e}")
             self.embeddings = None
     
+    def create_embedding_cache(self) -> Optional[EmbeddingCache]:
+        """Create the on-disk embedding cache unless disabled with RAG_EMBEDDING_CACHE=false"""
+        if os.getenv('RAG_EMBEDDING_CACHE', 'true').lower() != 'true':
+            return None
+        cache_dir = os.getenv('RAG_EMBEDDING_CACHE_DIR', os.path.join(self.knowledge_base_path, "embedding_cache"))
+        max_mb = os.getenv('RAG_EMBEDDING_CACHE_MAX_MB')
+        try:
+            return EmbeddingCache(cache_dir, max_bytes=int(max_mb) * 1024 * 1024 if max_mb else None)
+        except Exception as e:
+            print(f"⚠️ Embedding cache unavailable: {e}")
+            return None
+    
     def create_medical_knowledge_base(self):
         """Create comprehensive medical knowledge base"""
         medical_knowledge = [
@@ -329,145 +528,818 @@ class MedicalRAGSystem:
         ]
         
         # Save knowledge base
-        knowledge_file = os.path.join(self.knowledge_base_path, "medical_knowledge.json")
-        with open(knowledge_file, 'w', encoding='utf-8') as f:
-            json.dump(medical_knowledge, f, indent=2, ensure_ascii=False)
+        self.knowledge_store.replace_all(medical_knowledge)
         
         print(f"✅ Created medical knowledge base with {len(medical_knowledge)} entries")
-        return medical_knowledge
+        return self.knowledge_store.load()
+    
+    def get_text_splitter(self):
+        """Get the splitter used to chunk documents before embedding"""
+        if self.text_splitter is None:
+            self.text_splitter = RecursiveCharacterTextSplitter(
+                chunk_size=CHUNK_SIZE,
+                chunk_overlap=CHUNK_OVERLAP,
+                separators=SPLIT_SEPARATORS
+            )
+        return self.text_splitter
+    
+    def get_index_config(self) -> Dict:
+        """Settings that invalidate every stored vector when they change"""
+        if hasattr(self.embeddings, 'index_model_name'):
+            embedding_model = self.embeddings.index_model_name
+        elif self.embeddings is not None and not isinstance(self.embeddings, HuggingFaceEmbeddings):
+            embedding_model = type(self.embeddings).__name__
+        else:
+            embedding_model = EMBEDDING_MODEL_NAME
+        return {
+            "embedding_model": embedding_model,
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "chunking": self.chunking,
+            "chunk_dedup": self.chunk_dedup_threshold,
+            "normalized": True,
+            "index": {key: value for key, value in self.index_settings.items() if key != "train_sample"}
+        }
+    
+    def create_document(self, item: Dict) -> "Document":
+        """Convert a knowledge base entry into a LangChain document"""
+        metadata = {
+            'category': item['category'],
+            'title': item['title'],
+            'source': 'medical_knowledge_base'
+        }
+        if 'source_path' in item:
+            metadata['source_path'] = item['source_path']
+        if 'source_hash' in item:
+            metadata['source_hash'] = item['source_hash']
+        return Document(page_content=item['content'], metadata=metadata)
+    
+    def split_document(self, doc_key: str, item: Dict):
+        """Split a knowledge base entry into chunks with content-derived ids"""
+        document = self.create_document(item)
+        document.metadata['doc_key'] = doc_key
+        if self.chunking == 'sections':
+            texts = split_text_by_sections(document.page_content, CHUNK_SIZE, self.get_text_splitter().split_text)
+            chunks = [Document(page_content=text, metadata=dict(document.metadata)) for text in texts]
+        else:
+            chunks = self.get_text_splitter().split_documents([document])
+        ids = chunk_ids(doc_key, [chunk.page_content for chunk in chunks])
+        return ids, chunks
+    
+    def load_dedup_index(self):
+        """Load the persisted MinHash signatures if they cover exactly the indexed chunks"""
+        self.dedup_index = None
+        if self.chunk_dedup_threshold is None:
+            return
+        dedup_index = NearDuplicateIndex.load(self.vector_store_path, self.chunk_dedup_threshold)
+        if dedup_index is not None and set(dedup_index.signatures) == set(self.vector_store.index_to_docstore_id.values()):
+            self.dedup_index = dedup_index
+        else:
+            print("⚠️ Near-duplicate index missing or stale, it will be rebuilt on the next addition")
+    
+    def get_dedup_index(self) -> NearDuplicateIndex:
+        """MinHash index of the chunks already indexed, loaded with the vector store or built on first use"""
+        if self.dedup_index is None:
+            self.dedup_index = NearDuplicateIndex(self.chunk_dedup_threshold)
+            if self.vector_store is not None:
+                indexed = list(self.vector_store.index_to_docstore_id.values())
+            else:
+                indexed = list(self.keyword_chunks)
+            for chunk_id in indexed:
+                self.dedup_index.add(chunk_id, self.get_chunk(chunk_id).page_content)
+        return self.dedup_index
+    
+    def drop_near_duplicates(self, ids: List[str], chunks: List["Document"]):
+        """Leave out chunks that are near copies of indexed chunks (or of earlier ones in the batch)
+
+        Returns the kept ids and chunks, and the dropped ids mapped to the chunks standing in for them.
+        """
+        if self.chunk_dedup_threshold is None:
+            return ids, chunks, {}
+        dedup_index = self.get_dedup_index()
+        kept_ids, kept_chunks, duplicates = [], [], {}
+        for chunk_id, chunk in zip(ids, chunks):
+            stand_ins = dedup_index.find(chunk.page_content)
+            if stand_ins is None:
+                dedup_index.add(chunk_id, chunk.page_content)
+                kept_ids.append(chunk_id)
+                kept_chunks.append(chunk)
+            else:
+                duplicates[chunk_id] = stand_ins
+        return kept_ids, kept_chunks, duplicates
+    
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Embed chunk texts as unit vectors, computing only the vectors missing from the cache"""
+        if self.embedding_cache is None:
+            return normalize_vectors(self.embeddings.embed_documents(texts)).tolist()
+        
+        model_name = self.get_index_config()["embedding_model"]
+        hashes = [content_hash(text) for text in texts]
+        vectors = self.embedding_cache.get_many(model_name, hashes)
+        
+        missing = [i for i, text_hash in enumerate(hashes) if text_hash not in vectors]
+        if missing:
+            new_vectors = self.embeddings.embed_documents([texts[i] for i in missing])
+            missing_hashes = [hashes[i] for i in missing]
+            vectors.update(zip(missing_hashes, np.asarray(new_vectors, dtype=np.float32)))
+            self.embedding_cache.put_many(model_name, missing_hashes, new_vectors)
+        
+        return normalize_vectors([vectors[text_hash] for text_hash in hashes]).tolist()
+    
+    def clear_partitions(self):
+        self.partitions = {}
+        self.chunk_categories = {}
+        self.partition_positions = {}
+        self.partition_filters = {}
+    
+    def assign_partitions(self, categories: Dict[str, str]):
+        """Record the category of each chunk id, updating cached partitions in place"""
+        for chunk_id, category in categories.items():
+            self.chunk_categories[chunk_id] = category
+            self.partitions.setdefault(category, set()).add(chunk_id)
+            for key, partition in self.partition_filters.items():
+                if category in key:
+                    partition['chunk_ids'].add(chunk_id)
+    
+    def load_partitions(self):
+        """Rebuild the category partitions from the manifest"""
+        self.clear_partitions()
+        for doc_key, doc in self.manifest["documents"].items():
+            category = doc.get("category", doc_key.split("/", 1)[0])
+            self.assign_partitions({chunk_id: category for chunk_id in doc["chunks"]})
+        self.index_partition_positions()
+    
+    def index_partition_positions(self):
+        """Recompute each category's FAISS positions from the id map (after removals shift them)"""
+        self.partition_positions = {}
+        if self.vector_store is not None:
+            for position, chunk_id in self.vector_store.index_to_docstore_id.items():
+                self.partition_positions.setdefault(self.chunk_categories.get(chunk_id), []).append(position)
+        self.reset_partition_filters()
+    
+    def reset_partition_filters(self, categories: Optional[set] = None):
+        """Drop the cached FAISS filters of partitions touching some categories (all by default)"""
+        for key, partition in self.partition_filters.items():
+            if categories is None or categories.intersection(key):
+                partition['search_params'] = None
+    
+    def add_chunks(self, ids: List[str], chunks: List["Document"]):
+        """Index chunks for keyword search and, when embeddings are available, vector search"""
+        if not ids:
+            return
+        texts = [chunk.page_content for chunk in chunks]
+        for chunk_id, text in zip(ids, texts):
+            self.keyword_index.add(chunk_id, text)
+        self.assign_partitions({chunk_id: chunk.metadata.get('category', 'unknown')
+                                for chunk_id, chunk in zip(ids, chunks)})
+        
+        if not (VECTOR_DB_AVAILABLE and self.embeddings):
+            self.keyword_chunks.update(zip(ids, chunks))
+            return
+        
+        self.add_vectors(ids, chunks)
+    
+    def add_vectors(self, ids: List[str], chunks: List["Document"]):
+        """Embed chunks into the vector store, creating and training the index if needed"""
+        texts = [chunk.page_content for chunk in chunks]
+        vectors = self.embed_texts(texts)
+        metadatas = [chunk.metadata for chunk in chunks]
+        
+        self.ensure_writable_index()
+        if self.vector_store is None:
+            index, self.index_params = create_index(self.index_settings, np.asarray(vectors, dtype=np.float32))
+            self.index_params.update({k: v for k, v in get_search_params().items() if v is not None})
+            apply_search_params(index, self.index_params)
+            self.vector_store = FAISS(self.embeddings, index, InMemoryDocstore(), {})
+            self.partition_positions = {}
+        
+        start = self.vector_store.index.ntotal
+        self.vector_store.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+        categories = set()
+        for position, chunk_id in enumerate(ids, start):
+            category = self.chunk_categories.get(chunk_id)
+            self.partition_positions.setdefault(category, []).append(position)
+            categories.add(category)
+        self.reset_partition_filters(categories)
+        self.unsaved_chunks += len(ids)
+        self.vector_store_dirty = True
+    
+    def remove_chunks(self, ids: List[str]):
+        """Remove chunks from every index"""
+        for chunk_id in ids:
+            self.keyword_index.remove(chunk_id)
+            self.keyword_chunks.pop(chunk_id, None)
+            if self.dedup_index is not None:
+                self.dedup_index.remove(chunk_id)
+            category = self.chunk_categories.pop(chunk_id, None)
+            if category is not None:
+                self.partitions[category].discard(chunk_id)
+                for key, partition in self.partition_filters.items():
+                    if category in key:
+                        partition['chunk_ids'].discard(chunk_id)
+        if self.vector_store is None:
+            return
+        
+        self.vector_store_dirty = True
+        self.ensure_writable_index()
+        if supports_remove(self.vector_store.index):
+            self.vector_store.delete(ids)
+            self.index_partition_positions()
+        else:
+            # HNSW cannot delete in place: rebuild from the surviving chunks (vectors come from the cache)
+            stale = set(ids)
+            remaining = [chunk_id for chunk_id in self.vector_store.index_to_docstore_id.values() if chunk_id not in stale]
+            chunks = [self.get_chunk(chunk_id) for chunk_id in remaining]
+            self.vector_store = None
+            self.partition_positions = {}
+            if remaining:
+                self.add_vectors(remaining, chunks)
+    
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """Tune IVF nprobe / HNSW efSearch and persist the values with the index"""
+        if nprobe is not None:
+            self.index_params["nprobe"] = nprobe
+        if ef_search is not None:
+            self.index_params["ef_search"] = ef_search
+        if self.vector_store is not None:
+            apply_search_params(self.vector_store.index, self.index_params)
+            if os.path.exists(self.vector_store_path):
+                save_index_params(self.vector_store_path, self.index_params)
+        self.reset_partition_filters()
+        self.kb_version += 1
+    
+    def get_chunk(self, chunk_id: str) -> Optional["Document"]:
+        """Look up an indexed chunk by id"""
+        if self.vector_store is not None:
+            doc = self.vector_store.docstore.search(chunk_id)
+            return doc if isinstance(doc, Document) else None
+        return self.keyword_chunks.get(chunk_id)
+    
+    def load_keyword_index(self):
+        """Load the persisted BM25 index, rebuilding it from the docstore if missing"""
+        keyword_index = BM25Index.load(self.vector_store_path)
+        if keyword_index is None or len(keyword_index) != self.vector_store.index.ntotal:
+            keyword_index = BM25Index()
+            for chunk_id in self.vector_store.index_to_docstore_id.values():
+                keyword_index.add(chunk_id, self.get_chunk(chunk_id).page_content)
+        self.keyword_index = keyword_index
+    
+    def load_snapshot(self) -> bool:
+        """Serve everything from a prebuilt snapshot: nothing is embedded or written at startup"""
+        from rag_snapshot import RAGSnapshot, KNOWLEDGE_SECTION
+        try:
+            snapshot = RAGSnapshot(self.snapshot_path)
+            manifest = snapshot.read_json("manifest.json")
+            if manifest["index_config"]["embedding_model"] != self.get_index_config()["embedding_model"]:
+                print(f"⚠️ RAG snapshot was built with {manifest['index_config']['embedding_model']}, ignoring it")
+                return False
+            
+            docstore = snapshot.open_docstore()
+            self.vector_store = FAISS(self.embeddings, snapshot.load_index(self.use_mmap), docstore,
+                                      dict(enumerate(docstore.ids)))
+            self.index_mmapped = self.use_mmap
+            self.manifest = manifest
+            self.load_partitions()
+            self.index_params = snapshot.read_json("index_params.json")
+            self.index_params.update({k: v for k, v in get_search_params().items() if v is not None})
+            apply_search_params(self.vector_store.index, self.index_params)
+            self.keyword_index = BM25Index.from_data(snapshot.read_json("keyword_index.json"))
+            
+            medical_data = snapshot.read_json(KNOWLEDGE_SECTION)
+            self.documents = [self.create_document(item) for item in medical_data]
+            self.known_document_keys = set(document_keys(medical_data))
+            self.create_retriever()
+        except Exception as e:
+            print(f"⚠️ Could not load RAG snapshot {self.snapshot_path}: {e}")
+            self.vector_store = None
+            return False
+        
+        self.snapshot = snapshot
+        self.read_only = True
+        print(f"✅ Loaded RAG snapshot {snapshot.header['content_hash'][:12]} ({len(self.documents)} documents)")
+        return True
     
     def load_medical_knowledge(self):
         """Load medical knowledge and create vector store"""
-        knowledge_file = os.path.join(self.knowledge_base_path, "medical_knowledge.json")
+        if (self.snapshot_path and os.path.exists(self.snapshot_path)
+                and VECTOR_DB_AVAILABLE and self.embeddings and self.load_snapshot()):
+            self.kb_version += 1
+            return
         
         # Create knowledge base if it doesn't exist
-        if not os.path.exists(knowledge_file):
+        if not self.knowledge_store.exists():
             medical_data = self.create_medical_knowledge_base()
         else:
-            with open(knowledge_file, 'r', encoding='utf-8') as f:
-                medical_data = json.load(f)
+            medical_data = self.knowledge_store.load()
         
         # Convert to documents
-        documents = []
-        for item in medical_data:
-            doc = Document(
-                page_content=item['content'],
-                metadata={
-                    'category': item['category'],
-                    'title': item['title'],
-                    'source': 'medical_knowledge_base'
-                }
-            )
-            documents.append(doc)
+        documents = [self.create_document(item) for item in medical_data]
         
         self.documents = documents
+        self.known_document_keys = set(document_keys(medical_data))
         
         # Create vector store if embeddings available
         if VECTOR_DB_AVAILABLE and self.embeddings:
             try:
-                # Split documents into chunks
-                text_splitter = RecursiveCharacterTextSplitter(
-                    chunk_size=500,
-                    chunk_overlap=50,
-                    separators=["\n\n", "\n", ". ", " "]
-                )
-                
-                split_docs = text_splitter.split_documents(documents)
-                
-                # Create FAISS vector store
-                vector_store_path = os.path.join(self.knowledge_base_path, "vector_store")
-                
-                if os.path.exists(vector_store_path):
-                    # Load existing vector store
-                    self.vector_store = FAISS.load_local(
-                        vector_store_path, 
-                        self.embeddings,
-                        allow_dangerous_deserialization=True
-                    )
+                manifest = load_manifest(self.vector_store_path)
+                if (os.path.exists(self.vector_store_path) and manifest
+                        and manifest["index_config"] == self.get_index_config()
+                        and self.open_saved_vector_store(manifest)):
+                    # Bring the existing vector store in line with the JSON
+                    self.manifest = manifest
+                    self.load_partitions()
+                    self.index_params = load_index_params(self.vector_store_path)
+                    self.index_params.update({k: v for k, v in get_search_params().items() if v is not None})
+                    apply_search_params(self.vector_store.index, self.index_params)
+                    self.load_keyword_index()
+                    self.load_dedup_index()
                     print("✅ Loaded existing vector store")
+                    self.sync_vector_store(medical_data)
+                    if not self.vector_store.docstore.appendable():
+                        # Chunks an interrupted save appended past the index are dropped
+                        self.save_vector_store()
                 else:
-                    # Create new vector store
-                    self.vector_store = FAISS.from_documents(split_docs, self.embeddings)
-                    self.vector_store.save_local(vector_store_path)
+                    self.build_vector_store(medical_data)
                     print("✅ Created new vector store")
                 
-                # Create retriever
-                self.retriever = self.vector_store.as_retriever(
-                    search_type="similarity",
-                    search_kwargs={"k": 3}
-                )
+                self.create_retriever()
                 
             except Exception as e:
                 print(f"⚠️ Vector store creation failed: {e}")
                 self.vector_store = None
                 self.retriever = None
         
+        # Without a vector store the keyword index is built in memory
+        if self.vector_store is None:
+            self.keyword_index = BM25Index()
+            self.keyword_chunks = {}
+            self.clear_partitions()
+            self.dedup_index = None
+            for doc_key, item in zip(document_keys(medical_data), medical_data):
+                ids, chunks, _ = self.drop_near_duplicates(*self.split_document(doc_key, item))
+                self.add_chunks(ids, chunks)
+        
+        self.kb_version += 1
         print(f"✅ Loaded {len(documents)} medical documents")
     
-    def retrieve_relevant_info(self, query: str, max_results: int = 3) -> List[Dict]:
-        """Retrieve relevant medical information for a query"""
-        if self.retriever:
+    def open_saved_vector_store(self, manifest: Dict) -> bool:
+        """Open the saved vector store, or return False when its files are out of step with the manifest"""
+        if not chunk_store_exists(self.vector_store_path):
+            migrate_pickle_docstore(self.vector_store_path)
+        try:
+            vector_store = self.open_vector_store()
+        except ValueError as e:
+            print(f"⚠️ {e}, rebuilding the vector store")
+            return False
+        if vector_store.index.ntotal != manifest_chunk_count(manifest):
+            print("⚠️ Index and manifest disagree (interrupted save?), rebuilding the vector store")
+            return False
+        self.vector_store = vector_store
+        return True
+    
+    def open_vector_store(self) -> "FAISS":
+        """Open index.faiss and the chunk store; chunks are only read when a search returns them"""
+        index_file = os.path.join(self.vector_store_path, "index.faiss")
+        if self.use_mmap:
+            mmap_flag = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP)
+            index = faiss.read_index(index_file, mmap_flag | faiss.IO_FLAG_READ_ONLY)
+            self.index_mmapped = True
+        else:
+            index = faiss.read_index(index_file)
+            self.index_mmapped = False
+        docstore = MappedDocstore(self.vector_store_path, count=index.ntotal)
+        return FAISS(self.embeddings, index, docstore, dict(enumerate(docstore.ids)))
+    
+    def ensure_writable_index(self):
+        """Swap a memory-mapped index for a private in-memory copy before modifying it"""
+        if self.index_mmapped:
+            self.vector_store.index = faiss.read_index(os.path.join(self.vector_store_path, "index.faiss"))
+            apply_search_params(self.vector_store.index, self.index_params)
+            self.index_mmapped = False
+    
+    def build_vector_store(self, medical_data: List[Dict]):
+        """Embed the whole knowledge base into a new vector store"""
+        self.manifest = new_manifest(self.get_index_config())
+        self.vector_store = None
+        self.keyword_chunks = {}
+        self.dedup_index = None
+        all_ids, all_chunks = [], []
+        for doc_key, item in zip(document_keys(medical_data), medical_data):
+            ids, chunks, duplicates = self.drop_near_duplicates(*self.split_document(doc_key, item))
+            record_document(self.manifest, doc_key, item, ids, [c.page_content for c in chunks], duplicates)
+            all_ids.extend(ids)
+            all_chunks.extend(chunks)
+        
+        dropped = manifest_duplicate_count(self.manifest)
+        print(f"✅ Split {len(medical_data)} documents into {len(all_ids)} chunks "
+              f"({self.chunking} chunking, {dropped} near duplicates left out)")
+        
+        self.index_mmapped = False
+        self.keyword_index = BM25Index()
+        self.clear_partitions()
+        self.add_chunks(all_ids, all_chunks)
+        self.save_vector_store()
+    
+    def sync_vector_store(self, medical_data: List[Dict]) -> Dict:
+        """Embed new or changed chunks and drop removed ones"""
+        diff = diff_documents(self.manifest, medical_data)
+        if diff["in_sync"]:
+            return diff
+        
+        indexed = self.manifest["documents"]
+        stale_ids, new_ids, new_chunks = [], [], []
+        
+        for doc_key in diff["removed"]:
+            stale_ids.extend(indexed[doc_key]["chunks"])
+        
+        updates = []
+        for doc_key in diff["changed"] + diff["added"]:
+            item = diff["items"][doc_key]
+            old_ids = set(indexed.get(doc_key, {}).get("chunks", {}))
+            ids, chunks = self.split_document(doc_key, item)
+            stale_ids.extend(old_ids - set(ids))
+            updates.append((doc_key, item, old_ids, ids, chunks))
+        
+        # A left-out duplicate loses its stand-in when that chunk goes: re-split everything
+        updated = set(diff["removed"]) | set(diff["changed"])
+        stand_ins = {chunk_id for doc_key, doc in indexed.items() if doc_key not in updated
+                     for chunk_ids in doc.get("duplicates", {}).values() for chunk_id in chunk_ids}
+        if stand_ins & set(stale_ids):
+            print("⚠️ Removed chunks stood in for near duplicates, rebuilding the vector store")
+            self.build_vector_store(medical_data)
+            return diff
+        
+        for doc_key in diff["removed"]:
+            del indexed[doc_key]
+        if stale_ids:
+            self.remove_chunks(stale_ids)
+        
+        for doc_key, item, old_ids, ids, chunks in updates:
+            # Chunks whose text is unchanged keep their existing vectors
+            fresh = [(chunk_id, chunk) for chunk_id, chunk in zip(ids, chunks) if chunk_id not in old_ids]
+            added_ids, added_chunks, duplicates = self.drop_near_duplicates([chunk_id for chunk_id, _ in fresh],
+                                                                            [chunk for _, chunk in fresh])
+            new_ids.extend(added_ids)
+            new_chunks.extend(added_chunks)
+            kept = (old_ids & set(ids)) | set(added_ids)
+            record_document(self.manifest, doc_key, item,
+                            [chunk_id for chunk_id in ids if chunk_id in kept],
+                            [chunk.page_content for chunk_id, chunk in zip(ids, chunks) if chunk_id in kept],
+                            duplicates)
+        
+        if new_chunks:
+            self.add_chunks(new_ids, new_chunks)
+        self.save_vector_store()
+        
+        print(f"✅ Synced vector store: {len(diff['added'])} added, {len(diff['changed'])} changed, "
+              f"{len(diff['removed'])} removed documents ({len(new_chunks)} chunks embedded)")
+        return diff
+    
+    def create_retriever(self):
+        """Create the similarity retriever over the current vector store"""
+        self.retriever = self.vector_store.as_retriever(
+            search_type="similarity",
+            search_kwargs={"k": 3}
+        )
+    
+    def save_vector_store(self):
+        """Persist the vector store and its manifest
+
+        New chunks are appended to the chunk store and the index, keyword index and
+        manifest files are each replaced atomically, manifest last. After removals
+        chunk positions shift, so everything is written to a new directory that is
+        swapped in instead.
+        """
+        # Every worker checkpoints into the same directory (at least at exit), so saves take the KB lock
+        with self.knowledge_store.locked():
+            self.train_pending_index()
+            docstore = self.vector_store.docstore
+            if (isinstance(docstore, MappedDocstore) and docstore.directory == self.vector_store_path
+                    and docstore.appendable() and os.path.exists(self.vector_store_path)):
+                id_map = self.vector_store.index_to_docstore_id
+                count = docstore.append_to_files((id_map[i], docstore.search(id_map[i]))
+                                                 for i in range(len(docstore.ids), len(id_map)))
+                if not self.index_mmapped:
+                    index_file = os.path.join(self.vector_store_path, "index.faiss")
+                    faiss.write_index(self.vector_store.index, f"{index_file}.tmp")
+                    os.replace(f"{index_file}.tmp", index_file)
+                self.write_index_files(self.vector_store_path)
+            else:
+                tmp_path = f"{self.vector_store_path}.tmp-{os.getpid()}"
+                old_path = f"{self.vector_store_path}.old-{os.getpid()}"
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            
+                # Write the complete index next to the live one, then swap directories
+                os.makedirs(tmp_path)
+                faiss.write_index(self.vector_store.index, os.path.join(tmp_path, "index.faiss"))
+                id_map = self.vector_store.index_to_docstore_id
+                write_chunk_store(tmp_path, ((id_map[i], self.get_chunk(id_map[i])) for i in range(len(id_map))))
+                self.write_index_files(tmp_path)
+                if os.path.exists(self.vector_store_path):
+                    os.rename(self.vector_store_path, old_path)
+                os.rename(tmp_path, self.vector_store_path)
+                shutil.rmtree(old_path, ignore_errors=True)
+                count = len(id_map)
+            
+            # Serve chunks from the saved store instead of Python objects in memory
+            self.vector_store.docstore = MappedDocstore(self.vector_store_path, count=count)
+            self.unsaved_chunks = 0
+            self.vector_store_dirty = False
+            self.last_checkpoint = time.monotonic()
+    
+    def train_pending_index(self):
+        """Replace a flat fallback index with the configured IVF index once there are enough vectors to train it
+
+        Vectors keep their positions, so the chunk store and id map are unchanged.
+        """
+        index = self.vector_store.index
+        if (self.index_params.get("type") == self.index_settings["type"]
+                or index.ntotal < min_training_points(self.index_settings, index.ntotal)):
+            return
+        self.ensure_writable_index()
+        vectors = self.vector_store.index.reconstruct_n(0, index.ntotal)
+        trained, params = create_index(self.index_settings, vectors)
+        trained.add(vectors)
+        params.update({key: value for key, value in get_search_params().items() if value is not None})
+        apply_search_params(trained, params)
+        self.vector_store.index = trained
+        self.index_params = params
+        self.reset_partition_filters()
+        self.kb_version += 1
+        print(f"✅ Trained {params['type']} index on {trained.ntotal} vectors")
+    
+    def write_index_files(self, directory: str):
+        """Keyword index, near-duplicate signatures, search params and, last, the manifest"""
+        self.keyword_index.save(directory)
+        if self.dedup_index is not None:
+            self.dedup_index.save(directory)
+        save_index_params(directory, self.index_params)
+        save_manifest(directory, self.manifest)
+    
+    def checkpoint_vector_store(self, force: bool = False) -> bool:
+        """Save unsaved changes if forced or a checkpoint is due; returns whether anything was written"""
+        if self.vector_store is None or not self.vector_store_dirty or self.read_only:
+            return False
+        if not (force or self.unsaved_chunks >= self.checkpoint_chunks
+                or time.monotonic() - self.last_checkpoint >= self.checkpoint_seconds):
+            return False
+        self.save_vector_store()
+        return True
+    
+    def embed_query(self, query: str) -> List[float]:
+        """Embed a query, reusing the vector of earlier identical phrasings"""
+        key = normalize_query(query)
+        vector = self.query_embedding_cache.get(key)
+        if vector is None:
+            vector = normalize_vectors(self.embeddings.embed_query(key)).tolist()
+            self.query_embedding_cache.put(key, vector)
+        return vector
+    
+    def get_partition(self, categories: List[str]) -> Dict:
+        """Chunk ids of some categories, plus a cached FAISS filter for them"""
+        key = tuple(sorted(set(categories)))
+        partition = self.partition_filters.get(key)
+        if partition is None:
+            partition = {
+                'chunk_ids': set().union(*(self.partitions.get(category, set()) for category in key)),
+                'search_params': None
+            }
+            self.partition_filters[key] = partition
+        return partition
+    
+    def dense_search(self, query: str, k: int, categories: Optional[List[str]] = None) -> List[Tuple[str, float]]:
+        """Nearest chunks in the FAISS index as (chunk id, cosine similarity) pairs"""
+        query_vector = np.asarray([self.embed_query(query)], dtype=np.float32)
+        index = self.vector_store.index
+        if categories is None:
+            distances, positions = index.search(query_vector, k)
+        else:
+            # Vectors outside the partition are skipped inside FAISS instead of filtered afterwards
+            partition = self.get_partition(categories)
+            if not partition['chunk_ids']:
+                return []
+            if partition['search_params'] is None:
+                selected = [np.asarray(self.partition_positions.get(category, []), dtype=np.int64)
+                            for category in set(categories)]
+                partition['search_params'] = filtered_search_params(index, np.concatenate(selected))
+            distances, positions = index.search(query_vector, k, params=partition['search_params'][0])
+        id_map = self.vector_store.index_to_docstore_id
+        # Vectors are unit length, so squared L2 distance d gives cosine similarity 1 - d / 2
+        return [(id_map[position], float(np.clip(1.0 - distance / 2.0, -1.0, 1.0)))
+                for distance, position in zip(distances[0], positions[0]) if position != -1]
+    
+    def hybrid_search(self, query: str, k: int, categories: Optional[List[str]] = None) -> List[Dict]:
+        """Run dense and sparse search concurrently and fuse them with reciprocal rank fusion"""
+        allowed = self.get_partition(categories)['chunk_ids'] if categories is not None else None
+        pool = get_search_pool()
+        started = time.monotonic()
+        legs = {
+            'dense': pool.submit(self.dense_search, query, k, categories),
+            'sparse': pool.submit(self.keyword_index.search, query, k, allowed)
+        }
+        
+        # Each leg gets its own deadline; a slow leg is dropped rather than awaited
+        leg_results = {}
+        for name, future in legs.items():
+            remaining = self.leg_timeouts[name] - (time.monotonic() - started)
             try:
-                # Use vector similarity search
-                docs = self.retriever.get_relevant_documents(query)
-                
-                results = []
-                for doc in docs[:max_results]:
-                    results.append({
-                        'content': doc.page_content,
-                        'metadata': doc.metadata,
-                        'relevance_score': 0.8  # Placeholder score
-                    })
-                
-                return results
+                leg_results[name] = future.result(timeout=max(remaining, 0))
+            except FutureTimeoutError:
+                self.leg_timeout_counts[name] += 1
+                print(f"⚠️ {name.capitalize()} retrieval exceeded {self.leg_timeouts[name] * 1000:.0f} ms, skipping it")
+            except Exception as e:
+                print(f"⚠️ {name.capitalize()} retrieval failed: {e}")
+        
+        if not leg_results:
+            raise RuntimeError("all retrieval legs failed")
+        
+        similarities = dict(leg_results.get('dense', []))
+        keyword_scores = dict(leg_results.get('sparse', []))
+        fused = reciprocal_rank_fusion(
+            [[chunk_id for chunk_id, _ in ranking] for ranking in leg_results.values()],
+            k=int(os.getenv('RAG_RRF_K', '60'))
+        )
+        return [{
+            'chunk_id': chunk_id,
+            'score': score,
+            'similarity': similarities.get(chunk_id),
+            'keyword_score': keyword_scores.get(chunk_id)
+        } for chunk_id, score in fused]
+    
+    def select_diverse(self, results: List[Dict], max_results: int, mmr_lambda: float = 0.7) -> List[Dict]:
+        """Pick results MMR-style, trading relevance against overlap with chunks already chosen"""
+        token_sets = [set(tokenize(result['content'])) for result in results]
+        remaining = list(range(len(results)))
+        selected = []
+        
+        while remaining and len(selected) < max_results:
+            best, best_score = None, None
+            for i in list(remaining):
+                redundancy = max((jaccard_similarity(token_sets[i], token_sets[j]) for j in selected), default=0.0)
+                if redundancy >= self.duplicate_threshold:
+                    # Near-identical to a chunk we already have
+                    remaining.remove(i)
+                    continue
+                relevance = 1.0 - i / len(results)
+                mmr_score = mmr_lambda * relevance - (1 - mmr_lambda) * redundancy
+                if best_score is None or mmr_score > best_score:
+                    best, best_score = i, mmr_score
+            if best is None:
+                break
+            selected.append(best)
+            remaining.remove(best)
+        
+        return [results[i] for i in selected]
+    
+    def retrieve_relevant_info(self, query: str, max_results: int = 3, min_similarity: Optional[float] = None,
+                               categories: Optional[List[str]] = None) -> List[Dict]:
+        """Retrieve relevant medical information for a query, best match first
+
+        When categories are given only chunks of those categories are searched.
+        """
+        min_similarity = self.min_similarity if min_similarity is None else min_similarity
+        partition_key = tuple(sorted(set(categories))) if categories is not None else None
+        cache_key = (self.kb_version, normalize_query(query), max_results, min_similarity, partition_key)
+        cached = self.result_cache.get(cache_key)
+        if cached is not None:
+            return list(cached)
+        
+        # Fetch extra candidates so filtering, reranking and de-duplication still leave enough
+        fetch_k = max(max_results * 4, 10)
+        if self.reranker is not None:
+            fetch_k = max(fetch_k, self.rerank_candidates)
+        candidates = None
+        if self.vector_store is not None:
+            try:
+                if self.retrieval_mode == 'hybrid':
+                    candidates = self.hybrid_search(query, fetch_k, categories)
+                else:
+                    candidates = [{'chunk_id': chunk_id, 'score': similarity, 'similarity': similarity, 'keyword_score': None}
+                                  for chunk_id, similarity in self.dense_search(query, fetch_k, categories)]
             except Exception as e:
                 print(f"⚠️ Vector retrieval failed: {e}")
         
         # Fallback to keyword search
-        return self.keyword_search(query, max_results)
-    
-    def keyword_search(self, query: str, max_results: int = 3) -> List[Dict]:
-        """Fallback keyword-based search"""
-        query_lower = query.lower()
-        results = []
+        if candidates is None:
+            allowed = self.get_partition(categories)['chunk_ids'] if categories is not None else None
+            candidates = [{'chunk_id': chunk_id, 'score': score, 'similarity': None, 'keyword_score': score}
+                          for chunk_id, score in self.keyword_index.search(query, fetch_k, allowed)]
         
-        for doc in self.documents:
-            content_lower = doc.page_content.lower()
-            
-            # Simple keyword matching
-            matches = 0
-            query_words = query_lower.split()
-            
-            for word in query_words:
-                if len(word) > 2:  # Skip very short words
-                    matches += content_lower.count(word)
-            
-            if matches > 0:
+        results = []
+        for candidate in candidates:
+            similarity = candidate['similarity']
+            # Strong keyword hits (rare terms such as drug names) survive a weak embedding similarity;
+            # anything else needs the similarity, and keyword-only hits need the BM25 floor
+            keyword_score = candidate['keyword_score']
+            strong_keyword = keyword_score is not None and keyword_score >= self.min_keyword_score
+            if not strong_keyword and (similarity is None or similarity < min_similarity):
+                continue
+            doc = self.get_chunk(candidate['chunk_id'])
+            if doc is not None:
                 results.append({
                     'content': doc.page_content,
                     'metadata': doc.metadata,
-                    'relevance_score': matches / len(query_words),
-                    'matches': matches
+                    'relevance_score': similarity if similarity is not None else candidate['score'],
+                    'similarity': similarity
                 })
         
-        # Sort by relevance
-        results.sort(key=lambda x: x['relevance_score'], reverse=True)
+        # Results reranked late keep first-stage order and are not cached
+        cacheable = True
+        if self.reranker is not None and len(results) > 1:
+            reranked = self.rerank(query, results)
+            if reranked is None:
+                cacheable = False
+            else:
+                results = reranked
         
-        return results[:max_results]
+        results = self.select_diverse(results, max_results)
+        if cacheable:
+            self.result_cache.put(cache_key, results)
+        return list(results)
+    
+    def rerank(self, query: str, results: List[Dict]) -> Optional[List[Dict]]:
+        """Reorder first-stage results by cross-encoder score, or None when it misses the time budget"""
+        future = get_rerank_pool().submit(self.reranker.score, query, [result['content'] for result in results])
+        try:
+            scores = future.result(timeout=self.rerank_budget)
+        except FutureTimeoutError:
+            future.cancel()
+            self.rerank_counts['budget_exceeded'] += 1
+            print(f"⚠️ Reranking exceeded {self.rerank_budget * 1000:.0f} ms, using first-stage order")
+            return None
+        except Exception as e:
+            self.rerank_counts['failed'] += 1
+            print(f"⚠️ Reranking failed: {e}")
+            return None
+        
+        self.rerank_counts['reranked'] += 1
+        order = sorted(range(len(results)), key=lambda i: scores[i], reverse=True)
+        return [dict(results[i], rerank_score=scores[i]) for i in order]
+    
+    def keyword_search(self, query: str, max_results: int = 3, categories: Optional[List[str]] = None) -> List[Dict]:
+        """Keyword search over chunks using the BM25 index"""
+        allowed = self.get_partition(categories)['chunk_ids'] if categories is not None else None
+        results = []
+        for chunk_id, score in self.keyword_index.search(query, max_results, allowed):
+            doc = self.get_chunk(chunk_id)
+            if doc is not None:
+                results.append({
+                    'content': doc.page_content,
+                    'metadata': doc.metadata,
+                    'relevance_score': score
+                })
+        return results
     
-    def get_context_for_query(self, query: str) -> str:
-        """Get relevant context for a medical query"""
-        relevant_docs = self.retrieve_relevant_info(query)
+    def route_query(self, query: str, include_uploads: bool = False) -> Optional[List[str]]:
+        """Pick the categories a question should search, or None for the whole knowledge base
+
+        First-aid, medication and prevention questions only search their own
+        category. Uploaded documents are left out unless the request has files.
+        """
+        if not self.category_routing:
+            return None
+        tokens = set(tokenize(query))
+        categories = [category for category, words in CATEGORY_ROUTES.items()
+                      if tokens & words and self.partitions.get(category)]
+        if categories:
+            if include_uploads and self.partitions.get(UPLOADED_CATEGORY):
+                categories.append(UPLOADED_CATEGORY)
+            return categories
+        if include_uploads or not self.partitions.get(UPLOADED_CATEGORY):
+            return None
+        return [category for category in self.partitions if category != UPLOADED_CATEGORY]
+    
+    def get_context_for_query(self, query: str, token_budget: Optional[int] = None,
+                              categories: Optional[List[str]] = None) -> str:
+        """Get relevant context for a medical query, packed into a token budget in score order"""
+        token_budget = self.context_token_budget if token_budget is None else token_budget
+        relevant_docs = self.retrieve_relevant_info(query, max_results=int(os.getenv('RAG_CONTEXT_CANDIDATES', '6')),
+                                                    categories=categories)
         
         if not relevant_docs:
             return "No specific medical information found for this query."
         
         context_parts = []
-        for i, doc in enumerate(relevant_docs, 1):
-            context_parts.append(f"Medical Reference {i}:")
-            context_parts.append(f"Topic: {doc['metadata'].get('title', 'Unknown')}")
-            context_parts.append(f"Content: {doc['content'][:500]}...")
-            context_parts.append("")
+        used_tokens = 0
+        for doc in relevant_docs:
+            # The knowledge base text is indented; leading whitespace is wasted prompt tokens
+            content = "\n".join(line.strip() for line in doc['content'].splitlines() if line.strip())
+            reference = "\n".join([
+                f"Medical Reference {len(context_parts) + 1}:",
+                f"Topic: {doc['metadata'].get('title', 'Unknown')}",
+                f"Content: {content}",
+                ""
+            ])
+            tokens = estimate_tokens(reference)
+            if used_tokens + tokens > token_budget:
+                if context_parts:
+                    # Smaller, lower-ranked chunks may still fit
+                    continue
+                # Always send at least the best match, trimmed to the budget
+                reference = reference[:token_budget * 4].rstrip() + "..."
+                tokens = token_budget
+            context_parts.append(reference)
+            used_tokens += tokens
         
         return "\n".join(context_parts)
     
@@ -479,53 +1351,143 @@ class MedicalRAGSystem:
             "content": content,
             "added_date": datetime.now().isoformat()
         }
+        self.add_medical_documents([new_doc])
+        print(f"✅ Added new medical document: {title}")
+    
+    def add_medical_documents(self, new_docs: List[Dict], persist: bool = True):
+        """Add knowledge base entries, embedding the chunks of all of them in one batch
+
+        With persist=False the entries are only indexed in memory; persist_knowledge()
+        then writes the JSON and the index once for everything added so far.
+        """
+        if self.read_only:
+            print("⚠️ Serving a read-only RAG snapshot; add documents to the knowledge base and rebuild it")
+            return
         
-        # Load existing knowledge
-        knowledge_file = os.path.join(self.knowledge_base_path, "medical_knowledge.json")
-        if os.path.exists(knowledge_file):
-            with open(knowledge_file, 'r', encoding='utf-8') as f:
-                medical_data = json.load(f)
-        else:
-            medical_data = []
-        
-        # Add new document
-        medical_data.append(new_doc)
+        self.pending_documents.extend(new_docs)
+        self.documents.extend(self.create_document(item) for item in new_docs)
         
-        # Save updated knowledge
-        with open(knowledge_file, 'w', encoding='utf-8') as f:
-            json.dump(medical_data, f, indent=2, ensure_ascii=False)
+        # Without a vector store the whole knowledge base is embedded when persisting
+        if not (VECTOR_DB_AVAILABLE and self.embeddings and self.vector_store is None):
+            try:
+                split = []
+                for item in new_docs:
+                    doc_key = document_key(item, self.known_document_keys)
+                    split.append((doc_key, item) + self.drop_near_duplicates(*self.split_document(doc_key, item)))
+                self.add_chunks([chunk_id for _, _, ids, _, _ in split for chunk_id in ids],
+                                [chunk for _, _, _, chunks, _ in split for chunk in chunks])
+                if self.vector_store is not None:
+                    for doc_key, item, ids, chunks, duplicates in split:
+                        record_document(self.manifest, doc_key, item, ids, [c.page_content for c in chunks], duplicates)
+            except Exception as e:
+                print(f"⚠️ Incremental indexing failed: {e}")
         
-        # Reload knowledge base
-        self.load_medical_knowledge()
+        self.kb_version += 1
+        if persist:
+            self.persist_knowledge()
+    
+    def persist_knowledge(self, checkpoint: bool = False):
+        """Append pending entries to the knowledge base log and save the index when a checkpoint is due
+
+        With checkpoint=True the index is saved now.
+        """
+        if self.pending_documents:
+            # Only the new entries are written; the snapshot is rewritten by compaction
+            self.knowledge_store.append(self.pending_documents)
+            self.pending_documents = []
+            if self.vector_store is not None:
+                self.vector_store_dirty = True
+        elif not checkpoint:
+            return
         
-        print(f"✅ Added new medical document: {title}")
+        try:
+            if VECTOR_DB_AVAILABLE and self.embeddings and self.vector_store is None:
+                self.build_vector_store(self.knowledge_store.load())
+                self.create_retriever()
+            else:
+                self.checkpoint_vector_store(force=checkpoint)
+        except Exception as e:
+            print(f"⚠️ Saving the vector store failed: {e}")
+    
+    def release_document_text(self, start: int = 0) -> int:
+        """Drop the text of saved entries from self.documents, keeping their metadata
+
+        Entries still waiting for persist_knowledge() are kept. Returns the position
+        to start from next time.
+        """
+        end = len(self.documents) - len(self.pending_documents)
+        for position in range(start, end):
+            self.documents[position] = Document(page_content="", metadata=self.documents[position].metadata)
+        return max(start, end)
     
     def get_statistics(self) -> Dict:
         """Get RAG system statistics"""
         return {
             'total_documents': len(self.documents),
             'vector_store_available': self.vector_store is not None,
+            'snapshot': {key: self.snapshot.header[key] for key in ('version', 'created', 'content_hash', 'documents')}
+                        if self.snapshot else None,
+            'index_memory_mapped': self.index_mmapped,
+            'vector_index': describe_index(self.vector_store.index, self.index_params) if self.vector_store is not None else None,
             'embeddings_available': self.embeddings is not None,
             'knowledge_base_path': self.knowledge_base_path,
-            'categories': list(set(doc.metadata.get('category', 'unknown') for doc in self.documents))
+            'embedding_cache': self.embedding_cache.get_statistics() if self.embedding_cache else None,
+            'knowledge_store': self.knowledge_store.get_statistics(),
+            'knowledge_base_version': self.kb_version,
+            'keyword_index_chunks': len(self.keyword_index),
+            'retrieval_mode': self.retrieval_mode,
+            'retrieval_leg_timeouts': dict(self.leg_timeout_counts),
+            'reranker': dict(self.rerank_counts, model=getattr(self.reranker, 'model_name', type(self.reranker).__name__),
+                             candidates=self.rerank_candidates, budget_ms=self.rerank_budget * 1000)
+                        if self.reranker is not None else None,
+            'query_cache': {
+                'embeddings': self.query_embedding_cache.get_statistics(),
+                'results': self.result_cache.get_statistics()
+            },
+            'categories': list(set(doc.metadata.get('category', 'unknown') for doc in self.documents)),
+            'category_partitions': {category: len(ids) for category, ids in self.partitions.items()},
+            'category_routing': self.category_routing,
+            'chunking': {
+                'mode': self.chunking,
+                'dedup_threshold': self.chunk_dedup_threshold,
+                'near_duplicates_left_out': manifest_duplicate_count(self.manifest) if self.manifest else 0
+            }
         }
 
 # Global RAG instance
 rag_system = None
+_rag_lock = threading.Lock()
 
 def initialize_rag():
-    """Initialize the RAG system"""
+    """Initialize the RAG system (requests arriving during a warm-up wait for it)"""
     global rag_system
-    if rag_system is None:
-        rag_system = MedicalRAGSystem()
+    with _rag_lock:
+        if rag_system is None:
+            rag_system = MedicalRAGSystem()
     return rag_system
 
-def get_medical_context(query: str) -> str:
-    """Get medical context for a query"""
+def get_medical_context(query: str, categories: Optional[List[str]] = None) -> str:
+    """Get medical context for a query, optionally from some categories only"""
+    if rag_system is None:
+        initialize_rag()
+    
+    return rag_system.get_context_for_query(query, categories=categories)
+
+def route_medical_query(query: str, include_uploads: bool = False) -> Optional[List[str]]:
+    """Categories the knowledge base search for a query should be limited to"""
     if rag_system is None:
         initialize_rag()
     
-    return rag_system.get_context_for_query(query)
+    return rag_system.route_query(query, include_uploads)
+
+def embed_medical_query(query: str) -> Optional[Tuple[List[float], int]]:
+    """Normalized query vector (shared with retrieval) and the knowledge base version, if embeddings are available"""
+    if rag_system is None:
+        initialize_rag()
+
+    if rag_system.embeddings is None:
+        return None
+    return rag_system.embed_query(query), rag_system.kb_version
 
 def add_medical_knowledge(title: str, content: str, category: str = "custom"):
     """Add new medical knowledge"""
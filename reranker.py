@@ -0,0 +1,46 @@
+"""
+Second-stage reranking for the RAG retriever
+A small cross-encoder scores (query, chunk) pairs on CPU; the RAG system runs it
+under a per-request time budget and keeps the first-stage order when it overruns
+"""
+
+import os
+from typing import List, Optional
+
+DEFAULT_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+class CrossEncoderReranker:
+    """Relevance scores from a sentence-transformers cross-encoder"""
+
+    def __init__(self, model_name: str = DEFAULT_RERANK_MODEL, max_length: int = 256,
+                 batch_size: int = 16, threads: int = 0):
+        from sentence_transformers import CrossEncoder
+
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.model = CrossEncoder(model_name, max_length=max_length, device='cpu')
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        """Higher is more relevant; one score per text"""
+        if not texts:
+            return []
+        scores = self.model.predict([(query, text) for text in texts], batch_size=self.batch_size,
+                                    show_progress_bar=False)
+        return [float(score) for score in scores]
+
+def create_reranker() -> Optional[CrossEncoderReranker]:
+    """Cross-encoder configured from the environment, or None when RAG_RERANK is off or unavailable"""
+    if os.getenv('RAG_RERANK', 'false').lower() != 'true':
+        return None
+    model_name = os.getenv('RAG_RERANK_MODEL', DEFAULT_RERANK_MODEL)
+    try:
+        reranker = CrossEncoderReranker(model_name, max_length=int(os.getenv('RAG_RERANK_MAX_LENGTH', '256')),
+                                        threads=int(os.getenv('RAG_EMBEDDING_THREADS', '0')))
+        print(f"✅ Reranker loaded ({model_name})")
+        return reranker
+    except Exception as e:
+        print(f"⚠️ Reranker unavailable ({e}), using first-stage order")
+        return None
@@ -0,0 +1,184 @@
+"""
+Semantic response cache for the chat endpoints
+Reuses a structured answer when a new query embeds within a cosine threshold
+of an earlier one asked against the same knowledge base version. Queries
+mentioning red-flag symptoms or severity always get a fresh answer: a
+"crushing chest pain" can embed close to a cached mild "chest ache"
+"""
+
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, List, Optional
+
+import numpy as np
+
+from schema import SymptomResponse
+from text_utils import normalize_query
+
+# Severity words and red-flag symptoms that must never be answered from the cache
+RED_FLAG_PATTERN = re.compile(r"\b(" + "|".join([
+    r"severe(ly)?", r"worst", r"extreme(ly)?", r"unbearable", r"excruciating", r"intense", r"crushing",
+    r"sudden(ly)?", r"emergency", r"urgent", r"chest", r"breath(e|ing|less)?", r"choking",
+    r"unconscious", r"faint(ed|ing)?", r"collapsed?", r"seizures?", r"convulsions?", r"confus(ed|ion)",
+    r"stroke", r"heart attack", r"numb(ness)?", r"paraly[sz](ed|is)", r"slurred", r"blood(y)?", r"bleeding",
+    r"vomiting blood", r"suicid(e|al)", r"self[- ]harm", r"overdose", r"poison(ed|ing)?", r"anaphyla\w*",
+    r"swollen (throat|tongue|lips)", r"high fever", r"10[345]", r"39\.\d", r"40(\.\d)?", r"pregnan\w*",
+    r"infant", r"newborn", r"baby"
+]) + r")\b", re.IGNORECASE)
+
+def has_red_flags(query: str) -> bool:
+    """Whether a query mentions severity or a symptom that needs a fresh, careful answer"""
+    return bool(RED_FLAG_PATTERN.search(query or ""))
+
+class SemanticResponseCache:
+    """Bounded LRU of (query vector, kb version) -> SymptomResponse, with a time-to-live
+
+    Query vectors are expected to be L2-normalized (as the RAG system's are),
+    so the dot product is the cosine similarity. Without a vector, entries are
+    keyed on the normalized query text and only exact repeats match.
+    """
+
+    def __init__(self, maxsize: int = 512, ttl: Optional[float] = 3600, threshold: float = 0.95,
+                 skip_severities: Iterable[str] = ("severe",)):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self.skip_severities = {severity.strip().lower() for severity in skip_severities if severity.strip()}
+        self.entries = OrderedDict()
+        self.next_key = 0
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.red_flag_bypasses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, vector: Optional[List[float]], kb_version: Hashable,
+               query: Optional[str] = None) -> Optional[SymptomResponse]:
+        """Cached response of the most similar earlier query, if it is similar enough
+
+        Never answers a query with red flags (see has_red_flags) from the cache.
+        """
+        if query is not None and has_red_flags(query):
+            with self.lock:
+                self.red_flag_bypasses += 1
+            return None
+        query_key = normalize_query(query) if query is not None else None
+        now = time.monotonic()
+        with self.lock:
+            expired = [key for key, entry in self.entries.items()
+                       if entry["expires_at"] is not None and entry["expires_at"] <= now]
+            for key in expired:
+                del self.entries[key]
+
+            candidates = [(key, entry) for key, entry in self.entries.items() if entry["kb_version"] == kb_version]
+            if vector is None:
+                matches = [(key, entry) for key, entry in candidates
+                           if query_key is not None and entry["query_key"] == query_key]
+            else:
+                candidates = [(key, entry) for key, entry in candidates if entry["vector"] is not None]
+                matches = []
+                if candidates:
+                    similarities = np.stack([entry["vector"] for _, entry in candidates]) @ np.asarray(vector, dtype=np.float32)
+                    best = int(np.argmax(similarities))
+                    if similarities[best] >= self.threshold:
+                        matches = [candidates[best]]
+            if matches:
+                key, entry = matches[-1]
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry["response"].model_copy()
+            self.misses += 1
+            return None
+
+    def store(self, vector: Optional[List[float]], kb_version: Hashable, response: SymptomResponse,
+              query: Optional[str] = None) -> bool:
+        """Cache a response unless its severity or the query's red flags opt out; returns whether it was stored"""
+        if self.maxsize <= 0 or (vector is None and query is None):
+            return False
+        if response.severity.strip().lower() in self.skip_severities or (query is not None and has_red_flags(query)):
+            with self.lock:
+                self.skipped += 1
+            return False
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self.lock:
+            self.entries[self.next_key] = {
+                "vector": np.asarray(vector, dtype=np.float32) if vector is not None else None,
+                "query_key": normalize_query(query) if query is not None else None,
+                "kb_version": kb_version,
+                "response": response.model_copy(),
+                "expires_at": expires_at
+            }
+            self.next_key += 1
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return True
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get_statistics(self) -> Dict:
+        """Hit/miss counters, severity opt-outs and current size"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "similarity_threshold": self.threshold,
+            "skip_severities": sorted(self.skip_severities),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "skipped": self.skipped,
+            "red_flag_bypasses": self.red_flag_bypasses,
+            "evictions": self.evictions
+        }
+
+class QueryEmbedder:
+    """Normalized query vectors for apps without the RAG system, from a lazily loaded local model
+
+    Each process loads its own copy of the model, so apps only use it when asked to
+    (RESPONSE_CACHE_SEMANTIC=true in main.py) and otherwise cache exact repeats.
+
+    Returns None (and stays disabled) when the model cannot be loaded.
+    """
+
+    def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2"):
+        self.model_name = model_name
+        self.model = None
+        self.failed = False
+        self.lock = threading.Lock()
+
+    def __call__(self, query: str) -> Optional[List[float]]:
+        if self.failed:
+            return None
+        with self.lock:
+            if self.model is None:
+                try:
+                    from langchain_community.embeddings import HuggingFaceEmbeddings
+                    self.model = HuggingFaceEmbeddings(model_name=self.model_name, model_kwargs={'device': 'cpu'})
+                except Exception as e:
+                    print(f"⚠️ Response cache embeddings unavailable ({e}), answers are not cached")
+                    self.failed = True
+                    return None
+        vector = np.asarray(self.model.embed_query(normalize_query(query)), dtype=np.float32)
+        return (vector / (np.linalg.norm(vector) or 1.0)).tolist()
+
+def create_response_cache() -> Optional[SemanticResponseCache]:
+    """Response cache configured from the environment, or None when RESPONSE_CACHE=false"""
+    if os.getenv('RESPONSE_CACHE', 'true').lower() != 'true':
+        return None
+    return SemanticResponseCache(
+        maxsize=int(os.getenv('RESPONSE_CACHE_SIZE', '512')),
+        ttl=float(os.getenv('RESPONSE_CACHE_TTL', '3600')),
+        threshold=float(os.getenv('RESPONSE_CACHE_THRESHOLD', '0.95')),
+        skip_severities=os.getenv('RESPONSE_CACHE_SKIP_SEVERITIES', 'severe').split(',')
+    )
@@ -1,7 +1,9 @@
 from pydantic import BaseModel, Field
 from typing import Optional, List
 
-class SymptomResponse(BaseModel):
+# The fields the model fills in; the rest of SymptomResponse is set server-side
+class SymptomAssessment(BaseModel):
+    """Assessment of the user's symptom"""
     probable_cause: str = Field(
         ..., description="What could be causing this symptom"
     )
@@ -11,6 +13,8 @@ class SymptomResponse(BaseModel):
     advice: str = Field(
         ..., description="Advice for next steps"
     )
+
+class SymptomResponse(SymptomAssessment):
     log_status: str = Field(
         default="", description="Status of logging"
     )
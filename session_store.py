@@ -0,0 +1,577 @@
+"""
+Bounded chat session store
+Keeps per-session message history under a total byte cap, with idle expiry,
+LRU eviction and a per-session message limit. The in-process backend spreads
+sessions over lock-striped shards so concurrent requests rarely contend; the
+SQLite (WAL) and Redis backends share sessions between gunicorn workers and
+nodes, storing each message as a one-character role code plus its text.
+A leading system message holds the session's rolling summary; trimming never
+drops it and it does not count towards the message limit.
+"""
+
+import os
+import json
+import math
+import time
+import sqlite3
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+# Rough per-message bookkeeping cost on top of the text itself
+MESSAGE_OVERHEAD_BYTES = 64
+
+# Compact role codes for serialized messages; plain strings use PLAIN_CODE
+ROLE_CODES = {'human': 'h', 'ai': 'a', 'system': 's'}
+PLAIN_CODE = '-'
+
+def message_bytes(message: Any) -> int:
+    """Approximate memory held by one chat message"""
+    content = getattr(message, 'content', message)
+    if not isinstance(content, str):
+        content = str(content)
+    return len(content.encode('utf-8')) + MESSAGE_OVERHEAD_BYTES
+
+def is_summary_message(message: Any) -> bool:
+    return getattr(message, 'type', '') == 'system'
+
+def encode_message(message: Any) -> str:
+    """Role code followed by the message text"""
+    if isinstance(message, str):
+        return PLAIN_CODE + message
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    return ROLE_CODES.get(getattr(message, 'type', ''), PLAIN_CODE) + content
+
+def decode_message(data) -> Any:
+    """Inverse of encode_message; falls back to plain text without langchain"""
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    code, content = data[:1], data[1:]
+    if code == PLAIN_CODE:
+        return content
+    try:
+        from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+    except ImportError:
+        return content
+    return {'h': HumanMessage, 'a': AIMessage, 's': SystemMessage}[code](content=content)
+
+def same_messages(first: List[Any], second: List[Any]) -> bool:
+    return len(first) == len(second) and all(
+        encode_message(a) == encode_message(b) for a, b in zip(first, second))
+
+def encode_session(messages: List[Any]) -> bytes:
+    return zlib.compress(json.dumps([encode_message(m) for m in messages], ensure_ascii=False,
+                                    separators=(',', ':')).encode('utf-8'), 1)
+
+def decode_session(data: bytes) -> List[Any]:
+    return [decode_message(m) for m in json.loads(zlib.decompress(data).decode('utf-8'))]
+
+class SessionBackend(ABC):
+    """Interface shared by the session stores
+
+    get returns the messages of a session, oldest first; append adds
+    messages, trimming the session to the store's limits.
+    """
+
+    @abstractmethod
+    def get(self, session_id: str) -> List[Any]:
+        ...
+
+    @abstractmethod
+    def append(self, session_id: str, *messages: Any):
+        ...
+
+    def touch(self, session_id: str):
+        """Start a session, or mark it as recently used"""
+        self.append(session_id)
+
+    @abstractmethod
+    def replace(self, session_id: str, messages: List[Any]):
+        """Overwrite a session's messages"""
+
+    @abstractmethod
+    def compare_and_replace(self, session_id: str, expected: List[Any], messages: List[Any]) -> bool:
+        """Atomically replace the session's leading messages if they are still `expected`
+
+        Messages appended after them (e.g. by a concurrent request) are kept.
+        Returns False, changing nothing, when the session no longer starts with them.
+        """
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        ...
+
+    @abstractmethod
+    def __contains__(self, session_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    @abstractmethod
+    def get_statistics(self) -> Dict:
+        ...
+
+class _Session:
+    __slots__ = ('messages', 'bytes', 'last_access')
+
+    def __init__(self):
+        self.messages = []
+        self.bytes = 0
+        self.last_access = time.monotonic()
+
+class _Stripe:
+    __slots__ = ('lock', 'sessions', 'bytes')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()
+        self.bytes = 0
+
+class SessionStore(SessionBackend):
+    """In-process chat histories keyed by session id, bounded in bytes, age and length
+
+    Each stripe owns an equal share of the byte cap and evicts its least
+    recently used sessions when over it, so no global lock is needed.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, idle_ttl: float = 3600,
+                 max_messages: int = 40, stripes: int = 16):
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.max_messages = max_messages
+        self.stripes = [_Stripe() for _ in range(max(1, stripes))]
+        self.stripe_bytes = max(1, max_bytes // len(self.stripes))
+        self.counter_lock = threading.Lock()
+        self.evictions = {'lru': 0, 'idle': 0, 'trimmed_messages': 0}
+        # Set when a configured shared backend could not be opened and this store stands in for it
+        self.fallback: Optional[Dict] = None
+
+    def _stripe(self, session_id: str) -> _Stripe:
+        return self.stripes[zlib.crc32(session_id.encode('utf-8')) % len(self.stripes)]
+
+    def _count(self, kind: str, amount: int = 1):
+        if amount:
+            with self.counter_lock:
+                self.evictions[kind] += amount
+
+    def _expire(self, stripe: _Stripe, now: float):
+        """Drop idle sessions; the stripe is in LRU order, so they are at the front"""
+        expired = 0
+        if self.idle_ttl:
+            while stripe.sessions:
+                session_id, session = next(iter(stripe.sessions.items()))
+                if now - session.last_access < self.idle_ttl:
+                    break
+                stripe.sessions.popitem(last=False)
+                stripe.bytes -= session.bytes
+                expired += 1
+        self._count('idle', expired)
+
+    def _live_session(self, stripe: _Stripe, session_id: str, now: float):
+        self._expire(stripe, now)
+        session = stripe.sessions.get(session_id)
+        if session is not None:
+            session.last_access = now
+            stripe.sessions.move_to_end(session_id)
+        return session
+
+    def get(self, session_id: str) -> List[Any]:
+        """Copy of the session's messages, oldest first (empty for unknown or expired sessions)"""
+        stripe = self._stripe(session_id)
+        with stripe.lock:
+            session = self._live_session(stripe, session_id, time.monotonic())
+            return list(session.messages) if session else []
+
+    def append(self, session_id: str, *messages: Any):
+        """Add messages to a session, trimming it and evicting other sessions to stay within limits"""
+        stripe = self._stripe(session_id)
+        now = time.monotonic()
+        with stripe.lock:
+            session = self._live_session(stripe, session_id, now)
+            if session is None:
+                session = stripe.sessions[session_id] = _Session()
+            for message in messages:
+                size = message_bytes(message)
+                session.messages.append(message)
+                session.bytes += size
+                stripe.bytes += size
+
+            # Oldest messages go first, but the summary and the newest message always stay
+            head = 1 if session.messages and is_summary_message(session.messages[0]) else 0
+            trimmed = 0
+            while len(session.messages) > head + 1 and (len(session.messages) - head > self.max_messages
+                                                        or session.bytes > self.stripe_bytes):
+                size = message_bytes(session.messages.pop(head))
+                session.bytes -= size
+                stripe.bytes -= size
+                trimmed += 1
+
+            evicted = 0
+            while stripe.bytes > self.stripe_bytes and len(stripe.sessions) > 1:
+                _, oldest = stripe.sessions.popitem(last=False)
+                stripe.bytes -= oldest.bytes
+                evicted += 1
+        self._count('trimmed_messages', trimmed)
+        self._count('lru', evicted)
+
+    def replace(self, session_id: str, messages: List[Any]):
+        self.delete(session_id)
+        self.append(session_id, *messages)
+
+    def compare_and_replace(self, session_id: str, expected: List[Any], messages: List[Any]) -> bool:
+        stripe = self._stripe(session_id)
+        with stripe.lock:
+            session = self._live_session(stripe, session_id, time.monotonic())
+            if session is None or not same_messages(session.messages[:len(expected)], expected):
+                return False
+            session.messages = list(messages) + session.messages[len(expected):]
+            size = sum(message_bytes(message) for message in session.messages)
+            stripe.bytes += size - session.bytes
+            session.bytes = size
+        return True
+
+    def delete(self, session_id: str):
+        stripe = self._stripe(session_id)
+        with stripe.lock:
+            session = stripe.sessions.pop(session_id, None)
+            if session is not None:
+                stripe.bytes -= session.bytes
+
+    def __contains__(self, session_id: str) -> bool:
+        stripe = self._stripe(session_id)
+        with stripe.lock:
+            return self._live_session(stripe, session_id, time.monotonic()) is not None
+
+    def __len__(self) -> int:
+        return sum(len(stripe.sessions) for stripe in self.stripes)
+
+    def get_statistics(self) -> Dict:
+        """Sessions, messages and bytes held, plus eviction counts"""
+        sessions = messages = used = 0
+        for stripe in self.stripes:
+            with stripe.lock:
+                sessions += len(stripe.sessions)
+                messages += sum(len(session.messages) for session in stripe.sessions.values())
+                used += stripe.bytes
+        with self.counter_lock:
+            evictions = dict(self.evictions)
+        return {
+            "backend": "memory",
+            "sessions": sessions,
+            "messages": messages,
+            "bytes": used,
+            "max_bytes": self.max_bytes,
+            "idle_ttl_seconds": self.idle_ttl,
+            "max_messages": self.max_messages,
+            "stripes": len(self.stripes),
+            "evictions": evictions,
+            "fallback": self.fallback
+        }
+
+class SQLiteSessionStore(SessionBackend):
+    """Chat histories in a SQLite database in WAL mode, shared by every process on the host
+
+    Each session is one row holding its compressed messages. Idle expiry and
+    the byte cap (least recently used sessions first) are enforced by a sweep
+    that runs at most every sweep_interval seconds per process.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024, idle_ttl: float = 3600,
+                 max_messages: int = 40, sweep_interval: float = 1.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.max_messages = max_messages
+        self.sweep_interval = sweep_interval
+        self.last_sweep = 0.0
+        self.local = threading.local()
+        self.counter_lock = threading.Lock()
+        self.evictions = {'lru': 0, 'idle': 0, 'trimmed_messages': 0}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data BLOB NOT NULL, "
+            "messages INTEGER NOT NULL, bytes INTEGER NOT NULL, last_access REAL NOT NULL)")
+        self._connection().execute(
+            "CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access)")
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread; sqlite3 connections are not shared between threads"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def _count(self, kind: str, amount: int = 1):
+        if amount:
+            with self.counter_lock:
+                self.evictions[kind] += amount
+
+    def _expired(self, last_access: float, now: float) -> bool:
+        return bool(self.idle_ttl) and now - last_access >= self.idle_ttl
+
+    def _sweep(self, conn: sqlite3.Connection, now: float):
+        if now - self.last_sweep < self.sweep_interval:
+            return
+        self.last_sweep = now
+        if self.idle_ttl:
+            self._count('idle', conn.execute("DELETE FROM sessions WHERE last_access <= ?",
+                                             (now - self.idle_ttl,)).rowcount)
+        # Keep the most recently used sessions that fit under the cap
+        self._count('lru', conn.execute(
+            "DELETE FROM sessions WHERE id IN (SELECT id FROM (SELECT id, SUM(bytes) OVER "
+            "(ORDER BY last_access DESC, id) AS running FROM sessions) WHERE running > ?)",
+            (self.max_bytes,)).rowcount)
+
+    def get(self, session_id: str) -> List[Any]:
+        conn = self._connection()
+        now = time.time()
+        row = conn.execute("SELECT data, last_access FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None:
+            return []
+        if self._expired(row[1], now):
+            self._count('idle', conn.execute("DELETE FROM sessions WHERE id = ? AND last_access = ?",
+                                             (session_id, row[1])).rowcount)
+            return []
+        conn.execute("UPDATE sessions SET last_access = ? WHERE id = ?", (now, session_id))
+        return decode_session(row[0])
+
+    def append(self, session_id: str, *messages: Any):
+        """Add messages to a session in one write transaction, then sweep if due"""
+        self._write(session_id, messages)
+
+    def replace(self, session_id: str, messages: List[Any]):
+        self._write(session_id, messages, keep_history=False)
+
+    def compare_and_replace(self, session_id: str, expected: List[Any], messages: List[Any]) -> bool:
+        return self._write(session_id, messages, expected=expected)
+
+    def _write(self, session_id: str, messages, keep_history: bool = True, expected: Optional[List[Any]] = None) -> bool:
+        """Read-modify-write of one session in a single write transaction
+
+        With expected, the session's leading messages are swapped for messages,
+        or nothing is written (returning False) when they no longer match.
+        """
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = None
+            if keep_history:
+                row = conn.execute("SELECT data, last_access FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            history = []
+            if row is not None:
+                if self._expired(row[1], now):
+                    self._count('idle')
+                else:
+                    history = decode_session(row[0])
+            if expected is not None:
+                if row is None or not same_messages(history[:len(expected)], expected):
+                    conn.execute("ROLLBACK")
+                    return False
+                history = list(messages) + history[len(expected):]
+            else:
+                history.extend(messages)
+
+            # Oldest messages go first, but the summary and the newest message always stay
+            head = 1 if history and is_summary_message(history[0]) else 0
+            trimmed = max(0, len(history) - head - max(1, self.max_messages))
+            history = history[:head] + history[head + trimmed:]
+            data = encode_session(history)
+            while len(history) > head + 1 and len(data) > self.max_bytes:
+                history.pop(head)
+                trimmed += 1
+                data = encode_session(history)
+            self._count('trimmed_messages', trimmed)
+
+            conn.execute("INSERT OR REPLACE INTO sessions (id, data, messages, bytes, last_access) "
+                         "VALUES (?, ?, ?, ?, ?)", (session_id, data, len(history), len(data), now))
+            self._sweep(conn, now)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return True
+
+    def delete(self, session_id: str):
+        self._connection().execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def __contains__(self, session_id: str) -> bool:
+        row = self._connection().execute("SELECT last_access FROM sessions WHERE id = ?",
+                                         (session_id,)).fetchone()
+        return row is not None and not self._expired(row[0], time.time())
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def get_statistics(self) -> Dict:
+        """Sessions, messages and bytes in the database; eviction counts are for this process"""
+        sessions, messages, used = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(messages), 0), COALESCE(SUM(bytes), 0) FROM sessions").fetchone()
+        with self.counter_lock:
+            evictions = dict(self.evictions)
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "sessions": sessions,
+            "messages": messages,
+            "bytes": used,
+            "max_bytes": self.max_bytes,
+            "idle_ttl_seconds": self.idle_ttl,
+            "max_messages": self.max_messages,
+            "evictions": evictions
+        }
+
+class RedisSessionStore(SessionBackend):
+    """Chat histories in a Redis-protocol server, shared by every node
+
+    Each session is a list of encoded messages. Appends push, trim to the
+    message limit and refresh the expiry in one MULTI/EXEC transaction;
+    memory beyond that is bounded by the server's maxmemory policy. The
+    summary lives under its own key, out of reach of the list trim.
+    client is a redis-py compatible client.
+    """
+
+    def __init__(self, client, prefix: str = 'chat:session:', idle_ttl: float = 3600, max_messages: int = 40):
+        self.client = client
+        self.prefix = prefix
+        self.idle_ttl = idle_ttl
+        self.max_messages = max_messages
+        self.expire_seconds = max(1, int(math.ceil(idle_ttl))) if idle_ttl else None
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.prefix}{session_id}"
+
+    def _summary_key(self, session_id: str) -> str:
+        # Outside the session key pattern, so scans count sessions only
+        return f"{self.prefix.rstrip(':')}-summary:{session_id}"
+
+    def get(self, session_id: str) -> List[Any]:
+        key, summary_key = self._key(session_id), self._summary_key(session_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.get(summary_key)
+        pipe.lrange(key, 0, -1)
+        if self.expire_seconds:
+            pipe.expire(key, self.expire_seconds)
+            pipe.expire(summary_key, self.expire_seconds)
+        summary, messages = pipe.execute()[:2]
+        return [decode_message(m) for m in ([summary] if summary else []) + messages]
+
+    def append(self, session_id: str, *messages: Any):
+        pipe = self.client.pipeline(transaction=True)
+        self._queue_write(pipe, session_id, [encode_message(m).encode('utf-8') for m in messages])
+        pipe.execute()
+
+    def replace(self, session_id: str, messages: List[Any]):
+        pipe = self.client.pipeline(transaction=True)
+        self._queue_write(pipe, session_id, [encode_message(m).encode('utf-8') for m in messages], keep_history=False)
+        pipe.execute()
+
+    def compare_and_replace(self, session_id: str, expected: List[Any], messages: List[Any]) -> bool:
+        key, summary_key = self._key(session_id), self._summary_key(session_id)
+        expected = [encode_message(m).encode('utf-8') for m in expected]
+
+        def swap(pipe) -> bool:
+            # Runs under WATCH; redis-py retries it if either key changes before EXEC
+            summary = pipe.get(summary_key)
+            current = ([summary] if summary else []) + pipe.lrange(key, 0, -1)
+            if current[:len(expected)] != expected:
+                return False
+            pipe.multi()
+            self._queue_write(pipe, session_id, [encode_message(m).encode('utf-8') for m in messages]
+                              + current[len(expected):], keep_history=False)
+            return True
+
+        return self.client.transaction(swap, key, summary_key, value_from_callable=True)
+
+    def _queue_write(self, pipe, session_id: str, encoded: List[bytes], keep_history: bool = True):
+        """Queue the commands writing encoded messages on a MULTI pipeline; a leading summary goes to its own key"""
+        key, summary_key = self._key(session_id), self._summary_key(session_id)
+        if not keep_history:
+            pipe.delete(key, summary_key)
+        if encoded and encoded[0][:1] == ROLE_CODES['system'].encode('utf-8'):
+            pipe.set(summary_key, encoded[0])
+            encoded = encoded[1:]
+        if encoded:
+            pipe.rpush(key, *encoded)
+            pipe.ltrim(key, -self.max_messages, -1)
+        if self.expire_seconds:
+            pipe.expire(key, self.expire_seconds)
+            pipe.expire(summary_key, self.expire_seconds)
+
+    def delete(self, session_id: str):
+        self.client.delete(self._key(session_id), self._summary_key(session_id))
+
+    def __contains__(self, session_id: str) -> bool:
+        return bool(self.client.exists(self._key(session_id)))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.client.scan_iter(match=f"{self.prefix}*", count=1000))
+
+    def get_statistics(self) -> Dict:
+        """Session count from a key scan; expiry and eviction are left to the server"""
+        return {
+            "backend": "redis",
+            "sessions": len(self),
+            "idle_ttl_seconds": self.idle_ttl,
+            "max_messages": self.max_messages
+        }
+
+def create_session_store() -> SessionBackend:
+    """Session store configured from the environment
+
+    CHAT_SESSION_BACKEND selects memory (default), sqlite or redis. A shared
+    backend that cannot be opened falls back to the in-process store, which then
+    reports the requested backend and the error under "fallback" in its statistics.
+    """
+    max_bytes = int(float(os.getenv('CHAT_SESSION_MAX_MB', '64')) * 1024 * 1024)
+    idle_ttl = float(os.getenv('CHAT_SESSION_TTL', '3600'))
+    max_messages = int(os.getenv('CHAT_SESSION_MAX_MESSAGES', '40'))
+    backend = os.getenv('CHAT_SESSION_BACKEND', 'memory').lower()
+    error = None
+
+    if backend == 'sqlite':
+        path = os.getenv('CHAT_SESSION_DB', 'sessions.db')
+        try:
+            store = SQLiteSessionStore(path, max_bytes=max_bytes, idle_ttl=idle_ttl, max_messages=max_messages)
+            print(f"✅ Chat sessions stored in SQLite ({path})")
+            return store
+        except Exception as e:
+            error = f"SQLite session store unavailable: {e}"
+    elif backend == 'redis':
+        url = os.getenv('CHAT_SESSION_REDIS_URL', os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+        try:
+            import redis
+
+            client = redis.Redis.from_url(url)
+            client.ping()
+            store = RedisSessionStore(client, prefix=os.getenv('CHAT_SESSION_PREFIX', 'chat:session:'),
+                                      idle_ttl=idle_ttl, max_messages=max_messages)
+            print("✅ Chat sessions stored in Redis")
+            return store
+        except Exception as e:
+            error = f"Redis session store unavailable: {e}"
+    elif backend != 'memory':
+        error = f"Unknown CHAT_SESSION_BACKEND '{backend}'"
+
+    store = SessionStore(
+        max_bytes=max_bytes,
+        idle_ttl=idle_ttl,
+        max_messages=max_messages,
+        stripes=int(os.getenv('CHAT_SESSION_STRIPES', '16'))
+    )
+    if error:
+        # Each worker now keeps its own sessions, so follow-up turns can lose their history
+        print(f"❌ {error}")
+        print("❌ Chat sessions are NOT shared between workers; they are kept in this process's memory only")
+        store.fallback = {"requested_backend": backend, "error": error}
+    return store
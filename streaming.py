@@ -0,0 +1,52 @@
+"""
+Server-Sent Events for streamed chat responses
+A chat stream emits, in order: retrieval (context is ready), token (partial
+text of a response field), final (the structured response), audio (speech
+is ready or failed) and done; error replaces the rest when a step fails
+"""
+
+import json
+from typing import Any, Dict, Iterable, Iterator, Tuple
+
+from flask import Response, stream_with_context
+
+# Fields whose text is streamed as it is generated
+STREAMED_FIELDS = ("probable_cause", "advice")
+
+def sse_event(event: str, data: Any) -> str:
+    """One SSE message with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def sse_response(events: Iterable[Tuple[str, Any]]) -> Response:
+    """Stream (event, data) pairs to the client as they are produced"""
+    def generate():
+        # A comment line first so proxies and browsers see bytes immediately
+        yield ": stream\n\n"
+        for event, data in events:
+            yield sse_event(event, data)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def field_deltas(partials: Iterable[Any], emitted: Dict[str, str]) -> Iterator[Tuple[str, Any]]:
+    """Token events for the new text of each streamed field across cumulative partial responses
+
+    Each partial is a dict or model holding the response so far; emitted
+    tracks what was already sent and ends up holding the last partial's text.
+    """
+    for partial in partials:
+        if partial is None:
+            continue
+        values = partial if isinstance(partial, dict) else partial.__dict__
+        for field in STREAMED_FIELDS:
+            text = values.get(field) or ""
+            sent = emitted.get(field, "")
+            if len(text) > len(sent) and text.startswith(sent):
+                yield "token", {"field": field, "text": text[len(sent):]}
+                emitted[field] = text
+            elif text != sent and not sent.startswith(text):
+                # The model revised earlier text; resend the field in full
+                yield "token", {"field": field, "text": text, "replace": True}
+                emitted[field] = text
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Test script for the agent's chat history window
+Checks turn windowing, the token budget and the rolling summary
+"""
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from chat_history import SUMMARY_PREFIX, HistoryWindow
+from session_store import SessionStore
+
+def test_history_window_and_summary():
+    """Old turns are summarized once per fold and the new query is never part of the history"""
+    calls = []
+
+    def summarize(previous, messages):
+        calls.append(len(messages))
+        return " ".join(filter(None, [previous, f"{len(messages)} earlier messages"]))
+
+    store = SessionStore()
+    window = HistoryWindow(summarize, max_tokens=1500, keep_turns=2, summary_tokens=100)
+    for turn in range(5):
+        query = f"Turn {turn}: my headache is still there."
+        history, info = window.prepare(store, "s", "System prompt", query)
+        assert all(m.content != query for m in history)
+        assert info["history_messages"] <= 4 and info["prompt_tokens"]["total"] == sum(
+            value for key, value in info["prompt_tokens"].items() if key != "total")
+        store.append("s", HumanMessage(content=query), AIMessage(content=f"Answer {turn}."))
+
+    # Turns 0 and 1 were folded two messages at a time, each exactly once
+    assert calls == [2, 2]
+    assert history[0].content == SUMMARY_PREFIX + "2 earlier messages 2 earlier messages"
+    assert [m.content for m in history[1:]] == ["Turn 2: my headache is still there.", "Answer 2.",
+                                                "Turn 3: my headache is still there.", "Answer 3."]
+    stored = store.get("s")
+    assert stored[0].type == "system" and len(stored) == 7
+
+    # A turn larger than the budget is folded instead of sent verbatim
+    budgeted = HistoryWindow(max_tokens=150, keep_turns=4, summary_tokens=100)
+    store.append("long", HumanMessage(content="word " * 400), AIMessage(content="Short answer."))
+    history, info = budgeted.prepare(store, "long", "System prompt", "Next question")
+    assert info["summarized_messages"] == 1 and info["history_messages"] == 1
+    assert history[0].type == "system" and info["prompt_tokens"]["summary"] <= 100 + len(SUMMARY_PREFIX)
+
+    # A turn stored by a parallel request while the summary is written is kept
+    def slow_summarize(previous, messages):
+        store.append("race", HumanMessage(content="Parallel question"))
+        return "folded"
+
+    racing = HistoryWindow(slow_summarize, max_tokens=1500, keep_turns=1, summary_tokens=100)
+    store.append("race", HumanMessage(content="q1"), AIMessage(content="a1"),
+                 HumanMessage(content="q2"), AIMessage(content="a2"))
+    racing.prepare(store, "race", "System prompt", "Next question")
+    assert [m.content for m in store.get("race")] == ["folded", "q2", "a2", "Parallel question"]
+    print("✅ Chat history window works")
+
+if __name__ == "__main__":
+    test_history_window_and_summary()
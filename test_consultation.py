@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Test script for single-call consultations
+Checks that one model call yields a SymptomResponse and the consultation is logged server-side
+"""
+
+import os
+import json
+import tempfile
+
+from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from consultation import ASSESSMENT_SCHEMA, consult, create_consultation_chain, log_consultation, normalize_severity
+from schema import SymptomAssessment, SymptomResponse
+
+class StructuredLLM:
+    """Stand-in chat model: records each call and returns a fixed structured answer"""
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.calls = []
+
+    def with_structured_output(self, schema):
+        assert schema == ASSESSMENT_SCHEMA
+        return RunnableLambda(lambda prompt_value: self.calls.append(prompt_value.to_messages()) or self.answer)
+
+def test_single_call_consultation():
+    """One schema-constrained call per consultation, then a server-side log entry"""
+    llm = StructuredLLM({"probable_cause": "Likely a tension headache", "severity": "Moderate to Severe",
+                         "advice": "Rest, hydrate and see your GP if it persists"})
+    chain = create_consultation_chain(llm, "System prompt")
+    history = [HumanMessage(content="I have a headache"), AIMessage(content="How long has it lasted?")]
+    response = consult(chain, "Two days now", history)
+
+    assert len(llm.calls) == 1
+    messages = llm.calls[0]
+    assert [m.content for m in messages] == ["System prompt", "I have a headache", "How long has it lasted?", "Two days now"]
+    assert isinstance(response, SymptomResponse) and response.severity == "severe"
+    assert normalize_severity("unclear") == "moderate" and normalize_severity("Mild") == "mild"
+
+    # Server-side fields in the model's answer are never taken from it
+    injected = StructuredLLM({"probable_cause": "Tension headache", "severity": "mild", "advice": "Rest",
+                              "log_status": "ok", "audio_response": "/etc/passwd"})
+    response_from_injection = consult(create_consultation_chain(injected, "System prompt"), "Headache", [])
+    assert response_from_injection.audio_response is None and response_from_injection.log_status == ""
+    assert "audio_response" not in SymptomAssessment.model_json_schema()["properties"]
+
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            status = log_consultation("s1", "Two days now", response)
+            log_files = os.listdir("logs")
+            with open(os.path.join("logs", log_files[0]), encoding="utf-8") as f:
+                entry = json.loads(json.loads(f.readline())["entry"])
+        finally:
+            os.chdir(previous)
+    assert status.startswith("Symptom consultation logged")
+    assert entry["session_id"] == "s1" and entry["severity"] == "severe"
+    print("✅ Single-call consultation works")
+
+if __name__ == "__main__":
+    test_single_call_consultation()
@@ -0,0 +1,661 @@
+#!/usr/bin/env python3
+"""
+Test script for MedicalRAGSystem indexing behaviour
+Runs against a temporary knowledge base with a deterministic embedding model
+"""
+
+import os
+import json
+import time
+import tempfile
+import multiprocessing
+
+import faiss
+import numpy as np
+from langchain_community.embeddings import DeterministicFakeEmbedding, FakeEmbeddings
+from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
+
+from rag_system import MedicalRAGSystem, reciprocal_rank_fusion
+from rag_database_manager import RAGDatabaseManager
+from bulk_ingest import ingest_directory
+from knowledge_store import KnowledgeStore
+from onnx_embeddings import compare_embeddings
+from rag_snapshot import RAGSnapshot, write_snapshot
+from benchmark_retrieval import HashingEmbeddings, run_benchmarks
+from chunking import split_text_by_sections
+from vector_manifest import content_hash, manifest_chunk_count
+from chunk_store import MappedDocstore, chunk_store_exists
+from embedding_cache import EmbeddingCache
+from text_utils import estimate_tokens
+from vector_index import INDEX_TYPES, get_index_settings, create_index, apply_search_params, describe_index
+
+def create_test_rag(knowledge_base_path: str) -> MedicalRAGSystem:
+    """Create a RAG system that does not need to download an embedding model"""
+    return MedicalRAGSystem(knowledge_base_path, embeddings=DeterministicFakeEmbedding(size=32))
+
+def test_add_document_is_incremental():
+    """Adding a document embeds only its own chunks and keeps them searchable"""
+    with tempfile.TemporaryDirectory() as kb_path:
+        rag = create_test_rag(kb_path)
+        vectors_before = rag.vector_store.index.ntotal
+
+        index_file = os.path.join(rag.vector_store_path, "index.faiss")
+        with open(index_file, 'rb') as f:
+            saved_index = f.read()
+
+        rag.add_medical_document("Sunburn Care", "Cool the skin and apply aloe vera gel.", "first_aid")
+
+        assert rag.vector_store.index.ntotal == vectors_before + 1
+        assert len(rag.documents) == 8
+
+        # The index is only written at checkpoints, so nothing on disk has changed yet...
+        with open(index_file, 'rb') as f:
+            assert f.read() == saved_index
+        assert rag.unsaved_chunks == 1
+
+        # ...and a restart restores the chunk by replaying the knowledge log
+        reloaded = create_test_rag(kb_path)
+        assert reloaded.vector_store.index.ntotal == vectors_before + 1
+        assert reloaded.keyword_search("aloe vera")[0]['metadata']['title'] == "Sunburn Care"
+
+        # Checkpoints from several workers go through the knowledge base lock
+        acquired = multiprocessing.Event()
+        holder = multiprocessing.Process(target=_hold_kb_lock, args=(kb_path, acquired, 0.5))
+        holder.start()
+        assert acquired.wait(10)
+        started = time.monotonic()
+        rag.checkpoint_vector_store(force=True)
+        assert time.monotonic() - started >= 0.2
+        holder.join()
+        print("✅ Incremental indexing works")
+
+def _hold_kb_lock(kb_path, acquired, seconds):
+    with KnowledgeStore(kb_path).locked():
+        acquired.set()
+        time.sleep(seconds)
+
+def test_index_checkpoints_append_chunks():
+    """Adds are saved at checkpoints by appending chunks; an interrupted save is recovered on load"""
+    with tempfile.TemporaryDirectory() as kb_path:
+        rag = create_test_rag(kb_path)
+        store_path = rag.vector_store_path
+        chunks_file = os.path.join(store_path, "chunks.bin")
+        saved_chunks = open(chunks_file, 'rb').read()
+        directory_inode = os.stat(store_path).st_ino
+        vectors_before = rag.vector_store.index.ntotal
+
+        rag.add_medical_document("Sunburn Care", "Cool the skin and apply aloe vera gel.", "first_aid")
+        assert rag.vector_store_dirty and open(chunks_file, 'rb').read() == saved_chunks
+        assert rag.checkpoint_vector_store(force=True) and not rag.vector_store_dirty
+        assert open(chunks_file, 'rb').read().startswith(saved_chunks) and len(open(chunks_file, 'rb').read()) > len(saved_chunks)
+        assert os.stat(store_path).st_ino == directory_inode and not rag.vector_store.docstore.added
+        assert "aloe" in rag.get_chunk(rag.vector_store.index_to_docstore_id[vectors_before]).page_content
+
+        # Chunks appended by a save that died before the index was written are dropped on load
+        rag.add_medical_document("Hiccups", "Sip cold water slowly.", "first_aid")
+        id_map = rag.vector_store.index_to_docstore_id
+        rag.vector_store.docstore.append_to_files([(id_map[vectors_before + 1], rag.get_chunk(id_map[vectors_before + 1]))])
+        reloaded = create_test_rag(kb_path)
+        assert reloaded.vector_store.index.ntotal == vectors_before + 2
+        assert reloaded.vector_store.docstore.stored_count == vectors_before + 2
+        assert reloaded.keyword_search("sip cold water")[0]["metadata"]["title"] == "Hiccups"
+
+        # After a removal positions shift, so the whole store is rewritten
+        reloaded.remove_chunks([id_map[vectors_before + 1]])
+        reloaded.save_vector_store()
+        assert os.stat(store_path).st_ino != directory_inode
+        assert create_test_rag(kb_path).vector_store.docstore.stored_count == vectors_before + 2
+        print("✅ Index checkpoints work")
+
+def test_manifest_sync_after_external_edit():
+    """Edits made directly to the JSON are detected and applied on the next load"""
+    with tempfile.TemporaryDirectory() as kb_path:
+        create_test_rag(kb_path)
+        manager = RAGDatabaseManager(kb_path)
+        assert manager.check_index_consistency()["in_sync"]
+
+        knowledge_file = os.path.join(kb_path, "medical_knowledge.json")
+        with open(knowledge_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        data[0]["content"] += "\nKeep a headache diary to identify triggers."
+        removed = data.pop()
+        with open(knowledge_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+
+        report = manager.check_index_consistency()
+        assert not report["in_sync"]
+        assert report["changed_documents"] == ["symptoms/Headache Types and Causes"]
+        assert report["removed_documents"] == [f"{removed['category']}/{removed['title']}"]
+
+        rag = create_test_rag(kb_path)
+        assert rag.vector_store.index.ntotal == manifest_chunk_count(rag.manifest)
+        assert manager.check_index_consistency()["in_sync"]
+        print("✅ Manifest sync works")
+
+def test_rebuild_reuses_cached_embeddings():
+    """A fresh index build takes every vector from the embedding cache"""
+    with tempfile.TemporaryDirectory() as kb_path:
+        rag = create_test_rag(kb_path)
+        misses = rag.embedding_cache.misses
+
+        reloaded = MedicalRAGSystem(kb_path, embeddings=rag.embeddings)
+        reloaded.build_vector_store(reloaded.knowledge_store.load())
+
+        assert reloaded.embedding_cache.misses == 0
+        assert reloaded.embedding_cache.hits == misses
+        assert reloaded.vector_store.index.ntotal == rag.vector_store.index.ntotal
+
+        result = RAGDatabaseManager(kb_path).prune_embedding_cache()
+        assert result["freed_mb"] == 0
+
+        # A logged entry whose chunk is not checkpointed yet keeps its cached vector
+        reloaded.add_medical_document("Sunburn Care", "Cool the skin and apply aloe vera gel.", "first_aid")
+        assert reloaded.unsaved_chunks == 1
+        RAGDatabaseManager(kb_path).prune_embedding_cache()
+        model = reloaded.get_index_config()["embedding_model"]
+        chunk_hash = content_hash("Cool the skin and apply aloe vera gel.")
+        assert chunk_hash in EmbeddingCache(reloaded.embedding_cache.cache_dir).get_many(model, [chunk_hash])
+        print("✅ Embedding cache reuse works")
+
+def _cache_writer(cache_dir, worker):
+    cache = EmbeddingCache(cache_dir)
+    for batch in range(20):
+        keys = [f"w{worker}-{batch}-{i}" for i in range(5)] + ["shared"]
+        cache.put_many("fake", keys, [_key_vector(key) for key in keys])
+
+def _key_vector(key):
+    return np.full(8, sum(key.encode('utf-8')), dtype=np.float32)
+
+def test_embedding_cache_shared_by_processes():
+    """Concurrent writers in several processes never map a key to another text's vector"""
+    with tempfile.TemporaryDirectory() as cache_dir:
+        reader = EmbeddingCache(cache_dir)
+        reader.put_many("fake", ["first"], [_key_vector("first")])
+        workers = [multiprocessing.Process(target=_cache_writer, args=(cache_dir, n)) for n in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+            assert worker.exitcode == 0
+
+        keys = ["first", "shared"] + [f"w{w}-{b}-{i}" for w in range(4) for b in range(20) for i in range(5)]
+        found = reader.get_many("fake", keys)
+        assert len(found) == len(keys)
+        assert all(np.array_equal(found[key], _key_vector(key)) for key in keys)
+        assert reader.get_statistics()["models"]["fake"]["entries"] == len(keys)
+    print("✅ Embedding cache is safe across processes")
+
+def test_query_cache_invalidated_by_new_documents():
+    """Repeated phrasings hit the cache until the knowledge base changes"""
+    with tempfile.TemporaryDirectory() as kb_path:
+        rag = create_test_rag(kb_path)
+        first = rag.retrieve_relevant_info("I have a headache")
+        assert rag.retrieve_relevant_info("  I have a HEADACHE? ") == first
+
+        stats = rag.get_statistics()["query_cache"]
+        assert stats["results"]["hits"] == 1
+        assert stats["embeddings"]["misses"] == 1
+
+        rag.add_medical_document("Sunburn Care", "Cool the skin and apply aloe vera gel.", "first_aid")
+        rag.retrieve_relevant_info("I have a headache")
+
+        stats = rag.get_statistics()["query_cache"]
+        assert stats["results"]["misses"] == 2
+        assert stats["embeddings"]["hits"] == 1
+        print("✅ Query cache works")
+
+def test_keyword_search_uses_bm25_index():
+    """Keyword search ranks chunks with BM25 and follows added documents"""
+    with tempfile.TemporaryDirectory() as kb_path:
+        rag = create_test_rag(kb_path)
+        results = rag.keyword_search("tylenol acetaminophen dose", max_results=2)
+        assert results[0]['metadata']['title'] == "Common Over-the-Counter Medications"
+        assert results[0]['relevance_score'] >= results[-1]['relevance_score']
+
+        rag.add_medical_document("Sunburn Care", "Cool the skin and apply aloe vera gel.", "first_aid")
+        assert rag.keyword_search("aloe vera")[0]['metadata']['title'] == "Sunburn Care"
+
+        # The persisted index is reloaded rather than rebuilt
+        reloaded = create_test_rag(kb_path)
+        assert len(reloaded.keyword_index) == len(rag.keyword_index)
+        assert reloaded.keyword_search("aloe vera")[0]['metadata']['title'] == "Sunburn Care"
+        print("✅ BM25 keyword search works")
+
+def test_hybrid_search_fuses_and_survives_slow_leg():
+    """Hybrid retrieval fuses both legs and drops a leg that misses its deadline"""
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "a"]])
+    assert [chunk_id for chunk_id, _ in fused] == ["a", "c", "b"]
+
+    with tempfile.TemporaryDirectory() as kb_path:
+        rag = create_test_rag(kb_path)
+        # Exact drug names are found through the sparse leg even with random embeddings
+        results = rag.retrieve_relevant_info("tylenol", max_results=2, min_similarity=0.99)
+        assert any("Tylenol" in result['content'] for result in results)
+        # A common word is not enough to get past the similarity cutoff
+        assert rag.keyword_index.search("pain", 1)[0][1] < rag.min_keyword_score
+        assert rag.retrieve_relevant_info("pain", max_results=2, min_similarity=0.99) == []
+
+        slow_search = rag.dense_search
+        def delayed_dense_search(query, k, categories=None):
+            time.sleep(0.3)
+            return slow_search(query, k, categories)
+        rag.dense_search = delayed_dense_search
+        rag.leg_timeouts['dense'] = 0.05
+
+        results = rag.retrieve_relevant_info("aspirin children viral illness")
+        assert results and rag.leg_timeout_counts['dense'] == 1
+        print("✅ Hybrid retrieval works")
+
+def test_scored_retrieval_and_context_budget():
+    """Results carry real similarities, skip near-duplicates and fit the token budget"""
+    with tempfile.TemporaryDirectory() as kb_path:
+        rag = create_test_rag(kb_path)
+        content = "Tylenol and acetaminophen are safe for most people at up to 3000mg per day."
+        rag.add_medical_document("Acetaminophen Dosing", content, "medications")
+        rag.add_medical_document("Acetaminophen Dosing (copy)", content, "medications")
+
+        results = rag.retrieve_relevant_info("tylenol acetaminophen", max_results=5, min_similarity=-1.0)
+        assert sum(result['content'] == content for result in results) == 1
+        assert all(-1.0 <= result['similarity'] <= 1.0 for result in results if result['similarity'] is not None)
+
+        rag.retrieval_mode = 'dense'
+        dense = rag.retrieve_relevant_info("fever", max_results=3, min_similarity=-1.0)
+        similarities = [result['similarity'] for result in dense]
+        assert similarities == sorted(similarities, reverse=True)
+        assert rag.retrieve_relevant_info("fever", max_results=3, min_similarity=1.01) == []
+
+        context = rag.get_context_for_query("tylenol acetaminophen", token_budget=80)
+        assert estimate_tokens(context) <= 85
+        print("✅ Scored retrieval and context packing work")
+
+def test_index_factory_types():
+    """Every index type builds, searches and reports its footprint"""
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((2000, 32)).astype(np.float32)
+    settings = get_index_settings()
+    settings.update({"nlist": 16, "pq_m": 8, "pq_nbits": 4})
+
+    for index_type in INDEX_TYPES:
+        index, params = create_index(dict(settings, type=index_type), vectors)
+        assert params["type"] == index_type
+        apply_search_params(index, dict(params, nprobe=16))
+        index.add(vectors)
+        _, positions = index.search(vectors[:5], 1)
+        if index_type != "ivf_pq":
+            assert list(positions[:, 0]) == [0, 1, 2, 3, 4]
+        assert describe_index(index, params)["memory_mb"] > 0
+
+    # Too few vectors to train falls back to an exact index
+    _, params = create_index(dict(settings, type="ivf_flat"), vectors[:100])
+    assert params["type"] == "flat"
+
+    with tempfile.TemporaryDirectory() as kb_path:
+        os.environ['RAG_INDEX_TYPE'] = 'hnsw'
+        try:
+            rag = create_test_rag(kb_path)
+        finally:
+            del os.environ['RAG_INDEX_TYPE']
+        assert rag.get_statistics()['vector_index']['type'] == 'hnsw'
+        before = rag.vector_store.index.ntotal
+        rag.remove_chunks([rag.vector_store.index_to_docstore_id[0]])
+        assert rag.vector_store.index.ntotal == before - 1
+        rag.set_search_params(ef_search=128)
+        assert rag.vector_store.index.hnsw.efSearch == 128
+
+    # A KB too small to train IVF starts flat and is trained once bulk ingestion grows it
+    with tempfile.TemporaryDirectory() as kb_path:
+        os.environ['RAG_INDEX_TYPE'] = 'ivf_flat'
+        os.environ['RAG_IVF_NLIST'] = '2'
+        try:
+            rag = create_test_rag(kb_path)
+            assert rag.index_params["type"] == "flat"
+            words = ["".join(rng.choice(list("abcdefghijklmnop"), 6)) for _ in range(900)]
+            rag.add_medical_documents([{"title": f"Condition {i}", "content": " ".join(words[i * 10:i * 10 + 10]),
+                                        "category": "general"} for i in range(90)])
+            rag.checkpoint_vector_store(force=True)
+            assert rag.index_params["type"] == "ivf_flat" and rag.vector_store.index.is_trained
+            assert rag.keyword_search(words[420])[0]['metadata']['title'] == "Condition 42"
+            reloaded = create_test_rag(kb_path)
+        finally:
+            del os.environ['RAG_INDEX_TYPE']
+            del os.environ['RAG_IVF_NLIST']
+        assert reloaded.get_statistics()['vector_index']['type'] == "ivf_flat"
+        assert faiss.extract_index_ivf(reloaded.vector_store.index).nlist == 2
+        print("✅ Index factory works")
+
+def test_memory_mapped_loading():
+    """The index and chunks can be opened read-only via mmap and still accept additions"""
+    with tempfile.TemporaryDirectory() as kb_path:
+        rag = create_test_rag(kb_path)
+        expected = rag.retrieve_relevant_info("tylenol", min_similarity=-1.0)
+
+        os.environ['RAG_MMAP_INDEX'] = 'true'
+        try:
+            mapped = create_test_rag(kb_path)
+        finally:
+            del os.environ['RAG_MMAP_INDEX']
+        assert mapped.index_mmapped
+        assert isinstance(mapped.vector_store.docstore, MappedDocstore)
+        assert mapped.retrieve_relevant_info("tylenol", min_similarity=-1.0) == expected
+
+        mapped.add_medical_document("Sunburn Care", "Cool the skin and apply aloe vera gel.", "first_aid")
+        assert not mapped.index_mmapped
+        assert mapped.keyword_search("aloe vera")[0]['metadata']['title'] == "Sunburn Care"
+        assert len(mapped.vector_store.docstore) == mapped.vector_store.index.ntotal
+        print("✅ Memory-mapped loading works")
+
+def test_pickle_docstore_migration():
+    """An index.pkl docstore is converted once and never loaded again"""
+    with tempfile.TemporaryDirectory() as kb_path:
+        rag = create_test_rag(kb_path)
+        assert not os.path.exists(os.path.join(rag.vector_store_path, "index.pkl"))
+
+        # Recreate the layout written by FAISS.save_local before the chunk store existed
+        store = rag.vector_store
+        docs = {chunk_id: rag.get_chunk(chunk_id) for chunk_id in store.index_to_docstore_id.values()}
+        FAISS(rag.embeddings, store.index, InMemoryDocstore(docs), dict(store.index_to_docstore_id)).save_local(rag.vector_store_path)
+        for name in ("chunks.bin", "chunks.offsets", "chunks.ids"):
+            os.remove(os.path.join(rag.vector_store_path, name))
+
+        migrated = create_test_rag(kb_path)
+        assert not os.path.exists(os.path.join(rag.vector_store_path, "index.pkl"))
+        assert chunk_store_exists(rag.vector_store_path)
+        assert migrated.embedding_cache.misses == 0
+        assert migrated.keyword_search("tylenol")[0]['content'] == rag.keyword_search("tylenol")[0]['content']
+        print("✅ Pickle docstore migration works")
+
+def test_category_filtered_retrieval():
+    """Category filters restrict both retrieval legs and routing keeps uploads out of general questions"""
+    with tempfile.TemporaryDirectory() as kb_path:
+        rag = create_test_rag(kb_path)
+        rag.add_medical_document("Uploaded: notes.txt", "Patient reports a headache and takes tylenol daily.", "uploaded_document")
+
+        for mode in ('hybrid', 'dense'):
+            rag.retrieval_mode = mode
+            results = rag.retrieve_relevant_info("headache tylenol", max_results=5, min_similarity=-1.0,
+                                                 categories=["medications"])
+            assert results and all(result['metadata']['category'] == "medications" for result in results)
+        assert rag.retrieve_relevant_info("headache", categories=["no_such_category"]) == []
+
+        assert rag.route_query("How much ibuprofen can I take?") == ["medications"]
+        assert rag.route_query("What should I do for a bad burn?") == ["first_aid"]
+        general = rag.route_query("I have a headache")
+        assert "uploaded_document" not in general and "symptoms" in general
+        assert rag.route_query("I have a headache", include_uploads=True) is None
+
+        def expected_positions(categories):
+            return sorted(position for position, chunk_id in rag.vector_store.index_to_docstore_id.items()
+                          if rag.chunk_categories[chunk_id] in categories)
+
+        # Writes update the cached partitions instead of dropping them and rescanning the id map
+        routed = ["medications", "uploaded_document"]
+        rag.retrieve_relevant_info("tylenol", categories=routed, min_similarity=-1.0)
+        cached = rag.get_partition(routed)
+        rag.add_medical_document("Uploaded: diary.txt", "Took tylenol again for the headache.", "uploaded_document")
+        assert rag.get_partition(routed) is cached and cached['search_params'] is None
+        assert len(cached['chunk_ids']) == len(expected_positions(routed))
+        results = rag.retrieve_relevant_info("tylenol diary headache", categories=routed, min_similarity=-1.0, max_results=10)
+        assert "Uploaded: diary.txt" in [result['metadata']['title'] for result in results]
+
+        # Partitions survive a reload from disk
+        reloaded = create_test_rag(kb_path)
+        assert reloaded.get_statistics()['category_partitions'] == rag.get_statistics()['category_partitions']
+
+        # Removals shift FAISS positions; every category's positions follow
+        rag.remove_chunks([rag.vector_store.index_to_docstore_id[0]])
+        assert len(cached['chunk_ids']) == len(expected_positions(routed))
+        for category in rag.partitions:
+            assert sorted(rag.partition_positions.get(category, [])) == expected_positions([category])
+        print("✅ Category-filtered retrieval works")
+
+def test_bulk_ingestion_is_resumable():
+    """Bulk ingestion extracts in worker processes, saves once and skips files it already added"""
+    with tempfile.TemporaryDirectory() as kb_path, tempfile.TemporaryDirectory() as docs_path:
+        os.makedirs(os.path.join(docs_path, "clinic"))
+        for i in range(5):
+            with open(os.path.join(docs_path, "clinic", f"note_{i}.txt"), 'w', encoding='utf-8') as f:
+                f.write(f"Visit note {i}: patient recovering from zoster{i} infection.")
+        open(os.path.join(docs_path, "empty.txt"), 'w').close()
+
+        rag = create_test_rag(kb_path)
+        saves = []
+        save_vector_store = rag.save_vector_store
+        rag.save_vector_store = lambda: saves.append(1) or save_vector_store()
+
+        report = ingest_directory(rag, docs_path, workers=2, batch_size=2)
+        assert report["documents"] == 5 and report["chunks"] == 5
+        assert len(report["failed"]) == 1 and len(saves) == 1
+        assert rag.keyword_search("zoster3")[0]['metadata']['source_path'] == os.path.join("clinic", "note_3.txt")
+
+        # A renamed file is matched by its bytes; an entry added without a file hash by its text
+        os.rename(os.path.join(docs_path, "clinic", "note_0.txt"), os.path.join(docs_path, "moved.txt"))
+        with open(os.path.join(docs_path, "note_9.txt"), 'w', encoding='utf-8') as f:
+            f.write("Visit note 9: patient recovering from zoster9 infection.")
+        rag.add_medical_document("Note 9", "Visit note 9: patient recovering from zoster9 infection.")
+        reloaded = create_test_rag(kb_path)
+        assert ingest_directory(reloaded, docs_path, workers=1)["skipped"] == 6
+        assert len(reloaded.documents) == 13
+        print("✅ Bulk ingestion works")
+
+def test_bulk_ingestion_checkpoints():
+    """Checkpoints save the index and drop the saved text from memory"""
+    with tempfile.TemporaryDirectory() as kb_path, tempfile.TemporaryDirectory() as docs_path:
+        for i in range(5):
+            with open(os.path.join(docs_path, f"note_{i}.txt"), 'w', encoding='utf-8') as f:
+                f.write(f"Clinic letter {i}: follow-up for measles{i} exposure.")
+
+        rag = create_test_rag(kb_path)
+        saves = []
+        save_vector_store = rag.save_vector_store
+        rag.save_vector_store = lambda: saves.append(len(rag.vector_store.docstore.added)) or save_vector_store()
+
+        report = ingest_directory(rag, docs_path, workers=1, batch_size=2, checkpoint_every=2)
+        assert report["documents"] == 5 and saves == [2, 2, 1]
+        assert not rag.pending_documents and not rag.vector_store.docstore.added
+        assert [document.page_content for document in rag.documents[7:11]] == [""] * 4
+        assert rag.documents[11].page_content and rag.keyword_search("measles2")
+        print("✅ Bulk ingestion checkpoints work")
+
+def test_knowledge_log_and_compaction():
+    """Additions are appended to the log, survive a torn write and are folded into the snapshot"""
+    with tempfile.TemporaryDirectory() as kb_path:
+        rag = create_test_rag(kb_path)
+        snapshot = open(rag.knowledge_file, encoding='utf-8').read()
+
+        rag.add_medical_document("Sunburn Care", "Cool the skin and apply aloe vera gel.", "first_aid")
+        manager = RAGDatabaseManager(kb_path)
+        assert manager.add_knowledge_entry("Hiccups", "Sip cold water slowly.")
+        assert open(rag.knowledge_file, encoding='utf-8').read() == snapshot
+
+        # A crash mid-append leaves a partial last line, which is ignored and trimmed
+        with open(rag.knowledge_store.log_file, 'a', encoding='utf-8') as f:
+            f.write('{"op": "add", "entry": {"ti')
+        assert [item['title'] for item in manager.knowledge_store.load()][-2:] == ["Sunburn Care", "Hiccups"]
+        assert manager.delete_knowledge_entries("Hiccups") == 1
+
+        reloaded = create_test_rag(kb_path)
+        assert len(reloaded.documents) == 8
+        assert reloaded.keyword_search("hiccups") == []
+        assert reloaded.keyword_search("aloe vera")[0]['metadata']['title'] == "Sunburn Care"
+
+        # Compaction rewrites the snapshot and empties the log; replaying the old log again changes nothing
+        log = open(rag.knowledge_store.log_file, encoding='utf-8').read()
+        assert manager.compact_knowledge_base() == 3
+        assert os.path.getsize(rag.knowledge_store.log_file) == 0
+        with open(rag.knowledge_store.log_file, 'w', encoding='utf-8') as f:
+            f.write(log)
+        titles = [item['title'] for item in json.load(open(rag.knowledge_file, encoding='utf-8'))]
+        assert titles == [item['title'] for item in manager.knowledge_store.load()]
+        assert "Sunburn Care" in titles and "Hiccups" not in titles
+
+        # Background compaction kicks in once the log passes the threshold
+        store = KnowledgeStore(kb_path, compact_after=2)
+        store.append([{"category": "custom", "title": f"Note {i}", "content": "text"} for i in range(2)])
+        store.compaction_thread.join()
+        assert store.compactions == 1 and len(store.load()) == 10
+        print("✅ Knowledge base log and compaction work")
+
+def test_embedding_backend_parity_and_identity():
+    """Backends are compared by cosine parity, and quantized vectors get their own index identity"""
+    reference = DeterministicFakeEmbedding(size=32)
+    assert compare_embeddings(reference, DeterministicFakeEmbedding(size=32))["passed"]
+    assert not compare_embeddings(reference, FakeEmbeddings(size=32))["passed"]
+
+    class QuantizedFake(DeterministicFakeEmbedding):
+        index_model_name = "fake#int8"
+
+    with tempfile.TemporaryDirectory() as kb_path:
+        rag = MedicalRAGSystem(kb_path, embeddings=QuantizedFake(size=32))
+        assert rag.get_index_config()["embedding_model"] == "fake#int8"
+        assert rag.embedding_cache.list_models() == ["fake#int8"]
+        print("✅ Embedding backend parity works")
+
+def test_snapshot_opens_without_embedding():
+    """A packed snapshot serves the same results from an empty directory without embedding anything"""
+    with tempfile.TemporaryDirectory() as kb_path, tempfile.TemporaryDirectory() as serve_path:
+        rag = create_test_rag(kb_path)
+        rag.add_medical_document("Sunburn Care", "Cool the skin and apply aloe vera gel.", "first_aid")
+        rag.checkpoint_vector_store(force=True)
+        snapshot_file = os.path.join(serve_path, "rag_snapshot.bin")
+        header = write_snapshot(rag.vector_store_path, snapshot_file, rag.knowledge_store.load())
+        assert header["documents"] == 8
+
+        assert os.path.exists(os.path.join(serve_path, "rag_snapshot.faiss"))
+
+        os.environ['RAG_SNAPSHOT'] = snapshot_file
+        os.environ['RAG_MMAP_INDEX'] = 'true'
+        try:
+            served = create_test_rag(os.path.join(serve_path, "kb"))
+        finally:
+            del os.environ['RAG_SNAPSHOT']
+            del os.environ['RAG_MMAP_INDEX']
+        assert served.read_only and served.embedding_cache.hits == served.embedding_cache.misses == 0
+        assert served.index_mmapped
+        assert not os.path.exists(served.knowledge_file)
+        assert served.get_statistics()['snapshot']['content_hash'] == header["content_hash"]
+        assert len(served.documents) == 8
+        assert (served.retrieve_relevant_info("aloe vera sunburn", min_similarity=-1.0)
+                == rag.retrieve_relevant_info("aloe vera sunburn", min_similarity=-1.0))
+
+        served.add_medical_document("Hiccups", "Sip cold water slowly.")
+        assert len(served.documents) == 8
+
+        # An index of the same size from another build is refused, not served against these chunks
+        index_file = os.path.join(serve_path, "rag_snapshot.faiss")
+        index = faiss.read_index(index_file)
+        vectors = index.reconstruct_n(0, index.ntotal)
+        swapped = faiss.clone_index(index)
+        swapped.reset()
+        swapped.add(np.ascontiguousarray(vectors[::-1]))
+        faiss.write_index(swapped, f"{index_file}.other")
+        os.replace(f"{index_file}.other", index_file)
+        assert os.path.getsize(index_file) == header["index_size"]
+        try:
+            RAGSnapshot(snapshot_file).load_index()
+            assert False, "a mismatched index must not load"
+        except ValueError:
+            pass
+        print("✅ RAG snapshot works")
+
+def test_section_chunking_and_near_duplicates():
+    """Chunks start at headings; a re-uploaded KB entry adds no chunks until its original is deleted"""
+    text = "Intro line\n1. First:\n- " + "a" * 40 + "\n2. Second:\n- " + "b" * 340 + "\nRed flags:\n- " + "c" * 300
+    chunks = split_text_by_sections(text, 400, lambda section: [section])
+    assert [chunk.splitlines()[0] for chunk in chunks] == ["Intro line", "2. Second:", "Red flags:"]
+
+    with tempfile.TemporaryDirectory() as kb_path:
+        rag = create_test_rag(kb_path)
+        headache = rag.knowledge_store.load()[0]
+        chunks_before = rag.vector_store.index.ntotal
+        assert all(chunk.splitlines()[0].startswith(("Headaches", "1.", "2.", "3.", "4.", "Red flags"))
+                   for chunk in (rag.get_chunk(chunk_id).page_content for chunk_id in rag.manifest["documents"]
+                                 ["symptoms/Headache Types and Causes"]["chunks"]))
+
+        # Re-indented copy with a changed line
+        copy = headache["content"].replace("\n", "\n  ").replace("Feels like tight band", "Feels like a tight band")
+        rag.add_medical_document("Uploaded: headaches.txt", copy, "uploaded_document")
+        assert rag.vector_store.index.ntotal == chunks_before
+        left_out = rag.get_statistics()["chunking"]["near_duplicates_left_out"]
+        uploaded = rag.manifest["documents"]["uploaded_document/Uploaded: headaches.txt"]
+        assert left_out > 0 and left_out == len(uploaded["duplicates"]) and not uploaded["chunks"]
+
+        # The signatures are loaded with the store, so the next addition does not rebuild them
+        reopened = create_test_rag(kb_path)
+        assert len(reopened.dedup_index) == reopened.vector_store.index.ntotal
+        assert reopened.get_dedup_index() is reopened.dedup_index and reopened.dedup_index.find(copy)
+
+        # Deleting the original brings the uploaded copy's chunks into the index
+        rag.knowledge_store.delete([headache["id"]])
+        rag = create_test_rag(kb_path)
+        assert rag.get_statistics()["chunking"]["near_duplicates_left_out"] == 0
+        assert rag.vector_store.index.ntotal == manifest_chunk_count(rag.manifest)
+        results = rag.retrieve_relevant_info("tension headache tight band", min_similarity=-1.0)
+        assert any("a tight band" in doc["content"] for doc in results)
+        print("✅ Section chunking and near-duplicate removal work")
+
+def test_reranking_within_budget():
+    """The reranker reorders first-stage candidates, and first-stage order is kept when it is too slow"""
+    class KeywordReranker:
+        def __init__(self, delay=0.0):
+            self.delay = delay
+
+        def score(self, query, texts):
+            time.sleep(self.delay)
+            return [float("aloe" in text.lower()) for text in texts]
+
+    with tempfile.TemporaryDirectory() as kb_path:
+        rag = MedicalRAGSystem(kb_path, embeddings=DeterministicFakeEmbedding(size=32), reranker=KeywordReranker())
+        rag.add_medical_document("Sunburn Care", "Cool the skin and apply aloe vera gel.", "first_aid")
+        results = rag.retrieve_relevant_info("skin care", max_results=3, min_similarity=-1.0)
+        assert "aloe" in results[0]['content'] and results[0]['rerank_score'] == 1.0
+        assert rag.get_statistics()['reranker']['reranked'] == 1
+
+        rag.reranker = KeywordReranker(delay=0.5)
+        rag.rerank_budget = 0.05
+        started = time.monotonic()
+        fallback = rag.retrieve_relevant_info("headache relief", max_results=3, min_similarity=-1.0)
+        assert time.monotonic() - started < 0.4
+        assert all('rerank_score' not in result for result in fallback)
+        assert rag.rerank_counts['budget_exceeded'] == 1
+        assert len(rag.result_cache) == 1
+    print("✅ Reranking works")
+
+def test_retrieval_benchmark_smoke():
+    """The benchmark is deterministic offline, exact search has full recall and records are JSON-ready"""
+    embeddings = HashingEmbeddings(64)
+    assert embeddings.embed_query("fever and cough") == HashingEmbeddings(64).embed_query("fever and cough")
+
+    results = run_benchmarks([500], ["flat", "hnsw"], n_queries=10, k=5, dim=64, system_max_size=500)
+    index_results = [result for result in results if result["benchmark"] == "index"]
+    system_results = [result for result in results if result["benchmark"] == "system"]
+    assert [result["index_type"] for result in index_results] == ["flat", "hnsw"]
+    assert index_results[0]["recall_at_k"] == 1.0
+    assert {result["retrieval_mode"] for result in system_results} == {"dense", "hybrid"}
+    for result in results:
+        assert result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"]
+    json.loads(json.dumps(results))
+    print("✅ Retrieval benchmark works")
+
+if __name__ == "__main__":
+    test_add_document_is_incremental()
+    test_index_checkpoints_append_chunks()
+    test_manifest_sync_after_external_edit()
+    test_rebuild_reuses_cached_embeddings()
+    test_embedding_cache_shared_by_processes()
+    test_query_cache_invalidated_by_new_documents()
+    test_keyword_search_uses_bm25_index()
+    test_hybrid_search_fuses_and_survives_slow_leg()
+    test_scored_retrieval_and_context_budget()
+    test_index_factory_types()
+    test_memory_mapped_loading()
+    test_pickle_docstore_migration()
+    test_category_filtered_retrieval()
+    test_bulk_ingestion_is_resumable()
+    test_bulk_ingestion_checkpoints()
+    test_knowledge_log_and_compaction()
+    test_embedding_backend_parity_and_identity()
+    test_snapshot_opens_without_embedding()
+    test_section_chunking_and_near_duplicates()
+    test_reranking_within_budget()
+    test_retrieval_benchmark_smoke()
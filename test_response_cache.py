@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Test script for the semantic response cache
+Covers similarity matching, invalidation and opt-outs, and reuse through /api/chat
+"""
+
+import os
+import time
+
+import numpy as np
+
+from response_cache import SemanticResponseCache, has_red_flags
+from schema import SymptomResponse
+
+def unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+def answer(severity="mild"):
+    return SymptomResponse(probable_cause="Tension headache", severity=severity, advice="Rest and hydrate")
+
+def test_similarity_version_and_severity():
+    """Near queries hit, other kb versions and severe answers never do, stats count it all"""
+    cache = SemanticResponseCache(maxsize=2, ttl=None, threshold=0.95)
+    cache.store(unit([1, 0, 0]), 1, answer())
+
+    assert cache.lookup(unit([1, 0.1, 0]), 1).probable_cause == "Tension headache"
+    assert cache.lookup(unit([0, 1, 0]), 1) is None
+    assert cache.lookup(unit([1, 0, 0]), 2) is None
+
+    assert not cache.store(unit([0, 0, 1]), 1, answer("Severe"))
+    assert cache.lookup(unit([0, 0, 1]), 1) is None
+
+    cache.store(unit([0, 1, 0]), 1, answer())
+    cache.store(unit([0, 1, 1]), 1, answer())
+    assert len(cache) == 2 and cache.lookup(unit([1, 0, 0]), 1) is None
+
+    stats = cache.get_statistics()
+    assert (stats["hits"], stats["misses"], stats["skipped"], stats["evictions"]) == (1, 4, 1, 1)
+    assert stats["hit_rate"] == 0.2
+
+    expiring = SemanticResponseCache(ttl=0.05)
+    expiring.store(unit([1, 0]), 1, answer())
+    time.sleep(0.1)
+    assert expiring.lookup(unit([1, 0]), 1) is None and len(expiring) == 0
+    print("✅ Semantic response cache works")
+
+def test_red_flags_bypass_cache():
+    """A severe-sounding paraphrase of a cached mild question gets a fresh answer"""
+    cache = SemanticResponseCache(maxsize=4, ttl=None, threshold=0.95)
+    assert cache.store(unit([0, 1, 0]), 1, answer(), query="my head hurts")
+    assert cache.lookup(unit([0, 1, 0.05]), 1, query="my head hurts a lot").probable_cause == "Tension headache"
+    assert cache.lookup(unit([0, 1, 0.05]), 1, query="sudden severe headache, worst of my life") is None
+    assert not cache.store(unit([0, 0, 1]), 1, answer(), query="crushing pain and numbness in my arm")
+
+    assert has_red_flags("Fever of 104 and a stiff neck") and has_red_flags("I can't breathe properly")
+    assert not has_red_flags("runny nose and sneezing for two days")
+    stats = cache.get_statistics()
+    assert (stats["hits"], stats["red_flag_bypasses"], stats["skipped"]) == (1, 1, 1)
+    print("✅ Red-flag queries bypass the response cache")
+
+def test_exact_query_keys():
+    """Without query vectors only exact repeats (after normalization) hit"""
+    cache = SemanticResponseCache(maxsize=4, ttl=None, threshold=0.95)
+    assert cache.store(None, "model", answer(), query="My head hurts")
+    assert cache.lookup(None, "model", query="  my head HURTS?").probable_cause == "Tension headache"
+    assert cache.lookup(None, "model", query="my head is hurting") is None
+    assert cache.lookup(None, "other-model", query="my head hurts") is None
+    # Exact entries never answer a semantic lookup, or the other way round
+    assert cache.lookup(unit([1, 0]), "model", query="my head hurts") is None
+    assert not cache.store(None, "model", answer())
+    print("✅ Exact-match response cache works")
+
+def test_chat_reuses_cached_answer():
+    """A paraphrase skips the LLM; adding knowledge invalidates it"""
+    os.environ['RAG_WARMUP'] = 'lazy'
+    try:
+        import main_rag
+    finally:
+        del os.environ['RAG_WARMUP']
+
+    state = {"kb_version": 0, "llm_calls": 0}
+    vectors = {"my head hurts": unit([1, 0.05]), "my head is hurting": unit([1, 0.08])}
+    original = (main_rag.embed_medical_query, main_rag.route_medical_query, main_rag.llm.invoke,
+                main_rag.convert_text_to_speech)
+
+    def invoke(prompt, categories=None):
+        state["llm_calls"] += 1
+        return {"probable_cause": "Tension headache", "severity": "mild", "advice": "Rest"}
+
+    main_rag.embed_medical_query = lambda query: (vectors[query], state["kb_version"])
+    main_rag.route_medical_query = lambda query, include_uploads=False: None
+    main_rag.llm.invoke = invoke
+    main_rag.convert_text_to_speech = lambda text, session_id: None
+    main_rag.response_cache.clear()
+    client = main_rag.app.test_client()
+    try:
+        first = client.post('/api/chat', json={'message': "my head hurts"}).get_json()['response']
+        second = client.post('/api/chat', json={'message': "my head is hurting"}).get_json()['response']
+        assert not first['cached'] and second['cached'] and state["llm_calls"] == 1
+        assert second['probable_cause'] == first['probable_cause']
+
+        state["kb_version"] = 1
+        third = client.post('/api/chat', json={'message': "my head is hurting"}).get_json()['response']
+        assert not third['cached'] and state["llm_calls"] == 2
+
+        stats = client.get('/api/cache/status').get_json()['statistics']
+        assert stats['hits'] == 1 and stats['misses'] == 2
+    finally:
+        (main_rag.embed_medical_query, main_rag.route_medical_query, main_rag.llm.invoke,
+         main_rag.convert_text_to_speech) = original
+        main_rag.response_cache.clear()
+    print("✅ Chat reuses cached answers")
+
+if __name__ == "__main__":
+    test_similarity_version_and_severity()
+    test_red_flags_bypass_cache()
+    test_exact_query_keys()
+    test_chat_reuses_cached_answer()
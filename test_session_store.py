@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Test script for the chat session store
+Checks the message limit, byte cap, idle expiry, concurrent access and the
+shared SQLite and Redis backends
+"""
+
+import os
+import time
+import tempfile
+import threading
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from session_store import (RedisSessionStore, SessionBackend, SessionStore, SQLiteSessionStore,
+                           create_session_store, message_bytes)
+
+def test_limits_and_eviction():
+    """Sessions are trimmed to the message limit and evicted by size (LRU) and idleness"""
+    store = SessionStore(max_bytes=10 * message_bytes("x" * 100), idle_ttl=None, max_messages=4, stripes=1)
+    for i in range(6):
+        store.append("a", f"message {i}")
+    assert store.get("a") == [f"message {i}" for i in range(2, 6)]
+    assert store.get_statistics()["evictions"]["trimmed_messages"] == 2
+
+    store = SessionStore(max_bytes=10 * message_bytes("x" * 100), idle_ttl=None, max_messages=100, stripes=1)
+    store.append("a", "x" * 100)
+    store.append("b", "x" * 100)
+    store.get("a")
+    for i in range(9):
+        store.append("c", "x" * 100)
+    assert "b" not in store and "a" in store
+    stats = store.get_statistics()
+    assert stats["bytes"] <= stats["max_bytes"] and stats["evictions"]["lru"] == 1
+
+    idle = SessionStore(idle_ttl=0.05)
+    idle.append("old", "hello")
+    time.sleep(0.1)
+    idle.append("new", "hi")
+    assert "old" not in idle and idle.get("old") == [] and len(idle) == 1
+    assert idle.get_statistics()["evictions"]["idle"] == 1
+    print("✅ Session limits work")
+
+def test_concurrent_appends():
+    """Threads appending to many sessions never lose or corrupt messages"""
+    store = SessionStore(max_messages=1000, stripes=8)
+
+    def worker(n):
+        for i in range(200):
+            store.append(f"session-{(n + i) % 20}", f"{n}:{i}")
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = store.get_statistics()
+    assert stats["sessions"] == 20 and stats["messages"] == 8 * 200
+    assert stats["bytes"] == sum(message_bytes(m) for i in range(20) for m in store.get(f"session-{i}"))
+    print("✅ Concurrent session access works")
+
+class LocalRedis:
+    """Stand-in for a Redis server: the list, expiry and scan commands the session store uses"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lists = {}
+        self.expires = {}
+
+    def _live(self, key):
+        if key in self.expires and self.expires[key] <= time.time():
+            self.lists.pop(key, None)
+            self.expires.pop(key, None)
+        return self.lists.get(key)
+
+    def rpush(self, key, *values):
+        self._live(key)
+        self.lists.setdefault(key, []).extend(values)
+
+    def ltrim(self, key, start, end):
+        values = self._live(key) or []
+        self.lists[key] = values[start:len(values) + end + 1 if end < 0 else end + 1]
+
+    def lrange(self, key, start, end):
+        values = self._live(key) or []
+        return list(values[start:len(values) + end + 1 if end < 0 else end + 1])
+
+    def expire(self, key, seconds):
+        if self._live(key) is not None:
+            self.expires[key] = time.time() + seconds
+
+    def get(self, key):
+        return self._live(key)
+
+    def set(self, key, value):
+        self.lists[key] = value
+        self.expires.pop(key, None)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.lists.pop(key, None)
+
+    def exists(self, key):
+        return int(self._live(key) is not None)
+
+    def scan_iter(self, match, count=None):
+        return [key for key in list(self.lists) if key.startswith(match.rstrip('*')) and self._live(key)]
+
+    def pipeline(self, transaction=True):
+        redis = self
+        calls = []
+
+        class Pipeline:
+            def __getattr__(self, name):
+                return lambda *args: calls.append((name, args))
+
+            def execute(self):
+                with redis.lock:
+                    return [getattr(redis, name)(*args) for name, args in calls]
+
+        return Pipeline()
+
+    def transaction(self, func, *watches, value_from_callable=False):
+        """Runs func with immediate commands until multi(), then queued ones, all under the lock (as WATCH would)"""
+        redis = self
+        calls = []
+
+        class Transaction:
+            queued = False
+
+            def multi(self):
+                self.queued = True
+
+            def __getattr__(self, name):
+                def command(*args):
+                    if self.queued:
+                        calls.append((name, args))
+                    else:
+                        return getattr(redis, name)(*args)
+                return command
+
+        with self.lock:
+            value = func(Transaction())
+            results = [getattr(self, name)(*args) for name, args in calls]
+        return value if value_from_callable else results
+
+def test_shared_backends():
+    """SQLite and Redis stores share sessions between workers and keep message roles"""
+    turn = [HumanMessage(content="I have a headache ☹"), AIMessage(content="How long has it lasted?")]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sessions.db")
+        workers = [SQLiteSessionStore(path, max_messages=4, sweep_interval=0) for _ in range(2)]
+        workers[0].append("a", *turn)
+        history = workers[1].get("a")
+        assert [(type(m), m.content) for m in history] == [(type(m), m.content) for m in turn]
+
+        def worker(n):
+            for i in range(20):
+                workers[n % 2].append(f"session-{i % 5}", f"{n}:{i}")
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = workers[0].get_statistics()
+        assert stats["backend"] == "sqlite" and stats["sessions"] == 6 and stats["messages"] == 2 + 5 * 4
+        assert all(len(workers[1].get(f"session-{i}")) == 4 for i in range(5))
+
+        capped = SQLiteSessionStore(path, max_bytes=workers[0].get_statistics()["bytes"] // 2, sweep_interval=0)
+        capped.append("a", "latest")
+        assert "a" in capped and len(capped) < 6 and capped.get_statistics()["evictions"]["lru"] > 0
+
+        idle = SQLiteSessionStore(os.path.join(tmp, "idle.db"), idle_ttl=0.05)
+        idle.append("old", "hello")
+        time.sleep(0.1)
+        assert "old" not in idle and idle.get("old") == []
+
+    server = LocalRedis()
+    nodes = [RedisSessionStore(server, max_messages=3) for _ in range(2)]
+    nodes[0].append("a", *turn)
+    nodes[1].append("a", "plain", HumanMessage(content="Still there"))
+    history = nodes[0].get("a")
+    assert [m if isinstance(m, str) else m.content for m in history] == ["How long has it lasted?", "plain", "Still there"]
+    assert isinstance(history[0], AIMessage) and "a" in nodes[1] and len(nodes[1]) == 1
+    nodes[1].delete("a")
+    assert nodes[0].get("a") == [] and nodes[0].get_statistics()["sessions"] == 0
+    print("✅ Shared session backends work")
+
+def test_summary_fold_on_every_backend():
+    """Folding swaps only the messages it read, and trimming never drops the summary"""
+    with tempfile.TemporaryDirectory() as tmp:
+        stores = [SessionStore(max_messages=3), SQLiteSessionStore(os.path.join(tmp, "s.db"), max_messages=3),
+                  RedisSessionStore(LocalRedis(), max_messages=3)]
+        for store in stores:
+            store.append("s", HumanMessage(content="q1"), AIMessage(content="a1"))
+            folded = store.get("s")
+            # A parallel request appends while the summary is being written
+            store.append("s", HumanMessage(content="q2"))
+            assert store.compare_and_replace("s", folded, [SystemMessage(content="summary 1")])
+            assert [m.content for m in store.get("s")] == ["summary 1", "q2"]
+            # Another request already folded these messages: nothing changes
+            assert not store.compare_and_replace("s", folded, [SystemMessage(content="stale")])
+
+            store.append("s", AIMessage(content="a2"), HumanMessage(content="q3"), AIMessage(content="a3"))
+            history = store.get("s")
+            assert history[0].type == "system" and [m.content for m in history] == ["summary 1", "a2", "q3", "a3"]
+            assert len(store) == 1
+    print("✅ Summary folding works on every backend")
+
+def test_backend_interface_and_fallback():
+    """Backends must implement the whole interface; a failed shared backend is reported"""
+    class Incomplete(SessionBackend):
+        def get(self, session_id):
+            return []
+
+    try:
+        Incomplete()
+        assert False, "an incomplete backend must not instantiate"
+    except TypeError as e:
+        assert "replace" in str(e)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['CHAT_SESSION_BACKEND'] = 'sqlite'
+        # A directory cannot be opened as a database
+        os.environ['CHAT_SESSION_DB'] = tmp
+        try:
+            store = create_session_store()
+        finally:
+            del os.environ['CHAT_SESSION_BACKEND'], os.environ['CHAT_SESSION_DB']
+    stats = store.get_statistics()
+    assert stats["backend"] == "memory" and stats["fallback"]["requested_backend"] == "sqlite"
+    assert stats["fallback"]["error"].startswith("SQLite session store unavailable")
+    print("✅ Session backend interface and fallback reporting work")
+
+def test_sessions_status_endpoint():
+    """The chat apps report the session store"""
+    os.environ['RAG_WARMUP'] = 'lazy'
+    try:
+        import main_rag
+    finally:
+        del os.environ['RAG_WARMUP']
+    main_rag.chat_sessions.touch("status-check")
+    stats = main_rag.app.test_client().get('/api/sessions/status').get_json()
+    assert stats["sessions"] >= 1 and "evictions" in stats
+    print("✅ Session status endpoint works")
+
+if __name__ == "__main__":
+    test_limits_and_eviction()
+    test_concurrent_appends()
+    test_shared_backends()
+    test_summary_fold_on_every_backend()
+    test_backend_interface_and_fallback()
+    test_sessions_status_endpoint()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Test script for application startup
+Checks that importing the app stays cheap and that readiness follows the RAG warm-up
+"""
+
+import os
+
+from import_report import measure_imports, summarize
+
+HEAVY_MODULES = {"rag_system", "faiss", "torch", "sentence_transformers", "PIL", "PyPDF2", "docx", "gtts", "langchain"}
+
+def test_main_rag_imports_lazily():
+    """Importing main_rag does not load the RAG stack or the file/audio libraries"""
+    imports = measure_imports("main_rag", {"RAG_WARMUP": "lazy"})
+    loaded = {item["module"] for item in imports}
+    assert not loaded & HEAVY_MODULES, loaded & HEAVY_MODULES
+
+    report = summarize("main_rag", imports)
+    assert report["total_ms"] > 0 and report["slowest"]
+    print(f"✅ main_rag imports in {report['total_ms']} ms")
+
+def test_health_and_readiness_endpoints():
+    """/healthz is always up; /readyz is 503 only while the warm-up runs"""
+    os.environ['RAG_WARMUP'] = 'lazy'
+    try:
+        import main_rag
+    finally:
+        del os.environ['RAG_WARMUP']
+    client = main_rag.app.test_client()
+
+    assert client.get('/healthz').status_code == 200
+    assert client.get('/readyz').status_code == 200
+
+    main_rag.warmup_state['status'] = 'pending'
+    try:
+        response = client.get('/readyz')
+        assert response.status_code == 503 and response.get_json()['ready'] is False
+
+        # A failed warm-up still serves the fallback, so the instance stays in rotation
+        main_rag.warmup_state.update(status='failed', error='model download failed')
+        response = client.get('/readyz')
+        assert response.status_code == 200 and response.get_json()['rag']['status'] == 'failed'
+    finally:
+        main_rag.warmup_state['error'] = None
+        main_rag.warmup_state['status'] = 'lazy'
+    print("✅ Health endpoints work")
+
+if __name__ == "__main__":
+    test_main_rag_imports_lazily()
+    test_health_and_readiness_endpoints()
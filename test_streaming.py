@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Test script for streamed chat responses
+Checks token deltas from streamed tool-call arguments and the SSE chat endpoint
+"""
+
+import os
+import json
+from typing import List
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from consultation import create_consultation_chain, stream_consult
+
+def parse_sse(body: str):
+    """(event, data) pairs of an SSE body, skipping comments"""
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if lines:
+            events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+class ToolCallStreamingModel(BaseChatModel):
+    """Stand-in chat model that streams one tool call's JSON arguments in small pieces"""
+
+    pieces: List[str]
+
+    @property
+    def _llm_type(self) -> str:
+        return "tool-call-streaming"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        for position, piece in enumerate(self.pieces):
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[{
+                "name": "SymptomAssessment" if position == 0 else None,
+                "args": piece, "id": "call_1" if position == 0 else None, "index": 0
+            }]))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        message = AIMessage(content="", tool_calls=[{
+            "name": "SymptomAssessment", "args": json.loads("".join(self.pieces)), "id": "call_1"
+        }])
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+def test_stream_consult_deltas():
+    """Tool-call argument deltas become token events as they arrive, before the other fields exist"""
+    arguments = json.dumps({"probable_cause": "Likely a tension headache", "advice": "Rest and hydrate",
+                            "severity": "Mild", "log_status": "ok", "audio_response": "/etc/passwd"})
+    pieces = [arguments[i:i + 5] for i in range(0, len(arguments), 5)]
+    chain = create_consultation_chain(ToolCallStreamingModel(pieces=pieces), "System prompt")
+    stream = stream_consult(chain, "My head hurts", [])
+    events = []
+    try:
+        while True:
+            events.append(next(stream))
+    except StopIteration as stop:
+        response = stop.value
+
+    cause = [data for _, data in events if data["field"] == "probable_cause"]
+    advice = [data for _, data in events if data["field"] == "advice"]
+    # probable_cause streams in several pieces while advice and severity have not been generated yet
+    assert len(cause) > 2 and events.index(("token", advice[0])) == len(cause)
+    assert "".join(data["text"] for data in cause) == "Likely a tension headache"
+    assert len(advice) > 1 and "".join(data["text"] for data in advice) == "Rest and hydrate"
+    assert response.advice == "Rest and hydrate" and response.severity == "mild"
+    assert response.audio_response is None and response.log_status == ""
+    print("✅ Streamed consultation deltas work")
+
+def test_chat_stream_endpoint():
+    """The RAG app streams retrieval, tokens, the final fields and audio, in order"""
+    os.environ['RAG_WARMUP'] = 'lazy'
+    try:
+        import main_rag
+    finally:
+        del os.environ['RAG_WARMUP']
+
+    original = (main_rag.route_medical_query, main_rag.get_medical_context, main_rag.convert_text_to_speech)
+    main_rag.route_medical_query = lambda query, include_uploads=False: None
+    main_rag.get_medical_context = lambda query, categories=None: "Headache guidance"
+    main_rag.convert_text_to_speech = lambda text, session_id: "static/audio/answer.mp3"
+    try:
+        reply = main_rag.app.test_client().post('/api/chat/stream', json={'message': "I have a migraine"})
+        assert reply.mimetype == 'text/event-stream'
+        events = parse_sse(reply.get_data(as_text=True))
+    finally:
+        main_rag.route_medical_query, main_rag.get_medical_context, main_rag.convert_text_to_speech = original
+
+    names = [event for event, _ in events]
+    assert names[0] == "retrieval" and names[-3:] == ["final", "audio", "done"] and "token" in names
+    assert events[0][1]["rag_enhanced"] is True
+    final = events[-3][1]
+    streamed = "".join(data["text"] for event, data in events if event == "token" and data["field"] == "advice")
+    assert streamed == final["advice"] and final["severity"] == "moderate"
+    assert events[-2][1]["audio_response"] == "static/audio/answer.mp3"
+    print("✅ Chat stream endpoint works")
+
+if __name__ == "__main__":
+    test_stream_consult_deltas()
+    test_chat_stream_endpoint()
@@ -0,0 +1,31 @@
+"""
+Text helpers shared by the retrieval components
+"""
+
+import re
+
+def normalize_query(query: str) -> str:
+    """Canonical form of a user query used as a cache key"""
+    query = re.sub(r'\s+', ' ', query.strip().lower())
+    return query.rstrip('.?!')
+
+STOPWORDS = {
+    "the", "and", "for", "with", "are", "was", "you", "your", "have", "has", "had",
+    "this", "that", "what", "can", "not", "but", "from", "they", "will", "how",
+    "should", "about", "been", "into", "its", "our", "there", "when", "which", "who"
+}
+
+def tokenize(text: str) -> list:
+    """Lowercased word tokens for keyword search, skipping very short words and stopwords"""
+    return [token for token in re.findall(r"[a-z0-9]+", text.lower())
+            if len(token) > 2 and token not in STOPWORDS]
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count (about four characters per token for English text)"""
+    return (len(text) + 3) // 4
+
+def jaccard_similarity(tokens_a: set, tokens_b: set) -> float:
+    """Overlap of two token sets, from 0 (disjoint) to 1 (identical)"""
+    if not tokens_a or not tokens_b:
+        return 0.0
+    return len(tokens_a & tokens_b) / len(tokens_a | tokens_b)
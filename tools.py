@@ -1,12 +1,9 @@
 import os
 import json
 from datetime import datetime
-from langchain.tools import Tool
-from PIL import Image
-import PyPDF2
-from docx import Document
+# LangChain, PIL, PyPDF2, python-docx and gTTS are imported where they are
+# used, so importing these helpers stays cheap
 # import speech_recognition as sr  # Removed for cloud deployment
-from gtts import gTTS
 import io
 import base64
 
@@ -47,12 +44,14 @@ def process_uploaded_file(file_path: str):
         
         if file_extension in ['.jpg', '.jpeg', '.png', '.gif', '.bmp']:
             # Process image file
+            from PIL import Image
             with Image.open(file_path) as img:
                 # Basic image analysis
                 return f"Image processed: {img.size[0]}x{img.size[1]} pixels, format: {img.format}"
                 
         elif file_extension == '.pdf':
             # Process PDF file
+            import PyPDF2
             with open(file_path, 'rb') as file:
                 pdf_reader = PyPDF2.PdfReader(file)
                 text_content = ""
@@ -62,6 +61,7 @@ def process_uploaded_file(file_path: str):
                 
         elif file_extension in ['.doc', '.docx']:
             # Process Word document
+            from docx import Document
             doc = Document(file_path)
             text_content = ""
             for paragraph in doc.paragraphs:
@@ -93,6 +93,7 @@ def convert_text_to_speech(text: str, session_id: str):
         audio_filename = f"response_{session_id}_{timestamp}.mp3"
         audio_path = f"static/audio/{audio_filename}"
         
+        from gtts import gTTS
         tts = gTTS(text=text, lang='en', slow=False)
         tts.save(audio_path)
         
@@ -100,30 +101,40 @@ def convert_text_to_speech(text: str, session_id: str):
     except Exception as e:
         return f"Error converting text to speech: {str(e)}"
 
-tools = [
-    Tool(
-        name="log_symptom_entry",
-        func=log_symptom_entry,
-        description="Log user's symptom consultation with timestamp and details"
-    ),
-    Tool(
-        name="get_medical_resources",
-        func=get_medical_resources,
-        description="Get emergency contacts and medical resource information"
-    ),
-    Tool(
-        name="process_uploaded_file",
-        func=process_uploaded_file,
-        description="Process uploaded files (images, PDFs, documents) and extract information"
-    ),
-    Tool(
-        name="convert_speech_to_text",
-        func=convert_speech_to_text,
-        description="Convert speech audio to text"
-    ),
-    Tool(
-        name="convert_text_to_speech",
-        func=convert_text_to_speech,
-        description="Convert text response to speech audio"
-    )
-]
+def create_tools():
+    """LangChain tool wrappers for the agent"""
+    from langchain.tools import Tool
+    return [
+        Tool(
+            name="log_symptom_entry",
+            func=log_symptom_entry,
+            description="Log user's symptom consultation with timestamp and details"
+        ),
+        Tool(
+            name="get_medical_resources",
+            func=get_medical_resources,
+            description="Get emergency contacts and medical resource information"
+        ),
+        Tool(
+            name="process_uploaded_file",
+            func=process_uploaded_file,
+            description="Process uploaded files (images, PDFs, documents) and extract information"
+        ),
+        Tool(
+            name="convert_speech_to_text",
+            func=convert_speech_to_text,
+            description="Convert speech audio to text"
+        ),
+        Tool(
+            name="convert_text_to_speech",
+            func=convert_text_to_speech,
+            description="Convert text response to speech audio"
+        )
+    ]
+
+def __getattr__(name):
+    # `from tools import tools` builds the tool list on first access
+    if name == "tools":
+        globals()["tools"] = create_tools()
+        return globals()["tools"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
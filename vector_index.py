@@ -0,0 +1,190 @@
+"""
+FAISS index factory for the RAG vector store
+Builds flat, IVF-Flat, IVF-PQ or HNSW indexes and manages their search-time tuning
+"""
+
+import os
+import json
+import math
+from typing import Dict, Optional
+
+import numpy as np
+
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+INDEX_PARAMS_FILENAME = "index_params.json"
+
+# FAISS wants roughly this many training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+def get_index_settings() -> Dict:
+    """Index build settings from the environment"""
+    index_type = os.getenv('RAG_INDEX_TYPE', 'flat').lower()
+    if index_type not in INDEX_TYPES:
+        print(f"⚠️ Unknown RAG_INDEX_TYPE '{index_type}', using flat")
+        index_type = 'flat'
+    return {
+        "type": index_type,
+        "nlist": int(os.getenv('RAG_IVF_NLIST', '0')),  # 0 = about 4 * sqrt(vectors)
+        "pq_m": int(os.getenv('RAG_PQ_M', '16')),
+        "pq_nbits": int(os.getenv('RAG_PQ_NBITS', '8')),
+        "hnsw_m": int(os.getenv('RAG_HNSW_M', '32')),
+        "ef_construction": int(os.getenv('RAG_HNSW_EF_CONSTRUCTION', '80')),
+        "train_sample": int(os.getenv('RAG_TRAIN_SAMPLE', '50000'))
+    }
+
+def get_search_params() -> Dict:
+    """Search-time tuning from the environment (None means keep the persisted value)"""
+    nprobe = os.getenv('RAG_NPROBE')
+    ef_search = os.getenv('RAG_EF_SEARCH')
+    return {
+        "nprobe": int(nprobe) if nprobe else None,
+        "ef_search": int(ef_search) if ef_search else None
+    }
+
+def _pq_subquantizers(dim: int, requested: int) -> int:
+    """Largest number of PQ sub-quantizers not above the request that divides dim"""
+    for m in range(min(requested, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+def _nlist(settings: Dict, n_vectors: int) -> int:
+    return settings["nlist"] or max(1, int(4 * math.sqrt(n_vectors)))
+
+def min_training_points(settings: Dict, n_vectors: int) -> int:
+    """Vectors needed to train the configured index at this size (0 when it needs no training)"""
+    if settings["type"] not in ("ivf_flat", "ivf_pq"):
+        return 0
+    min_points = MIN_POINTS_PER_CENTROID * _nlist(settings, n_vectors)
+    if settings["type"] == "ivf_pq":
+        min_points = max(min_points, MIN_POINTS_PER_CENTROID * (2 ** settings["pq_nbits"]))
+    return min_points
+
+def create_index(settings: Dict, vectors: np.ndarray):
+    """Create (and train, if needed) an empty index for vectors like the given ones
+
+    Returns the index and the parameters actually used, which may fall back to
+    a flat index when there are too few vectors to train on.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n_vectors, dim = vectors.shape
+    index_type = settings["type"]
+    params = {"type": index_type}
+
+    if index_type in ("ivf_flat", "ivf_pq"):
+        nlist = _nlist(settings, n_vectors)
+        min_points = min_training_points(settings, n_vectors)
+        if n_vectors < min_points:
+            print(f"⚠️ {n_vectors} vectors are too few to train {index_type} (need {min_points}), using flat index")
+            index_type = "flat"
+            params = {"type": "flat"}
+
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dim), params
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, settings["hnsw_m"])
+        index.hnsw.efConstruction = settings["ef_construction"]
+        params.update({"hnsw_m": settings["hnsw_m"], "ef_search": index.hnsw.efSearch})
+        return index, params
+
+    quantizer = faiss.IndexFlatL2(dim)
+    if index_type == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+    else:
+        m = _pq_subquantizers(dim, settings["pq_m"])
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, m, settings["pq_nbits"])
+        params.update({"pq_m": m, "pq_nbits": settings["pq_nbits"]})
+
+    # Train the coarse quantizer (and PQ codebooks) on a random sample
+    sample_size = min(n_vectors, max(settings["train_sample"], min_points))
+    sample = vectors[np.random.default_rng(0).choice(n_vectors, sample_size, replace=False)]
+    index.train(sample)
+
+    params.update({"nlist": nlist, "nprobe": min(8, nlist), "trained_on": sample_size})
+    return index, params
+
+def supports_remove(index) -> bool:
+    """HNSW graphs cannot delete vectors in place"""
+    return not isinstance(index, faiss.IndexHNSW)
+
+def apply_search_params(index, params: Dict):
+    """Apply nprobe / efSearch to an index"""
+    if params.get("nprobe"):
+        try:
+            faiss.extract_index_ivf(index).nprobe = params["nprobe"]
+        except RuntimeError:
+            pass
+    if params.get("ef_search") and isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = params["ef_search"]
+
+def filtered_search_params(index, positions: np.ndarray):
+    """Search parameters restricting an index to the given vector positions
+
+    Carries over the index's own nprobe / efSearch, since passing parameters
+    replaces them. The returned params reference the selector, so keep both.
+    """
+    selector = faiss.IDSelectorBatch(np.ascontiguousarray(positions, dtype=np.int64))
+    if isinstance(index, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = index.hnsw.efSearch
+    else:
+        try:
+            ivf = faiss.extract_index_ivf(index)
+            params = faiss.SearchParametersIVF()
+            params.nprobe = ivf.nprobe
+        except RuntimeError:
+            params = faiss.SearchParameters()
+    params.sel = selector
+    return params, selector
+
+def describe_index(index, params: Optional[Dict] = None) -> Dict:
+    """Type, size and estimated memory footprint of an index"""
+    params = params or {}
+    dim = index.d
+    n_vectors = index.ntotal
+
+    if isinstance(index, faiss.IndexHNSW):
+        # Level-0 neighbour lists dominate the graph overhead
+        memory = n_vectors * (dim * 4 + 2 * params.get("hnsw_m", 32) * 4)
+    else:
+        try:
+            ivf = faiss.extract_index_ivf(index)
+            centroids = ivf.nlist * dim * 4
+            if isinstance(ivf, faiss.IndexIVFPQ):
+                memory = n_vectors * (ivf.pq.code_size + 8) + centroids + (2 ** ivf.pq.nbits) * dim * 4
+            else:
+                memory = n_vectors * (dim * 4 + 8) + centroids
+        except RuntimeError:
+            memory = n_vectors * dim * 4
+
+    return {
+        "type": params.get("type", "flat"),
+        "vectors": n_vectors,
+        "dimensions": dim,
+        "memory_mb": round(memory / (1024 * 1024), 2),
+        "nprobe": params.get("nprobe"),
+        "ef_search": params.get("ef_search")
+    }
+
+def load_index_params(vector_store_path: str) -> Dict:
+    """Persisted index type and search tuning"""
+    params_file = os.path.join(vector_store_path, INDEX_PARAMS_FILENAME)
+    if not os.path.exists(params_file):
+        return {"type": "flat"}
+    with open(params_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_index_params(vector_store_path: str, params: Dict):
+    """Persist index type and search tuning atomically"""
+    params_file = os.path.join(vector_store_path, INDEX_PARAMS_FILENAME)
+    tmp_file = f"{params_file}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(params, f, indent=2)
+    os.replace(tmp_file, params_file)
@@ -0,0 +1,135 @@
+"""
+Vector store manifest for the RAG knowledge base
+Records content hashes of every indexed document and chunk so the persisted
+FAISS index can be diffed against medical_knowledge.json
+"""
+
+import os
+import json
+import hashlib
+from datetime import datetime
+from typing import Dict, List, Optional
+
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+def content_hash(text: str) -> str:
+    """Stable SHA-256 hash of a piece of text"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def document_hash(item: Dict) -> str:
+    """Hash of the fields of a knowledge base entry that affect indexing"""
+    return content_hash("\0".join([
+        item.get('category', ''),
+        item.get('title', ''),
+        item.get('content', '')
+    ]))
+
+def document_key(item: Dict, seen: set) -> str:
+    """Identify a knowledge base entry by category and title, numbering repeats"""
+    base_key = f"{item.get('category', 'unknown')}/{item.get('title', 'Untitled')}"
+    key = base_key
+    occurrence = 1
+    while key in seen:
+        occurrence += 1
+        key = f"{base_key}#{occurrence}"
+    seen.add(key)
+    return key
+
+def document_keys(medical_data: List[Dict]) -> List[str]:
+    """Keys for every entry of the knowledge base, in file order"""
+    seen = set()
+    return [document_key(item, seen) for item in medical_data]
+
+def chunk_ids(doc_key: str, chunk_texts: List[str]) -> List[str]:
+    """Content-derived ids for the chunks of one document"""
+    ids = []
+    seen = set()
+    for text in chunk_texts:
+        base_id = content_hash(f"{doc_key}\0{text}")[:24]
+        chunk_id = base_id
+        occurrence = 1
+        while chunk_id in seen:
+            occurrence += 1
+            chunk_id = f"{base_id}-{occurrence}"
+        seen.add(chunk_id)
+        ids.append(chunk_id)
+    return ids
+
+def new_manifest(index_config: Dict) -> Dict:
+    """Create an empty manifest for an index built with the given settings"""
+    return {
+        "version": MANIFEST_VERSION,
+        "index_config": index_config,
+        "updated": datetime.now().isoformat(),
+        "documents": {}
+    }
+
+def record_document(manifest: Dict, doc_key: str, item: Dict, ids: List[str], chunk_texts: List[str],
+                    duplicates: Optional[Dict[str, List[str]]] = None):
+    """Record the hash and indexed chunks of a document
+
+    duplicates maps chunks that were not indexed, being near copies of
+    indexed ones, to the chunks that stand in for them.
+    """
+    manifest["documents"][doc_key] = {
+        "hash": document_hash(item),
+        "category": item.get('category', 'unknown'),
+        "chunks": {chunk_id: content_hash(text) for chunk_id, text in zip(ids, chunk_texts)}
+    }
+    if duplicates:
+        manifest["documents"][doc_key]["duplicates"] = duplicates
+    manifest["updated"] = datetime.now().isoformat()
+
+def manifest_chunk_count(manifest: Dict) -> int:
+    """Number of chunks the manifest expects in the index"""
+    return sum(len(doc["chunks"]) for doc in manifest["documents"].values())
+
+def manifest_duplicate_count(manifest: Dict) -> int:
+    """Number of near-duplicate chunks left out of the index"""
+    return sum(len(doc.get("duplicates", {})) for doc in manifest["documents"].values())
+
+def load_manifest(vector_store_path: str) -> Optional[Dict]:
+    """Load the manifest stored next to the index, if there is a valid one"""
+    manifest_file = os.path.join(vector_store_path, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_file):
+        return None
+    try:
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+def save_manifest(vector_store_path: str, manifest: Dict):
+    """Write the manifest atomically"""
+    manifest_file = os.path.join(vector_store_path, MANIFEST_FILENAME)
+    tmp_file = f"{manifest_file}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_file, manifest_file)
+
+def diff_documents(manifest: Dict, medical_data: List[Dict]) -> Dict:
+    """Compare the manifest with the knowledge base entries"""
+    indexed = manifest["documents"]
+    current = {}
+    for key, item in zip(document_keys(medical_data), medical_data):
+        current[key] = item
+
+    added = [key for key in current if key not in indexed]
+    removed = [key for key in indexed if key not in current]
+    changed = [
+        key for key in current
+        if key in indexed and indexed[key]["hash"] != document_hash(current[key])
+    ]
+
+    return {
+        "added": added,
+        "changed": changed,
+        "removed": removed,
+        "unchanged": len(current) - len(added) - len(changed),
+        "items": current,
+        "in_sync": not (added or changed or removed)
+    }